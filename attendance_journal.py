@@ -0,0 +1,214 @@
+# attendance_journal.py
+"""
+Change journal for the attendance (employee_data) table, so payroll can
+recompute only the (employee, month) pairs whose attendance changed since they
+were finalized.
+
+- SQL mode: employee_data gets a ROWVERSION column (added on first use). SQL
+  Server bumps it on every insert and update, so writers need no changes.
+- CSV mode: attendance writers call record_change(), which appends
+  (version, employee_id, salary_month, source) to a write log. The version is
+  a microsecond timestamp (small enough to survive a float round trip when
+  salary_log.csv is read back with empty cells).
+
+Payroll takes current_version() *before* reading attendance and stores it in
+each salary row it writes (salary_log.source_version). A finalized pair is
+dirty when the journal holds a newer version for it. Rows finalized before
+tracking existed have no stamp and count as version 0. Deleting attendance
+rows in SQL leaves no rowversion behind; re-finalize the month after deletions.
+
+List dirty pairs from the command line:
+    python attendance_journal.py            # every finalized month
+    python attendance_journal.py 2025-07    # a single month
+"""
+import argparse
+import csv
+import os
+import threading
+import time
+
+import pandas as pd
+
+import config
+import attendance_log
+from config import ATTENDANCE_JOURNAL_SETTINGS, EMPLOYEE_DATA_TABLE, sql_connection
+
+JOURNAL_COLUMNS = ["version", "employee_id", "salary_month", "source"]
+
+_journal_lock = threading.Lock()
+_sql_tracking_ready = False
+
+
+def _journal_path():
+    return ATTENDANCE_JOURNAL_SETTINGS.get("csv_path", "data/attendance_changes.csv")
+
+
+def _clock_version():
+    return time.time_ns() // 1000
+
+
+def _version_column():
+    return ATTENDANCE_JOURNAL_SETTINGS.get("sql_column", "row_version")
+
+
+# ==================== WRITES (CSV mode) ====================
+
+def record_changes(changes, source=""):
+    """
+    Journal attendance writes; changes are (employee_id, date) pairs.
+    No-op in SQL mode, where the rowversion column tracks changes.
+    """
+    if config.USE_SQL:
+        return
+    version = _clock_version()
+    keys = {
+        (attendance_log.normalize_employee_id(employee_id), attendance_log.month_key(day))
+        for employee_id, day in changes
+        if pd.notna(day) and str(day).strip()
+    }
+    if not keys:
+        return
+
+    path = _journal_path()
+    with _journal_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            if is_new:
+                writer.writerow(JOURNAL_COLUMNS)
+            writer.writerows([version, employee_id, month, source] for employee_id, month in sorted(keys))
+
+
+def record_change(employee_id, day, source=""):
+    """Journal one attendance write for employee_id on day"""
+    record_changes([(employee_id, day)], source)
+
+
+def record_frame_changes(df, source=""):
+    """Journal every (employee_id, date_only) in an attendance DataFrame that was written"""
+    if df is None or df.empty or "employee_id" not in df.columns or "date_only" not in df.columns:
+        return
+    record_changes(zip(df["employee_id"], df["date_only"]), source)
+
+
+# ==================== SQL TRACKING ====================
+
+def ensure_sql_tracking(conn):
+    """Add the ROWVERSION column to employee_data once per process"""
+    global _sql_tracking_ready
+    if _sql_tracking_ready:
+        return
+    column = _version_column()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"IF COL_LENGTH('{EMPLOYEE_DATA_TABLE}', '{column}') IS NULL "
+            f"ALTER TABLE {EMPLOYEE_DATA_TABLE} ADD {column} ROWVERSION"
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+    _sql_tracking_ready = True
+
+
+def tracking_column():
+    """Name of the ROWVERSION column on employee_data"""
+    return _version_column()
+
+
+def drop_tracking_column(df):
+    """
+    employee_data rows without the ROWVERSION column (8 raw bytes nothing else
+    expects); apply to every SELECT * of the table before the frame is used
+    """
+    return df.drop(columns=[_version_column()], errors="ignore")
+
+
+# ==================== READS ====================
+
+def current_version():
+    """Stamp to store with salary rows; take it before reading attendance"""
+    if not config.USE_SQL:
+        return _clock_version()
+    with sql_connection() as conn:
+        ensure_sql_tracking(conn)
+        # Rows at or above MIN_ACTIVE_ROWVERSION may still be uncommitted
+        row = conn.cursor().execute("SELECT CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) - 1").fetchone()
+        return int(row[0])
+
+
+def change_versions(since=0):
+    """Latest change version per (employee_id, salary_month) newer than `since`"""
+    if config.USE_SQL:
+        column = _version_column()
+        month = "CONVERT(CHAR(7), date_only, 120)"
+        query = f"""
+            SELECT CAST(employee_id AS NVARCHAR(50)) AS employee_id, {month} AS salary_month,
+                   CAST(MAX({column}) AS BIGINT) AS version
+            FROM {EMPLOYEE_DATA_TABLE}
+            WHERE {column} > CAST(CAST(? AS BIGINT) AS BINARY(8)) AND date_only IS NOT NULL
+            GROUP BY employee_id, {month}
+        """
+        with sql_connection() as conn:
+            ensure_sql_tracking(conn)
+            changes = pd.read_sql(query, conn, params=[int(since)])
+    else:
+        path = _journal_path()
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=["employee_id", "salary_month", "version"])
+        with _journal_lock:
+            changes = pd.read_csv(path, dtype={"employee_id": str, "salary_month": str})
+        changes = changes[changes["version"] > since]
+
+    changes["employee_id"] = changes["employee_id"].map(attendance_log.normalize_employee_id)
+    return changes.groupby(["employee_id", "salary_month"], as_index=False)["version"].max()
+
+
+def dirty_keys(salary_log, months=None):
+    """
+    Finalized (employee_id, salary_month) pairs whose attendance changed after
+    they were computed, optionally limited to `months` ("YYYY-MM" strings).
+    employee_id is returned as stored in salary_log.
+    """
+    if salary_log.empty:
+        return []
+    stamps = pd.DataFrame({
+        "log_employee_id": salary_log["employee_id"].astype(str),
+        "employee_id": salary_log["employee_id"].map(attendance_log.normalize_employee_id),
+        "salary_month": salary_log["salary_month"].astype(str),
+        "source_version": pd.to_numeric(
+            salary_log.get("source_version", pd.Series(0, index=salary_log.index)), errors="coerce"
+        ).fillna(0).astype("int64"),
+    })
+    if months is not None:
+        stamps = stamps[stamps["salary_month"].isin(set(months))]
+    if stamps.empty:
+        return []
+    # A pair finalized twice is as fresh as its latest stamp
+    stamps = stamps.groupby(["employee_id", "salary_month"], as_index=False).agg(
+        log_employee_id=("log_employee_id", "last"), source_version=("source_version", "max")
+    )
+
+    changes = change_versions(since=stamps["source_version"].min())
+    merged = stamps.merge(changes, on=["employee_id", "salary_month"])
+    dirty = merged[merged["version"] > merged["source_version"]]
+    return sorted(zip(dirty["log_employee_id"], dirty["salary_month"]))
+
+
+def main():
+    from repository import read_table
+
+    parser = argparse.ArgumentParser(description="List finalized payroll entries whose attendance changed")
+    parser.add_argument("months", nargs="*", help="Months to check, YYYY-MM (default: all)")
+    args = parser.parse_args()
+
+    salary_log = read_table(config.SALARY_LOG_TABLE, missing_ok=True)
+    keys = dirty_keys(salary_log, months=args.months or None)
+    for employee_id, month in keys:
+        print(f"{month}  {employee_id}")
+    print(f"{len(keys)} entr{'y' if len(keys) == 1 else 'ies'} to recompute")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+# attendance_log.py
+"""
+Append-only, month-partitioned attendance storage for CSV mode.
+
+Instead of rewriting data/employee_data.csv on every punch, each punch is one
+line appended to its month's event file:
+
+    data/attendance/2025-07.events.csv   check_in / check_out / row events, append-only
+    data/attendance/2025-07.csv          daily rows, written only by compact_month()
+
+Readers fold the pending events over the compacted daily rows, so data is
+current without compaction; the compactor just keeps event files short. Each
+month's folded rows are kept in memory and advanced by reading only the bytes
+appended since the last read, so a punch costs O(1) work rather than a pass
+over the whole table. Punches for different months never touch the same file.
+Appends and compaction of a month hold an OS-level lock on
+<YYYY-MM>.events.csv.lock, so the app and a cron compactor running as a
+separate process never interleave, and a check-in's duplicate check and
+append happen under that one lock.
+
+Event types:
+- check_in: inserts the (employee_id, date_only) row unless it already exists
+- check_out: updates the non-empty fields of an existing row
+- row: replaces the whole row (manual entries, rows carried over from the
+  pre-log employee_data.csv)
+
+data/employee_data.csv keeps the history from before the log was enabled;
+read_attendance() returns it with the monthly rows on top (a monthly row wins
+for the same employee and date).
+
+Compact from cron / the command line:
+    python attendance_log.py             # every month with pending events
+    python attendance_log.py 2025-07     # a single month
+"""
+import argparse
+import csv
+import io
+import os
+import threading
+from datetime import datetime, date
+
+import pandas as pd
+
+import config
+import attendance_journal
+from config import ATTENDANCE_LOG_SETTINGS, EMPLOYEE_DATA_CSV
+from utils.file_lock import file_lock
+
+# Same column order as data/employee_data.csv
+LOG_COLUMNS = [
+    "employee_id", "employee_name", "start_datetime", "exit_datetime", "date_only",
+    "total_hours", "extra_hours", "extra_pay", "attendance_status", "late_mark",
+    "method", "confidence", "notes", "admin_user", "description", "reason",
+    "timestamp", "action_type", "location_lat", "location_lon",
+    "location_verified", "location_name",
+]
+EVENT_COLUMNS = ["event_time", "event_type"] + LOG_COLUMNS
+EVENT_TYPES = ("check_in", "check_out", "row")
+
+_locks = {}
+_locks_guard = threading.Lock()
+_months = {}  # month -> _MonthState
+_legacy = {"signature": None, "rows": [], "index": {}}
+
+
+def is_enabled():
+    """The log is used in CSV mode only; SQL mode keeps its keyed INSERT/UPDATE"""
+    return ATTENDANCE_LOG_SETTINGS.get("enabled", True) and not config.USE_SQL
+
+
+def normalize_employee_id(value):
+    """Normalize employee IDs read back from CSV ('7', '7.0', ' 7 ') for comparison"""
+    value = str(value).strip()
+    return value[:-2] if value.endswith(".0") else value
+
+
+def csv_value(value):
+    """Format a Python value the way pandas writes it to the attendance CSV"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def month_key(day):
+    """'YYYY-MM' partition for a date/datetime/ISO string"""
+    return pd.Timestamp(day).strftime("%Y-%m")
+
+
+def _row_key(record):
+    day = record.get("date_only") or record.get("start_datetime") or ""
+    return normalize_employee_id(record.get("employee_id", "")), str(day)[:10]
+
+
+def _paths(month):
+    base = os.path.join(ATTENDANCE_LOG_SETTINGS.get("dir", "data/attendance"), month)
+    return f"{base}.csv", f"{base}.compacting.csv", f"{base}.events.csv"
+
+
+def _month_lock(month):
+    """Guards this process's in-memory fold of a month"""
+    with _locks_guard:
+        return _locks.setdefault(month, threading.Lock())
+
+
+def _month_file_lock(month):
+    """Cross-process lock for writing a month's files (event appends and compaction)"""
+    return file_lock(_paths(month)[2])
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+
+# ==================== FOLDING ====================
+
+def _apply_event(rows, fields):
+    """Apply one event (dict of strings from an events file) to the daily rows"""
+    event_type = fields.get("event_type")
+    record = {col: fields.get(col, "") for col in LOG_COLUMNS}
+    key = _row_key(record)
+    if event_type == "check_in":
+        rows.setdefault(key, record)
+    elif event_type == "check_out":
+        if key in rows:
+            rows[key].update({col: value for col, value in record.items() if value != ""})
+    elif event_type == "row":
+        rows[key] = record
+
+
+def _read_rows(path):
+    """Rows of a CSV file as dicts of strings (empty list if the file is missing)"""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+class _MonthState:
+    """In-memory fold of one month, advanced incrementally as events are appended"""
+
+    def __init__(self, month):
+        self.month = month
+        self.rows = {}
+        self.compacted_sig = None
+        self.compacting_sig = None
+        self.events_header = None
+        self.events_offset = 0
+
+    def refresh(self):
+        compacted, compacting, events = _paths(self.month)
+        events_size = os.path.getsize(events) if os.path.exists(events) else 0
+        if (_signature(compacted) != self.compacted_sig
+                or _signature(compacting) != self.compacting_sig
+                or events_size < self.events_offset):
+            self._reload()
+        self._read_new_events()
+
+    def _reload(self):
+        compacted, compacting, _ = _paths(self.month)
+        self.compacted_sig = _signature(compacted)
+        self.compacting_sig = _signature(compacting)
+        self.rows = {_row_key(r): {col: r.get(col, "") for col in LOG_COLUMNS} for r in _read_rows(compacted)}
+        # Left behind by an interrupted compaction; events are idempotent so re-applying is safe
+        for fields in _read_rows(compacting):
+            _apply_event(self.rows, fields)
+        self.events_header = None
+        self.events_offset = 0
+
+    def _read_new_events(self):
+        _, _, events = _paths(self.month)
+        if not os.path.exists(events):
+            return
+        with open(events, "rb") as f:
+            f.seek(self.events_offset)
+            chunk = f.read()
+        # Only consume complete lines (another process may be mid-append)
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return
+        text = chunk[:end].decode("utf-8-sig" if self.events_offset == 0 else "utf-8")
+        reader = csv.reader(io.StringIO(text, newline=""))
+        if self.events_header is None:
+            self.events_header = next(reader, None)
+        for values in reader:
+            if values:
+                _apply_event(self.rows, dict(zip(self.events_header, values)))
+        self.events_offset += end
+
+
+def _month_rows(month, key=None):
+    """
+    Current daily rows of one month: {(employee_id, date): {column: text}}.
+    With key, just that row (or None) without copying the whole month.
+    """
+    with _month_lock(month):
+        state = _months.get(month)
+        if state is None:
+            state = _months[month] = _MonthState(month)
+        state.refresh()
+        if key is not None:
+            row = state.rows.get(key)
+            return dict(row) if row is not None else None
+        return {k: dict(row) for k, row in state.rows.items()}
+
+
+def _legacy_rows():
+    """
+    Rows of the pre-log employee_data.csv as (list of rows, {key: last row}).
+    Re-read only when the file changes.
+    """
+    signature = _signature(EMPLOYEE_DATA_CSV)
+    if signature != _legacy["signature"]:
+        rows = _read_rows(EMPLOYEE_DATA_CSV)
+        _legacy.update(signature=signature, rows=rows, index={_row_key(r): r for r in rows})
+    return _legacy["rows"], _legacy["index"]
+
+
+# ==================== WRITES ====================
+
+def _event_record(event_type, record):
+    """(month, record) with date_only filled in and parsed"""
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown attendance event type: {event_type}")
+    record = dict(record)
+    if not record.get("date_only"):
+        record["date_only"] = pd.to_datetime(record["start_datetime"]).date()
+    record["date_only"] = pd.to_datetime(record["date_only"]).date()
+    return month_key(record["date_only"]), record
+
+
+def _append_locked(month, event_type, record):
+    """Append one event; the caller holds the month's file lock"""
+    _, _, events = _paths(month)
+    values = [datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"), event_type]
+    values += [csv_value(record.get(col)) for col in LOG_COLUMNS]
+
+    os.makedirs(os.path.dirname(events), exist_ok=True)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    # The file cannot be renamed by the compactor while we hold the lock
+    if not os.path.exists(events) or os.path.getsize(events) == 0:
+        writer.writerow(EVENT_COLUMNS)
+    writer.writerow(values)
+    with open(events, "a", encoding="utf-8", newline="") as f:
+        f.write(buffer.getvalue())
+
+
+def append_event(event_type, record):
+    """Append one event for record's (employee_id, date_only) to its month's event file"""
+    month, record = _event_record(event_type, record)
+    with _month_file_lock(month):
+        _append_locked(month, event_type, record)
+    attendance_journal.record_change(record["employee_id"], record["date_only"], f"log:{event_type}")
+
+
+def check_in(record):
+    """Append a check-in. Returns False if the employee already has a row for that date."""
+    month, record = _event_record("check_in", record)
+    with _month_file_lock(month):
+        # Check and append under one lock, so concurrent check-ins cannot both pass
+        if find_record(record["employee_id"], record["date_only"]) is not None:
+            return False
+        _append_locked(month, "check_in", record)
+    attendance_journal.record_change(record["employee_id"], record["date_only"], "log:check_in")
+    return True
+
+
+def check_out(employee_id, date_only, updates):
+    """Append the check-out fields for an existing row. Returns False if there is no row."""
+    month = month_key(date_only)
+    with _month_file_lock(month):
+        current = find_record(employee_id, date_only)
+        if current is None:
+            return False
+        if current["source"] == "legacy":
+            # The row predates the log: carry it over whole so the update has something to apply to
+            event_type = "row"
+            row = {col: current["row"].get(col, "") for col in LOG_COLUMNS}
+            row.update({col: csv_value(value) for col, value in updates.items()})
+        else:
+            event_type = "check_out"
+            row = {**updates, "employee_id": employee_id, "date_only": date_only}
+        _, row = _event_record(event_type, row)
+        _append_locked(month, event_type, row)
+    attendance_journal.record_change(row["employee_id"], row["date_only"], f"log:{event_type}")
+    return True
+
+
+def put_row(record):
+    """Append a whole-row event (manual entries and other admin writes)"""
+    append_event("row", record)
+
+
+# ==================== READS ====================
+
+def find_record(employee_id, date_only):
+    """
+    Current row for (employee_id, date_only) as {"source": "log"|"legacy", "row": {column: text}},
+    or None if there is none.
+    """
+    key = (normalize_employee_id(employee_id), pd.Timestamp(date_only).date().isoformat())
+    row = _month_rows(month_key(date_only), key)
+    if row is not None:
+        return {"source": "log", "row": row}
+    row = _legacy_rows()[1].get(key)
+    if row is not None:
+        return {"source": "legacy", "row": row}
+    return None
+
+
+def list_months():
+    """Months that have a compacted file or pending events, oldest first"""
+    directory = ATTENDANCE_LOG_SETTINGS.get("dir", "data/attendance")
+    if not os.path.isdir(directory):
+        return []
+    return sorted({name[:7] for name in os.listdir(directory) if name.endswith(".csv") and name[4:5] == "-"})
+
+
+def signature():
+    """Changes whenever any attendance file changes (used as a cache key by repository.py)"""
+    directory = ATTENDANCE_LOG_SETTINGS.get("dir", "data/attendance")
+    files = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    return (_signature(EMPLOYEE_DATA_CSV),) + tuple((name, _signature(os.path.join(directory, name))) for name in files)
+
+
+def read_attendance(employee_id=None, months=None):
+    """
+    Attendance as a DataFrame, parsed the same way as employee_data.csv.
+
+    employee_id: only this employee's rows. months: only these 'YYYY-MM' partitions.
+    """
+    log_rows = {}
+    for month in (list_months() if months is None else months):
+        log_rows.update(_month_rows(month))
+
+    # Duplicate legacy rows (e.g. manual + biometric on one day) are kept as stored
+    legacy_rows = [
+        row for row in _legacy_rows()[0]
+        if _row_key(row) not in log_rows and (months is None or _row_key(row)[1][:7] in months)
+    ]
+    rows = legacy_rows + list(log_rows.values())
+    if employee_id is not None:
+        wanted = normalize_employee_id(employee_id)
+        rows = [row for row in rows if normalize_employee_id(row.get("employee_id", "")) == wanted]
+
+    # Round-trip through the CSV parser so dtypes match what pd.read_csv gives for employee_data.csv
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=LOG_COLUMNS, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype={"employee_id": str})
+
+
+# ==================== COMPACTION ====================
+
+def compact_month(month):
+    """Fold a month's events into its daily-row file. Returns the number of daily rows."""
+    compacted, compacting, events = _paths(month)
+    with _month_file_lock(month), _month_lock(month):
+        # Appenders wait on the file lock, so nothing is written to the renamed file
+        if os.path.exists(events) and not os.path.exists(compacting):
+            os.replace(events, compacting)
+        state = _months.get(month) or _MonthState(month)
+        state._reload()  # compacted + compacting (no events file yet)
+        rows = state.rows
+
+        tmp_path = f"{compacted}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=LOG_COLUMNS, lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(sorted(rows.values(), key=lambda r: (r["date_only"], r["employee_id"])))
+        os.replace(tmp_path, compacted)
+        if os.path.exists(compacting):
+            os.remove(compacting)
+        _months.pop(month, None)
+    return len(rows)
+
+
+def compact_all():
+    """Compact every month that has pending events. Returns {month: daily rows}."""
+    results = {}
+    for month in list_months():
+        _, compacting, events = _paths(month)
+        if os.path.exists(events) or os.path.exists(compacting):
+            results[month] = compact_month(month)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold attendance check-in/check-out events into daily rows")
+    parser.add_argument("months", nargs="*", help="Months to compact as YYYY-MM (default: all with pending events)")
+    args = parser.parse_args()
+
+    results = {month: compact_month(month) for month in args.months} if args.months else compact_all()
+    if not results:
+        print("No pending attendance events.")
+    for month, count in results.items():
+        print(f"{month}: {count} daily rows")
+
+
+if __name__ == "__main__":
+    main()
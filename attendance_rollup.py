@@ -0,0 +1,537 @@
+# attendance_rollup.py
+"""
+Pre-aggregated attendance for the analytics dashboard.
+
+The dashboard used to load every punch ever recorded, merge it with the
+employee master and regroup the raw rows in every widget, so each month of
+history made it slower. It now reads rollups kept under
+ATTENDANCE_ROLLUP_SETTINGS["dir"], one folder per month (by punch-in date):
+
+- hourly.csv: punches and late marks per day, department and punch-in hour
+- daily.csv: punches, late marks, full days, extra hours and the punch-in
+  hour sum per day and department
+- employee_daily.csv: the same per day and employee (plus the hour sum of squares)
+- employee_monthly.csv: per employee for the whole month, with active days
+  and the last punch-in day
+
+Department figures come from hourly/daily, whose size depends on the number of
+days and departments, not on headcount or punches. Per-employee figures for a
+date range add up the monthly rows of the months fully inside it and the daily
+rows of the (at most two) months it cuts. Employees are attached to their
+department and name from the employee master when a month is built.
+
+aggregate_attendance() is the query layer underneath: the same filters (date
+range, department, employee) and GROUP BYs run on SQL Server in SQL mode, so
+only grouped rows cross ODBC, and in pandas in CSV mode.
+
+Rollups are kept up to date incrementally: state.json records the attendance
+journal version (see attendance_journal.py) they were built from, and refresh()
+rebuilds only the months with newer changes. A change to the departments or
+names in the employee master rebuilds everything. The dashboard calls
+refresh() when it opens; run it nightly as well so that is rarely more than a
+journal lookup:
+    python attendance_rollup.py            # rebuild changed months
+    python attendance_rollup.py --full     # rebuild everything (e.g. after deleting SQL rows)
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import config
+import attendance_journal
+import attendance_log
+from attendance_log import normalize_employee_id
+from config import (
+    ATTENDANCE_ROLLUP_SETTINGS, EMPLOYEE_DATA_TABLE, EMPLOYEE_MASTER_TABLE, sql_connection, table_columns,
+)
+from repository import read_table
+
+ROLLUP_LAYOUT = 1  # Bump when the rollup columns change; the next refresh rebuilds everything
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+_refresh_lock = threading.Lock()
+_file_cache = {}  # (month, rollup name) -> (mtime_ns, DataFrame)
+_file_cache_lock = threading.Lock()
+
+
+# ==================== FILES ====================
+
+def _rollup_dir():
+    return ATTENDANCE_ROLLUP_SETTINGS.get("dir", "data/attendance_rollups")
+
+
+def _state_path():
+    return os.path.join(_rollup_dir(), "state.json")
+
+
+def _month_path(month, name):
+    return os.path.join(_rollup_dir(), month, f"{name}.csv")
+
+
+def read_state():
+    """Contents of state.json ({} before the first refresh)"""
+    try:
+        with open(_state_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path, text):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    os.replace(temp_path, path)  # Readers never see half-written files
+
+
+def _write_month(month, frames):
+    for name, frame in frames.items():
+        _write_atomic(_month_path(month, name), frame.to_csv(index=False))
+
+
+def read_month(month, name):
+    """One rollup file of one month, parsed once per change of the file"""
+    path = _month_path(month, name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _file_cache_lock:
+        cached = _file_cache.get((month, name))
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    frame = pd.read_csv(path, dtype={"employee_id": str, "department": str, "employee_name": str, "month": str})
+    for column in ("date_only", "last_date"):
+        if column in frame.columns:
+            frame[column] = pd.to_datetime(frame[column], format="%Y-%m-%d")
+    with _file_cache_lock:
+        _file_cache[(month, name)] = (mtime, frame)
+    return frame
+
+
+# ==================== SOURCES ====================
+
+def load_master():
+    """employee_id -> department and display name, as the dashboard shows them"""
+    master = read_table(EMPLOYEE_MASTER_TABLE, missing_ok=True)
+    if master.empty or "employee_id" not in master.columns:
+        return pd.DataFrame(columns=["employee_id", "department", "employee_name"])
+    master = pd.DataFrame({
+        "employee_id": master["employee_id"].map(normalize_employee_id),
+        "department": master["department"] if "department" in master.columns else np.nan,
+        "employee_name": master["employee_name"].astype(str).str.strip().str.lower()
+        if "employee_name" in master.columns else np.nan,
+    })
+    return master.drop_duplicates("employee_id", keep="last").reset_index(drop=True)
+
+
+def _master_signature(master):
+    return hashlib.sha256(master.to_csv(index=False).encode("utf-8")).hexdigest()
+
+
+def _month_range(month):
+    start = pd.Timestamp(f"{month}-01")
+    return start, start + pd.offsets.MonthBegin(1)
+
+
+def read_punches(months=None):
+    """CSV mode: raw attendance rows of the given "YYYY-MM" months, or all of them"""
+    if months is not None and attendance_log.is_enabled():
+        # Only the touched monthly files; a punch-in is filed under its own month
+        return attendance_log.read_attendance(months=months)
+    return read_table(EMPLOYEE_DATA_TABLE, missing_ok=True, use_sql=False)
+
+
+def _flag(values):
+    """late_mark as booleans, whether stored as bool, 0/1 or text"""
+    if pd.api.types.is_bool_dtype(values):
+        return values.fillna(False).astype(bool)
+    return values.astype(str).str.strip().str.lower().isin(["true", "1", "1.0", "yes"])
+
+
+# ==================== QUERIES ====================
+# The same three aggregations in SQL (GROUP BY on the server, only grouped rows
+# come back over ODBC) and in pandas (CSV mode):
+# - hourly:         date_only, department, hour -> punches, late
+# - daily:          date_only, department -> punches, late, full_day, extra_hours, hour_sum
+# - employee_daily: date_only, employee_id -> employee_name, department, punches,
+#                   late, extra_hours, hour_sum, hour_sq_sum
+
+def punch_filters(start=None, end=None, department=None, employee_id=None):
+    """
+    SQL mode: WHERE conditions (on employee_data columns) and parameters for
+    punch-ins on start..end (dates, both inclusive), of one department and/or
+    one employee.
+    """
+    conditions, params = ["start_datetime IS NOT NULL"], []
+    if start is not None:
+        conditions.append("start_datetime >= ?")
+        params.append(pd.Timestamp(start).normalize().to_pydatetime())
+    if end is not None:
+        conditions.append("start_datetime < ?")
+        params.append((pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).to_pydatetime())
+    if department is not None:
+        conditions.append(f"employee_id IN (SELECT employee_id FROM {EMPLOYEE_MASTER_TABLE} WHERE department = ?)")
+        params.append(department)
+    if employee_id is not None:
+        conditions.append("employee_id = ?")
+        params.append(normalize_employee_id(employee_id))
+    return " AND ".join(conditions), params
+
+
+def _aggregate_sql(start, end, department, employee_id):
+    with sql_connection() as conn:
+        punch_columns = set(table_columns(conn, EMPLOYEE_DATA_TABLE))
+        master_columns = set(table_columns(conn, EMPLOYEE_MASTER_TABLE))
+
+        # Columns missing from older schemas count as "not late", "no extra hours", ...
+        names = [f"{alias}.employee_name" for alias, columns in (("m", master_columns), ("d", punch_columns))
+                 if "employee_name" in columns]
+        name_sql = f"LOWER(LTRIM(RTRIM(COALESCE({', '.join(names)}, NULL))))" if names else "CAST(NULL AS NVARCHAR(100))"
+        department_sql = "m.department" if "department" in master_columns else "CAST(NULL AS NVARCHAR(100))"
+        late_sql = ("CASE WHEN CAST(d.late_mark AS NVARCHAR(10)) IN ('1', '1.0', 'True', 'true', 'yes') THEN 1 ELSE 0 END"
+                    if "late_mark" in punch_columns else "0")
+        full_day_sql = ("CASE WHEN d.attendance_status = 'Full Day' THEN 1 ELSE 0 END"
+                        if "attendance_status" in punch_columns else "0")
+        extra_sql = ("ISNULL(TRY_CAST(d.extra_hours AS FLOAT), 0)"
+                     if "extra_hours" in punch_columns else "CAST(0 AS FLOAT)")
+
+        where, params = punch_filters(start, end, department if "department" in master_columns else None, employee_id)
+        punches = f"""
+            SELECT d.employee_id,
+                   CAST(d.start_datetime AS DATE) AS date_only,
+                   DATEPART(HOUR, d.start_datetime) AS hour,
+                   {department_sql} AS department,
+                   {name_sql} AS employee_name,
+                   {late_sql} AS late,
+                   {full_day_sql} AS full_day,
+                   {extra_sql} AS extra_hours
+            FROM (SELECT * FROM {EMPLOYEE_DATA_TABLE} WHERE {where}) d
+            LEFT JOIN {EMPLOYEE_MASTER_TABLE} m ON m.employee_id = d.employee_id
+        """
+        queries = {
+            "hourly": f"""
+                SELECT date_only, department, hour, COUNT(*) AS punches, SUM(late) AS late
+                FROM ({punches}) p GROUP BY date_only, department, hour
+            """,
+            "daily": f"""
+                SELECT date_only, department, COUNT(*) AS punches, SUM(late) AS late,
+                       SUM(full_day) AS full_day, SUM(extra_hours) AS extra_hours, SUM(hour) AS hour_sum
+                FROM ({punches}) p GROUP BY date_only, department
+            """,
+            "employee_daily": f"""
+                SELECT date_only, employee_id, MAX(employee_name) AS employee_name, MAX(department) AS department,
+                       COUNT(*) AS punches, SUM(late) AS late, SUM(extra_hours) AS extra_hours,
+                       SUM(hour) AS hour_sum, SUM(hour * hour) AS hour_sq_sum
+                FROM ({punches}) p GROUP BY date_only, employee_id
+            """,
+        }
+        frames = {name: pd.read_sql(query, conn, params=params) for name, query in queries.items()}
+
+    for frame in frames.values():
+        frame["date_only"] = pd.to_datetime(frame["date_only"])
+    employee_daily = frames["employee_daily"]
+    employee_daily["employee_id"] = employee_daily["employee_id"].map(normalize_employee_id)
+    # "1" and "1.0" are one employee
+    frames["employee_daily"] = employee_daily.groupby(["date_only", "employee_id"], as_index=False).agg(
+        employee_name=("employee_name", "first"), department=("department", "first"),
+        punches=("punches", "sum"), late=("late", "sum"), extra_hours=("extra_hours", "sum"),
+        hour_sum=("hour_sum", "sum"), hour_sq_sum=("hour_sq_sum", "sum"),
+    )
+    return frames
+
+
+def aggregate_punches(punches, master, start=None, end=None, department=None, employee_id=None):
+    """pandas version of the aggregations, over raw attendance rows and load_master()"""
+    start_datetime = pd.to_datetime(punches.get("start_datetime", pd.Series(dtype=object)), errors="coerce")
+    keep = start_datetime.notna()
+    if start is not None:
+        keep &= start_datetime >= pd.Timestamp(start).normalize()
+    if end is not None:
+        keep &= start_datetime < pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+    keep = keep.to_numpy()
+    start_datetime = start_datetime[keep]
+
+    def column(name, default):
+        return punches[name][keep] if name in punches.columns else pd.Series(default, index=start_datetime.index)
+
+    rows = pd.DataFrame({
+        "employee_id": column("employee_id", "").map(normalize_employee_id),
+        "punch_name": column("employee_name", np.nan).astype("string").str.strip().str.lower(),
+        "date_only": start_datetime.dt.normalize(),
+        "hour": start_datetime.dt.hour,
+        "late": _flag(column("late_mark", False)),
+        "full_day": column("attendance_status", "").astype(str) == "Full Day",
+        "extra_hours": pd.to_numeric(column("extra_hours", 0), errors="coerce").fillna(0.0),
+    }).reset_index(drop=True)
+    rows = rows.merge(master, on="employee_id", how="left")
+    rows["employee_name"] = rows["employee_name"].fillna(rows["punch_name"])
+    if department is not None:
+        rows = rows[rows["department"] == department]
+    if employee_id is not None:
+        rows = rows[rows["employee_id"] == normalize_employee_id(employee_id)]
+    rows = rows.assign(hour_sq=rows["hour"] ** 2)
+
+    return {
+        "hourly": rows.groupby(["date_only", "department", "hour"], dropna=False, as_index=False).agg(
+            punches=("late", "size"), late=("late", "sum"),
+        ),
+        "daily": rows.groupby(["date_only", "department"], dropna=False, as_index=False).agg(
+            punches=("late", "size"), late=("late", "sum"), full_day=("full_day", "sum"),
+            extra_hours=("extra_hours", "sum"), hour_sum=("hour", "sum"),
+        ),
+        "employee_daily": rows.groupby(["date_only", "employee_id"], as_index=False).agg(
+            employee_name=("employee_name", "first"), department=("department", "first"),
+            punches=("late", "size"), late=("late", "sum"), extra_hours=("extra_hours", "sum"),
+            hour_sum=("hour", "sum"), hour_sq_sum=("hour_sq", "sum"),
+        ),
+    }
+
+
+def aggregate_attendance(start=None, end=None, department=None, employee_id=None, master=None):
+    """
+    hourly, daily and employee_daily aggregates of the punch-ins on start..end
+    (dates, both inclusive; open-ended when None), optionally of one department
+    and/or one employee. SQL mode runs the filters and GROUP BYs on the server.
+    """
+    if config.USE_SQL:
+        return _aggregate_sql(start, end, department, employee_id)
+    months = None
+    if start is not None and end is not None:
+        months = pd.period_range(pd.Timestamp(start), pd.Timestamp(end), freq="M").strftime("%Y-%m").tolist()
+    master = load_master() if master is None else master
+    return aggregate_punches(read_punches(months), master, start, end, department, employee_id)
+
+
+# ==================== BUILDING ====================
+
+def build_rollups(aggregates):
+    """{month: {rollup name: DataFrame}} from aggregate_attendance() output, for every month with punches"""
+    frames = dict(aggregates)
+    frames["employee_monthly"] = _employee_totals(
+        frames["employee_daily"].assign(month=frames["employee_daily"]["date_only"].dt.strftime("%Y-%m")),
+        ["month", "employee_id"],
+    )
+    rollups = {}
+    for name, frame in frames.items():
+        if "month" not in frame.columns:
+            frame = frame.assign(month=frame["date_only"].dt.strftime("%Y-%m"))
+        for month, part in frame.groupby("month", sort=True):
+            rollups.setdefault(month, {})[name] = part.drop(columns="month").assign(
+                **{column: part[column].dt.strftime("%Y-%m-%d")
+                   for column in ("date_only", "last_date") if column in part.columns}
+            )
+    return rollups
+
+
+def _employee_totals(rows, keys):
+    """Per-employee totals of employee_daily rows, or of employee totals (e.g. several months)"""
+    if "active_days" in rows.columns:
+        active_days, last_date = ("active_days", "sum"), ("last_date", "max")
+    else:
+        active_days, last_date = ("date_only", "nunique"), ("date_only", "max")
+    return rows.groupby(keys, as_index=False).agg(
+        employee_name=("employee_name", "first"), department=("department", "first"),
+        active_days=active_days, punches=("punches", "sum"), late=("late", "sum"),
+        extra_hours=("extra_hours", "sum"), hour_sum=("hour_sum", "sum"),
+        hour_sq_sum=("hour_sq_sum", "sum"), last_date=last_date,
+    )
+
+
+def refresh(full=False):
+    """
+    Bring the rollups up to date with the attendance data; returns the months
+    that were rebuilt. Only months changed since the last refresh are read,
+    unless full is set, the employee master changed or there are no rollups yet.
+    """
+    with _refresh_lock:
+        state = read_state()
+        # Taken before reading attendance, so writes made meanwhile are picked up next time
+        version = attendance_journal.current_version()
+        master = load_master()
+        signature = _master_signature(master)
+
+        rebuild_all = (full or not state or state.get("master") != signature
+                       or state.get("layout") != ROLLUP_LAYOUT)
+        if rebuild_all:
+            months = None
+        else:
+            changes = attendance_journal.change_versions(since=state.get("version", 0))
+            months = sorted(set(changes["salary_month"].dropna().astype(str)))
+            if not months:
+                return []
+
+        if months is None:
+            rollups = build_rollups(aggregate_attendance(master=master))
+        else:
+            rollups = {}
+            for month in months:
+                start, end = _month_range(month)
+                rollups.update(build_rollups(
+                    aggregate_attendance(start, end - pd.Timedelta(days=1), master=master)
+                ))
+        known = set(state.get("months", []))
+        targets = sorted(known | set(rollups)) if months is None else months
+        for month in targets:
+            if month in rollups:
+                _write_month(month, rollups[month])
+            else:
+                # No punches left in the month (deleted rows)
+                shutil.rmtree(os.path.join(_rollup_dir(), month), ignore_errors=True)
+                known.discard(month)
+        known = set(rollups) if months is None else known | set(rollups)
+
+        _write_atomic(_state_path(), json.dumps({
+            "layout": ROLLUP_LAYOUT,
+            "version": int(version),
+            "master": signature,
+            "months": sorted(known),
+            "refreshed_at": datetime.now().isoformat(timespec="seconds"),
+        }, indent=2))
+        return targets
+
+
+# ==================== READING ====================
+
+def _concat(frames):
+    frames = [frame for frame in frames if frame is not None]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+class AttendanceRollups:
+    """The stored rollups of every month, for slicing by date range and department"""
+
+    def __init__(self, months):
+        self.months = sorted(months)
+        self.hourly = _concat(read_month(month, "hourly") for month in self.months)
+        self.daily = _concat(read_month(month, "daily") for month in self.months)
+        monthly = {month: read_month(month, "employee_monthly") for month in self.months}
+        self.employee_monthly = _concat(
+            frame.assign(month=month) for month, frame in monthly.items() if frame is not None
+        )
+
+    @property
+    def empty(self):
+        return self.daily.empty
+
+    def date_bounds(self):
+        """First and last punch-in day as datetime.date"""
+        return self.daily["date_only"].min().date(), self.daily["date_only"].max().date()
+
+    def departments(self):
+        return sorted(self.daily["department"].dropna().unique().tolist())
+
+    def select(self, start, end, department=None):
+        """AttendanceSlice for start..end (both inclusive), optionally one department"""
+        return AttendanceSlice(self, pd.Timestamp(start), pd.Timestamp(end), department)
+
+
+class AttendanceSlice:
+    """
+    Rollups of one date range (and department):
+    - hourly / daily: the stored rows within the range
+    - employees: one row per employee with active_days, punches, late,
+      extra_hours, last_date, avg_hour and hour_std (std of punch-in hours)
+    """
+
+    def __init__(self, rollups, start, end, department=None):
+        self.start = start
+        self.end = end
+        self.department = department
+
+        def within(frame):
+            if frame.empty:
+                return frame
+            mask = (frame["date_only"] >= start) & (frame["date_only"] <= end)
+            if department is not None:
+                mask &= frame["department"] == department
+            return frame[mask].reset_index(drop=True)
+
+        self.hourly = within(rollups.hourly)
+        self.daily = within(rollups.daily)
+        self.employees = self._employees(rollups)
+
+    def _employees(self, rollups):
+        parts = []
+        for month in rollups.months:
+            month_start, month_end = _month_range(month)
+            if month_end <= self.start or month_start > self.end:
+                continue
+            if self.start <= month_start and month_end - pd.Timedelta(days=1) <= self.end:
+                monthly = rollups.employee_monthly
+                parts.append(monthly[monthly["month"] == month].drop(columns="month"))
+                continue
+            # The range cuts this month: add up its days within the range
+            daily = read_month(month, "employee_daily")
+            if daily is not None:
+                daily = daily[(daily["date_only"] >= self.start) & (daily["date_only"] <= self.end)]
+                parts.append(_employee_totals(daily, ["employee_id"]))
+
+        employees = _concat(parts)
+        if employees.empty:
+            return pd.DataFrame(columns=["employee_id", "employee_name", "department", "active_days", "punches",
+                                         "late", "extra_hours", "last_date", "avg_hour", "hour_std"])
+        if self.department is not None:
+            employees = employees[employees["department"] == self.department]
+        employees = _employee_totals(employees, ["employee_id"])
+
+        n = employees["punches"]
+        employees["avg_hour"] = employees["hour_sum"] / n
+        variance = (employees["hour_sq_sum"] - employees["hour_sum"] ** 2 / n) / (n - 1)
+        # Sample std, as Series.std(); undefined for a single punch
+        employees["hour_std"] = np.sqrt(variance.clip(lower=0)).where(n > 1)
+        return employees.drop(columns=["hour_sum", "hour_sq_sum"])
+
+    @property
+    def empty(self):
+        return self.daily.empty
+
+    @property
+    def punches(self):
+        return int(self.daily["punches"].sum()) if not self.daily.empty else 0
+
+    def active_dates(self):
+        """Days with at least one punch-in"""
+        return self.daily["date_only"].drop_duplicates().sort_values().reset_index(drop=True)
+
+    def avg_hour(self):
+        punches = self.punches
+        return self.daily["hour_sum"].sum() / punches if punches else None
+
+    def weekday_hour_counts(self):
+        """Punches per (weekday name, hour)"""
+        hourly = self.hourly.assign(weekday=self.hourly["date_only"].dt.day_name())
+        return hourly.groupby(["weekday", "hour"])["punches"].sum()
+
+    def by_weekday(self, column="punches"):
+        """Sum of a daily column per weekday name, Monday first (weekdays without rows left out)"""
+        totals = self.daily.groupby(self.daily["date_only"].dt.day_name())[column].sum()
+        return totals.reindex([day for day in WEEKDAYS if day in totals.index])
+
+
+def load_rollups(refresh_first=True):
+    """Refresh (unless told not to) and return the rollups of every month"""
+    if refresh_first:
+        refresh()
+    return AttendanceRollups(read_state().get("months", []))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the attendance rollups used by the analytics dashboard")
+    parser.add_argument("--full", action="store_true", help="Rebuild every month instead of changed ones")
+    args = parser.parse_args()
+
+    months = refresh(full=args.full)
+    print(f"Rebuilt {len(months)} month(s): {', '.join(months)}" if months else "Rollups are up to date.")
+
+
+if __name__ == "__main__":
+    main()
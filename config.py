@@ -2,12 +2,16 @@
 import os
 import pyodbc
 import math
+import threading
+import time
 import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Union
 
 # ---------- Toggle (change as needed) ----------
 USE_SQL = True  # True => use SQL Server, False => use local CSV files
+USE_PARQUET = False  # CSV mode only: read tables from typed Parquet copies of the CSV files (see parquet_store.py)
 
 # ---------- CSV paths ----------
 EMPLOYEE_MASTER_CSV = "data/employee_master.csv"
@@ -41,6 +45,123 @@ VERIFIED_ADMIN_TABLE = "dbo.verified_admins"
 RESIGNATION_LOG_TABLE = "dbo.resignation_log"
 FEEDBACK_RAW_TABLE = "dbo.feedback_raw"
 FEEDBACK_REVIEWED_TABLE = "dbo.feedback_reviewed"
+PREDICTIVE_ALERTS_TABLE = "dbo.predictive_alerts"
+
+# ---------- Table -> CSV file mapping (CSV mode / fallback) ----------
+TABLE_CSV_PATHS = {
+    EMPLOYEE_MASTER_TABLE: EMPLOYEE_MASTER_CSV,
+    EMPLOYEE_DATA_TABLE: EMPLOYEE_DATA_CSV,
+    SALARY_LOG_TABLE: SALARY_LOG_CSV,
+    FEEDBACK_LOG_TABLE: FEEDBACK_LOG_CSV,
+    VERIFIED_ADMIN_TABLE: VERIFIED_ADMINS_CSV,
+    RESIGNATION_LOG_TABLE: RESIGNATION_LOG_CSV,
+    FEEDBACK_RAW_TABLE: FEEDBACK_RAW_CSV,
+    FEEDBACK_REVIEWED_TABLE: FEEDBACK_REVIEWED_CSV,
+}
+
+# ---------- Parquet storage (CSV mode, see parquet_store.py) ----------
+PARQUET_DIR = "data/parquet"
+
+# Per-table typing for the Parquet copies: datetime columns are parsed once at
+# conversion time; month_column is what month filters are pushed down to.
+PARQUET_TABLE_SETTINGS = {
+    EMPLOYEE_DATA_TABLE: {
+        "datetime_columns": ["start_datetime", "exit_datetime", "date_only", "timestamp"],
+        "month_column": "date_only",
+        "sort_by": ["date_only", "employee_id"],
+    },
+    SALARY_LOG_TABLE: {
+        "datetime_columns": ["data_date", "timestamp"],
+        "month_column": "salary_month",
+        "sort_by": ["salary_month", "employee_id"],
+    },
+    EMPLOYEE_MASTER_TABLE: {
+        "datetime_columns": [],
+    },
+    FEEDBACK_LOG_TABLE: {
+        "datetime_columns": ["timestamp", "related_date"],
+        "month_column": "timestamp",
+        "sort_by": ["timestamp"],
+    },
+    RESIGNATION_LOG_TABLE: {
+        "datetime_columns": ["notice_issued_date", "resignation_date"],
+    },
+    FEEDBACK_RAW_TABLE: {
+        "datetime_columns": ["timestamp"],
+        "month_column": "timestamp",
+    },
+    FEEDBACK_REVIEWED_TABLE: {
+        "datetime_columns": ["timestamp"],
+        "month_column": "timestamp",
+    },
+}
+PARQUET_ROW_GROUP_SIZE = 50000  # Rows per row group; smaller groups = finer month/employee pruning
+
+# ---------- Attendance event log (CSV mode, see attendance_log.py) ----------
+ATTENDANCE_LOG_SETTINGS = {
+    "enabled": True,  # CSV mode: append punches to monthly event files instead of rewriting employee_data.csv
+    "dir": "data/attendance",  # <YYYY-MM>.events.csv (append-only) and <YYYY-MM>.csv (compacted daily rows)
+}
+
+# ---------- Attendance change journal (see attendance_journal.py) ----------
+ATTENDANCE_JOURNAL_SETTINGS = {
+    "csv_path": "data/attendance_changes.csv",  # CSV mode: one line per attendance write
+    "sql_column": "row_version",  # SQL mode: ROWVERSION column added to employee_data on first use
+}
+
+# ---------- Attendance rollups for analytics (see attendance_rollup.py) ----------
+ATTENDANCE_ROLLUP_SETTINGS = {
+    "dir": "data/attendance_rollups",  # <YYYY-MM>/{hourly,daily,employee_daily,employee_monthly}.csv + state.json
+}
+
+# ---------- Working-day calendar (see work_calendar.py) ----------
+WORK_CALENDAR_SETTINGS = {
+    "holidays_csv": "data/holidays.csv",  # dates,holiday_name
+    "weekly_off": 1,  # Day of week with no work (Monday = 0, so 1 = Tuesday)
+    "first_year": 2020,  # Days precomputed up front; dates outside the range extend it on demand
+    "last_year": 2035,
+}
+
+# ---------- Bulk payslip archives (see views/bulkpayslip.py) ----------
+BULK_PAYSLIP_SETTINGS = {
+    "archive_dir": "data/exports/payslips",  # Payslips_<YYYY-MM>.zip, written PDF by PDF as they render
+    "max_download_mb": 200,  # Larger archives are not offered in the browser (Streamlit holds downloads in memory)
+}
+
+# ---------- Rendered payslip cache (see utils/pdf_payslip.py) ----------
+PAYSLIP_CACHE_SETTINGS = {
+    "enabled": True,  # Serve unchanged payslips from disk instead of rendering them again
+    "dir": "data/payslip_cache",  # <YYYY-MM>/<employee_id>/<content hash>.pdf
+    "max_mb": 500,  # Least recently used PDFs are removed beyond this
+}
+
+# ---------- Scored predictive alerts (see predictive_alerts.py) ----------
+PREDICTIVE_ALERTS_SETTINGS = {
+    "parquet_path": "data/predictive_alerts.parquet",  # CSV mode store; SQL mode uses PREDICTIVE_ALERTS_TABLE
+    "repeat_months": 3,  # "Flagged N months running" threshold on the alerts page and admin overview
+}
+
+# ---------- Payslip email delivery (see email_delivery.py) ----------
+EMAIL_DELIVERY_SETTINGS = {
+    "dir": "data/email_queue",  # deliveries.csv (state log) and <batch_id>/<message_id>.pdf (unsent attachments)
+    "workers": 4,  # Parallel SMTP sessions
+    "max_per_minute": 120,  # Across all workers; 0 = no limit
+    "messages_per_session": 100,  # Reconnect after this many messages (servers cap messages per connection)
+    "max_attempts": 5,  # Per message, before it is marked failed
+    "backoff_seconds": 5,  # First retry delay; doubles on each attempt
+    "backoff_max_seconds": 300,
+}
+
+# ---------- Table cache settings (see repository.py) ----------
+TABLE_CACHE_SETTINGS = {
+    "enabled": True,  # Cache whole-table reads in memory, shared by all sessions
+    "sql_max_age_seconds": 300,  # Re-read SQL tables after this long (catches writes from other processes)
+}
+
+# ---------- Schema cache settings (see get_schema below and schema_migrations.py) ----------
+SCHEMA_CACHE_SETTINGS = {
+    "ttl_seconds": 600,  # Re-read INFORMATION_SCHEMA after this long (catches DDL from other processes)
+}
 
 # ===== ENHANCED GPS/Location Settings =====
 # Office location coordinates (CRITICAL: THESE MUST MATCH YOUR PRESET_LOCATIONS IN ATTENDANCE.PY)
@@ -100,6 +221,13 @@ MOBILE_SETTINGS = {
     "battery_optimization": True,  # Optimize for mobile battery
 }
 
+# Face snapshot archive (see face_reverification.py)
+FACE_SNAPSHOT_SETTINGS = {
+    "archive_enabled": False,  # Keep each verified punch's camera snapshot so it can be re-scored later
+    "dir": "data/snapshots",  # <dir>/<employee_id>/<YYYY-MM-DD>.jpg
+    "report_dir": "logs",  # Where re-verification reports are written
+}
+
 # Security Settings
 SECURITY_SETTINGS = {
     "require_face_recognition": True,  # Mandatory face recognition
@@ -131,10 +259,20 @@ NOTIFICATIONS = {
 }
 
 
+# ---------- Connection pool settings ----------
+# One pool per process, shared by every Streamlit session/thread.
+SQL_POOL_SETTINGS = {
+    "max_size": int(os.getenv("SQL_POOL_MAX_SIZE", "10")),  # Max open connections (idle + in use)
+    "idle_timeout_seconds": int(os.getenv("SQL_POOL_IDLE_TIMEOUT", "300")),  # Close connections idle longer than this
+    "health_check_after_seconds": 30,  # Ping idle connections older than this before handing them out
+    "acquire_timeout_seconds": 15,  # Wait this long for a free connection before failing
+}
+
+
 # ---------- Connection helpers ----------
-def get_sql_connection():
+def _open_sql_connection():
     """
-    Returns a pyodbc connection using either SQL auth (if SQL_UID/SQL_PWD set)
+    Opens a new pyodbc connection using either SQL auth (if SQL_UID/SQL_PWD set)
     or Windows Trusted Connection (default).
     """
     if SQL_UID and SQL_PWD:
@@ -154,32 +292,330 @@ def get_sql_connection():
     return pyodbc.connect(conn_str)
 
 
+class PooledConnection:
+    """
+    Wrapper handed out by SQLConnectionPool.
+
+    Behaves like a pyodbc connection, except close() (or leaving a `with`
+    block) returns the underlying connection to the pool instead of tearing
+    down the TCP/auth session.
+    """
+
+    def __init__(self, pool, raw_conn):
+        self._pool = pool
+        self._conn = raw_conn
+        self._released = False
+
+    def __getattr__(self, name):
+        if self.__dict__.get("_conn") is None:
+            raise DatabaseConnectionError("Connection has already been returned to the pool")
+        return getattr(self._conn, name)
+
+    def close(self):
+        """Return the connection to the pool (safe to call more than once)"""
+        if not self._released:
+            self._released = True
+            self._pool._release(self._conn)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Same transaction semantics as `with pyodbc.connect(...)`: commit on
+        # success, roll back on error; then hand the connection back.
+        try:
+            if self._conn is not None:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def __del__(self):
+        # Callers that never close() must not leak a pool slot
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SQLConnectionPool:
+    """Thread-safe pool of long-lived pyodbc connections with health checks"""
+
+    def __init__(self, connect=_open_sql_connection, max_size=10, idle_timeout_seconds=300,
+                 health_check_after_seconds=30, acquire_timeout_seconds=15):
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.health_check_after_seconds = health_check_after_seconds
+        self.acquire_timeout_seconds = acquire_timeout_seconds
+        self._idle = []  # list of (raw_conn, last_used_monotonic)
+        self._in_use = 0
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Borrow a healthy connection, opening a new one if below max_size"""
+        deadline = time.monotonic() + self.acquire_timeout_seconds
+        expired = []
+        with self._cond:
+            while True:
+                expired.extend(self._take_expired_locked())
+                if self._idle:
+                    raw_conn, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    raw_conn, last_used = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DatabaseConnectionError(
+                        f"Timed out waiting for a SQL connection (pool max_size={self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+        # Network I/O happens outside the lock
+        for stale_conn in expired:
+            self._discard(stale_conn)
+        try:
+            if raw_conn is not None and time.monotonic() - last_used > self.health_check_after_seconds:
+                if not self._is_healthy(raw_conn):
+                    self._discard(raw_conn)
+                    raw_conn = None
+            if raw_conn is None:
+                raw_conn = self._connect()
+                with self._cond:
+                    self._created += 1
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return PooledConnection(self, raw_conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager: commit on success, rollback on error, always return to pool"""
+        conn = self.acquire()
+        with conn:
+            yield conn
+
+    def _release(self, raw_conn):
+        try:
+            # Never hand out a connection with a half-finished transaction
+            raw_conn.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((raw_conn, time.monotonic()))
+            self._cond.notify()
+
+        if not healthy:
+            self._discard(raw_conn)
+
+    def _take_expired_locked(self):
+        """Remove connections idle past idle_timeout_seconds; caller closes them"""
+        now = time.monotonic()
+        expired = [conn for conn, last_used in self._idle if now - last_used > self.idle_timeout_seconds]
+        if expired:
+            self._idle = [(conn, last_used) for conn, last_used in self._idle
+                          if now - last_used <= self.idle_timeout_seconds]
+        return expired
+
+    @staticmethod
+    def _is_healthy(raw_conn):
+        try:
+            cursor = raw_conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(raw_conn):
+        try:
+            raw_conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close every idle connection (in-use ones close when returned)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for raw_conn, _ in idle:
+            self._discard(raw_conn)
+
+    def stats(self):
+        """Pool counters for health reports"""
+        with self._cond:
+            return {
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "created": self._created,
+                "max_size": self.max_size,
+            }
+
+
+_sql_pool = None
+_sql_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> SQLConnectionPool:
+    """Return the process-wide SQL connection pool (created on first use)"""
+    global _sql_pool
+    if _sql_pool is None:
+        with _sql_pool_lock:
+            if _sql_pool is None:
+                _sql_pool = SQLConnectionPool(**SQL_POOL_SETTINGS)
+    return _sql_pool
+
+
+def close_connection_pool():
+    """Close all idle pooled connections (e.g. on shutdown or after changing SQL settings)"""
+    if _sql_pool is not None:
+        _sql_pool.close_all()
+
+
+@contextmanager
+def sql_connection():
+    """
+    Borrow a pooled SQL connection for the duration of a `with` block.
+
+        with sql_connection() as conn:
+            df = pd.read_sql(query, conn)
+
+    Commits on success, rolls back on error and always returns the
+    connection to the pool.
+    """
+    with get_connection_pool().connection() as conn:
+        yield conn
+
+
+def get_sql_connection():
+    """
+    Returns a pooled pyodbc connection using either SQL auth (if SQL_UID/SQL_PWD set)
+    or Windows Trusted Connection (default).
+    Calling close() on it (or leaving a `with` block) returns it to the pool.
+    Prefer `with sql_connection() as conn:` in new code.
+    """
+    return get_connection_pool().acquire()
+
+
+# ---------- Table change counters ----------
+# Every writer bumps the counter of the table it changed; repository.py uses
+# it (together with the CSV file mtime) to know when a cached copy is stale.
+_table_versions = {}
+_table_versions_lock = threading.Lock()
+
+
+def bump_table_version(table_name):
+    """Mark table_name as changed so cached reads of it are refreshed"""
+    with _table_versions_lock:
+        _table_versions[table_name] = _table_versions.get(table_name, 0) + 1
+        return _table_versions[table_name]
+
+
+def get_table_version(table_name):
+    """Current change counter of table_name (0 if never written in this process)"""
+    with _table_versions_lock:
+        return _table_versions.get(table_name, 0)
+
+
 def safe_get_conn() -> Union[pyodbc.Connection, None]:
     """Return SQL connection if USE_SQL=True, else None."""
     if not USE_SQL:
         return None
     try:
         return get_sql_connection()
-    except pyodbc.Error as ex:
+    except (pyodbc.Error, DatabaseConnectionError) as ex:
         print(f"SQL connection failed: {ex}. Returning None.")
         return None
 
 
+# ---------- Schema cache ----------
+# Columns (name, type, nullable) of every table in the database, read from
+# INFORMATION_SCHEMA in one query and shared by the whole process, so
+# existence and column checks no longer hit the catalog on every request.
+# Re-read after SCHEMA_CACHE_SETTINGS["ttl_seconds"], or right away after
+# invalidate_schema() (called by schema_migrations.py and the admin sidebar).
+_schema = None  # {(schema, table) lower-case: [(column, data_type, is_nullable), ...]}
+_schema_loaded_at = 0.0
+_schema_lock = threading.Lock()
+
+
+def _schema_key(table_name):
+    schema, _, tname = table_name.rpartition(".")
+    return (schema or "dbo").strip("[]").lower(), tname.strip("[]").lower()
+
+
+def _read_schema(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, IS_NULLABLE "
+            "FROM INFORMATION_SCHEMA.COLUMNS ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION"
+        )
+        schema = {}
+        for table_schema, tname, column, data_type, is_nullable in cursor.fetchall():
+            schema.setdefault((table_schema.lower(), tname.lower()), []).append(
+                (column, data_type, is_nullable == "YES")
+            )
+        return schema
+    finally:
+        cursor.close()
+
+
+def get_schema(conn=None):
+    """The cached schema, (re)loaded when missing or older than the TTL (uses conn if given)"""
+    global _schema, _schema_loaded_at
+    with _schema_lock:
+        if _schema is not None and time.monotonic() - _schema_loaded_at < SCHEMA_CACHE_SETTINGS.get("ttl_seconds", 600):
+            return _schema
+        if conn is not None:
+            _schema = _read_schema(conn)
+        else:
+            with sql_connection() as new_conn:
+                _schema = _read_schema(new_conn)
+        _schema_loaded_at = time.monotonic()
+        return _schema
+
+
+def invalidate_schema():
+    """Forget the cached schema, e.g. after DDL; the next lookup re-reads it"""
+    global _schema
+    with _schema_lock:
+        _schema = None
+
+
+def table_columns(conn, table_name):
+    """Column names of a table in table order ([] if it does not exist)"""
+    return [column for column, _, _ in get_schema(conn).get(_schema_key(table_name), [])]
+
+
+def column_types(conn, table_name):
+    """{column: (data_type, is_nullable)} of a table ({} if it does not exist)"""
+    return {column: (data_type, nullable) for column, data_type, nullable in get_schema(conn).get(_schema_key(table_name), [])}
+
+
 # ---------- Small helpers ----------
 def table_exists(conn, table_name):
     """
     Check if a table exists. Accepts 'schema.table' or 'table'.
+    Answered from the schema cache.
     """
-    if "." in table_name:
-        schema, tname = table_name.split(".", 1)
-    else:
-        schema, tname = "dbo", table_name
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA=? AND TABLE_NAME=?",
-        (schema.strip("[]"), tname.strip("[]"))
-    )
-    return cursor.fetchone()[0] > 0
+    return _schema_key(table_name) in get_schema(conn)
 
 
 def safe_float(value, precision=12, scale=4):
@@ -493,6 +929,7 @@ def sync_offline_data():
             # IMPORTANT: This assumes the data is for a single table.
             # You may need to adapt this if you have multiple temporary files.
             offline_data.to_sql(EMPLOYEE_DATA_TABLE, conn, if_exists='append', index=False)
+            bump_table_version(EMPLOYEE_DATA_TABLE)
 
             # Backup the temp file before deleting
             backup_path = f"{TEMP_CSV_PATH}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -536,25 +973,15 @@ def save_data(data: pd.DataFrame, table_name: str):
             _save_to_csv(data, TEMP_CSV_PATH)
     else:
         print(f"CSV-only mode. Saving data directly to corresponding CSV file.")
-        # Map table names to CSV files
-        csv_mapping = {
-            EMPLOYEE_MASTER_TABLE: EMPLOYEE_MASTER_CSV,
-            EMPLOYEE_DATA_TABLE: EMPLOYEE_DATA_CSV,
-            SALARY_LOG_TABLE: SALARY_LOG_CSV,
-            FEEDBACK_LOG_TABLE: FEEDBACK_LOG_CSV,
-            VERIFIED_ADMIN_TABLE: VERIFIED_ADMINS_CSV,
-            RESIGNATION_LOG_TABLE: RESIGNATION_LOG_CSV,
-            FEEDBACK_RAW_TABLE: FEEDBACK_RAW_CSV,
-            FEEDBACK_REVIEWED_TABLE: FEEDBACK_REVIEWED_CSV,
-        }
-
-        csv_file = csv_mapping.get(table_name)
+        csv_file = TABLE_CSV_PATHS.get(table_name)
         if csv_file:
             _save_to_csv(data, csv_file)
         else:
             print(f"Warning: Unknown table name {table_name}. Saving to generic CSV.")
             _save_to_csv(data, f"data/{table_name.replace('dbo.', '')}.csv")
 
+    bump_table_version(table_name)
+
 
 # ===== LOCATION SERVICE FUNCTIONS =====
 def get_office_locations_json():
@@ -646,7 +1073,12 @@ def system_health_check():
             conn = safe_get_conn()
             if conn:
                 conn.close()
-                health_report["database"] = {"status": "healthy", "details": "SQL connection successful"}
+                pool_stats = get_connection_pool().stats()
+                health_report["database"] = {
+                    "status": "healthy",
+                    "details": f"SQL connection successful (pool: {pool_stats['in_use']} in use, "
+                               f"{pool_stats['idle']} idle, max {pool_stats['max_size']})"
+                }
             else:
                 health_report["database"] = {"status": "degraded",
                                              "details": "SQL connection failed, using CSV fallback"}
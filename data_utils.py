@@ -6,14 +6,18 @@ based on config.py settings
 import pandas as pd
 import os
 from datetime import datetime
+from functools import wraps
 from config import (
-    USE_SQL, safe_get_conn,
+    USE_SQL, USE_PARQUET, sql_connection, bump_table_version,
     EMPLOYEE_MASTER_CSV, EMPLOYEE_DATA_CSV, SALARY_LOG_CSV,
     FEEDBACK_LOG_CSV, VERIFIED_ADMINS_CSV, RESIGNATION_LOG_CSV,
     EMPLOYEE_MASTER_TABLE, EMPLOYEE_DATA_TABLE, SALARY_LOG_TABLE,
     FEEDBACK_LOG_TABLE, VERIFIED_ADMIN_TABLE, RESIGNATION_LOG_TABLE,
     safe_float, safe_datetime_for_sql
 )
+import parquet_store
+import attendance_log
+import attendance_journal
 
 # Global variable to store debug messages for Streamlit
 DEBUG_MESSAGES = []
@@ -38,24 +42,53 @@ def clear_debug_messages():
     DEBUG_MESSAGES = []
 
 
+def invalidates(table_name):
+    """Decorator for writers: bump the table's change counter after a successful write"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            if result:
+                bump_table_version(table_name)
+            return result
+        return wrapper
+    return decorator
+
+
+def _read_local_table(table_name, csv_path, employee_id=None):
+    """
+    CSV-mode read: attendance comes from the monthly event log when it is
+    enabled, other tables from the typed Parquet copy when USE_PARQUET is on
+    (employee_id filter pushed down), otherwise from the CSV file itself.
+    Every source matches employee_id the same way ("1" and "1.0" are one employee).
+    """
+    if table_name == EMPLOYEE_DATA_TABLE and attendance_log.is_enabled():
+        return attendance_log.read_attendance(employee_id=employee_id)
+    if USE_PARQUET:
+        return parquet_store.read_table(table_name, employee_id=employee_id)
+    df = pd.read_csv(csv_path, dtype={"employee_id": str})
+    if employee_id is not None and "employee_id" in df.columns:
+        wanted = attendance_log.normalize_employee_id(employee_id)
+        df = df[df["employee_id"].map(attendance_log.normalize_employee_id) == wanted]
+    return df
+
+
 # ==================== EMPLOYEE MASTER ====================
 
 def get_employee_master():
     """Get employee master data from SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 query = f"SELECT * FROM {EMPLOYEE_MASTER_TABLE}"
                 df = pd.read_sql(query, conn)
-                conn.close()
                 return df
         except Exception as e:
             add_debug_message(f"SQL Error in get_employee_master: {e}")
 
     # CSV fallback
     if os.path.exists(EMPLOYEE_MASTER_CSV):
-        return pd.read_csv(EMPLOYEE_MASTER_CSV, dtype={"employee_id": str})
+        return _read_local_table(EMPLOYEE_MASTER_TABLE, EMPLOYEE_MASTER_CSV)
     else:
         return pd.DataFrame(columns=[
             'employee_id', 'employee_name', 'department', 'position',
@@ -63,12 +96,12 @@ def get_employee_master():
         ])
 
 
+@invalidates(EMPLOYEE_MASTER_TABLE)
 def add_employee(employee_data):
     """Add new employee to SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
                 insert_query = f"""
                 INSERT INTO {EMPLOYEE_MASTER_TABLE} 
@@ -85,7 +118,6 @@ def add_employee(employee_data):
                     str(employee_data.get('status', 'Active'))
                 ])
                 conn.commit()
-                conn.close()
                 return True
         except Exception as e:
             add_debug_message(f"SQL Error in add_employee: {e}")
@@ -109,25 +141,20 @@ def get_employee_data(employee_id=None):
     """Get employee data from SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 if employee_id:
                     query = f"SELECT * FROM {EMPLOYEE_DATA_TABLE} WHERE employee_id = ?"
                     df = pd.read_sql(query, conn, params=[str(employee_id)])
                 else:
                     query = f"SELECT * FROM {EMPLOYEE_DATA_TABLE}"
                     df = pd.read_sql(query, conn)
-                conn.close()
-                return df
+                return attendance_journal.drop_tracking_column(df)
         except Exception as e:
             add_debug_message(f"SQL Error in get_employee_data: {e}")
 
-    # CSV fallback
-    if os.path.exists(EMPLOYEE_DATA_CSV):
-        df = pd.read_csv(EMPLOYEE_DATA_CSV, dtype={"employee_id": str})
-        if employee_id:
-            return df[df['employee_id'] == str(employee_id)]
-        return df
+    # CSV fallback (punches may live only in the attendance event log)
+    if os.path.exists(EMPLOYEE_DATA_CSV) or attendance_log.is_enabled():
+        return _read_local_table(EMPLOYEE_DATA_TABLE, EMPLOYEE_DATA_CSV, employee_id=employee_id or None)
     else:
         return pd.DataFrame(columns=[
             'employee_id', 'date', 'attendance_status', 'hours_worked',
@@ -135,12 +162,12 @@ def get_employee_data(employee_id=None):
         ])
 
 
+@invalidates(EMPLOYEE_DATA_TABLE)
 def add_employee_data(data):
     """Add employee data record to SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
                 insert_query = f"""
                 INSERT INTO {EMPLOYEE_DATA_TABLE}
@@ -156,18 +183,21 @@ def add_employee_data(data):
                     str(data.get('notes', ''))
                 ])
                 conn.commit()
-                conn.close()
                 return True
         except Exception as e:
             add_debug_message(f"SQL Error in add_employee_data: {e}")
 
     # CSV fallback
     try:
+        if attendance_log.is_enabled():
+            attendance_log.put_row({**data, "date_only": data.get("date_only") or data.get("date")})
+            return True
         df = get_employee_data()
         new_row = pd.DataFrame([data])
         df = pd.concat([df, new_row], ignore_index=True)
         os.makedirs(os.path.dirname(EMPLOYEE_DATA_CSV), exist_ok=True)
         df.to_csv(EMPLOYEE_DATA_CSV, index=False)
+        attendance_journal.record_change(data["employee_id"], data.get("date_only") or data.get("date"), "add_employee_data")
         return True
     except Exception as e:
         add_debug_message(f"CSV Error in add_employee_data: {e}")
@@ -187,8 +217,7 @@ def get_salary_log(employee_id=None, start_date=None, end_date=None, debug_mode=
     if USE_SQL:
         try:
             add_debug_message("Attempting SQL connection...")
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 add_debug_message("SQL connection successful")
                 query = f"SELECT * FROM {SALARY_LOG_TABLE} WHERE 1=1"
                 params = []
@@ -215,7 +244,6 @@ def get_salary_log(employee_id=None, start_date=None, end_date=None, debug_mode=
                 add_debug_message(f"Query parameters: {params}")
 
                 df = pd.read_sql(query, conn, params=params)
-                conn.close()
 
                 add_debug_message(f"SQL returned {len(df)} records")
                 if not df.empty:
@@ -230,9 +258,6 @@ def get_salary_log(employee_id=None, start_date=None, end_date=None, debug_mode=
                 add_debug_message(f"Returning SQL data with {len(df)} records")
                 return df
 
-            else:
-                add_debug_message("SQL connection failed (safe_get_conn returned None), falling back to CSV")
-
         except Exception as e:
             add_debug_message(f"SQL Error in get_salary_log: {e}")
             add_debug_message(f"Exception type: {type(e).__name__}")
@@ -243,7 +268,7 @@ def get_salary_log(employee_id=None, start_date=None, end_date=None, debug_mode=
     add_debug_message("Using CSV fallback")
     if os.path.exists(SALARY_LOG_CSV):
         add_debug_message(f"CSV file exists: {SALARY_LOG_CSV}")
-        df = pd.read_csv(SALARY_LOG_CSV, dtype={"employee_id": str})
+        df = _read_local_table(SALARY_LOG_TABLE, SALARY_LOG_CSV, employee_id=employee_id or None)
         add_debug_message(f"CSV loaded with {len(df)} records")
 
         # Normalize IDs in the DataFrame
@@ -294,8 +319,7 @@ def debug_salary_in_streamlit(employee_id):
     # Test SQL connection first
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 st.success("✅ SQL connection test successful")
 
                 cursor = conn.cursor()
@@ -340,9 +364,6 @@ def debug_salary_in_streamlit(employee_id):
                         sample_df = pd.DataFrame([test_results[0]], columns=columns)
                         st.dataframe(sample_df)
 
-                conn.close()
-            else:
-                st.error("❌ SQL connection failed (safe_get_conn returned None)")
         except Exception as e:
             st.error(f"❌ SQL connection test failed: {e}")
             st.code(str(e))
@@ -382,12 +403,12 @@ def debug_salary_in_streamlit(employee_id):
         st.code(traceback.format_exc())
 
 
+@invalidates(SALARY_LOG_TABLE)
 def add_salary_record(salary_data):
     """Add salary record to SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
                 insert_query = f"""
                 INSERT INTO {SALARY_LOG_TABLE}
@@ -404,7 +425,6 @@ def add_salary_record(salary_data):
                     str(salary_data.get('pay_period', ''))
                 ])
                 conn.commit()
-                conn.close()
                 return True
         except Exception as e:
             add_debug_message(f"SQL Error in add_salary_record: {e}")
@@ -428,22 +448,20 @@ def get_feedback_log(employee_id=None):
     """Get feedback log from SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 if employee_id:
                     query = f"SELECT * FROM {FEEDBACK_LOG_TABLE} WHERE employee_id = ? ORDER BY feedback_date DESC"
                     df = pd.read_sql(query, conn, params=[str(employee_id)])
                 else:
                     query = f"SELECT * FROM {FEEDBACK_LOG_TABLE} ORDER BY feedback_date DESC"
                     df = pd.read_sql(query, conn)
-                conn.close()
                 return df
         except Exception as e:
             add_debug_message(f"SQL Error in get_feedback_log: {e}")
 
     # CSV fallback
     if os.path.exists(FEEDBACK_LOG_CSV):
-        df = pd.read_csv(FEEDBACK_LOG_CSV, dtype={"employee_id": str})
+        df = _read_local_table(FEEDBACK_LOG_TABLE, FEEDBACK_LOG_CSV)
         if employee_id:
             df = df[df['employee_id'] == str(employee_id)]
         return df.sort_values('feedback_date', ascending=False) if 'feedback_date' in df.columns else df
@@ -454,12 +472,12 @@ def get_feedback_log(employee_id=None):
         ])
 
 
+@invalidates(FEEDBACK_LOG_TABLE)
 def add_feedback(feedback_data):
     """Add feedback record to SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
                 insert_query = f"""
                 INSERT INTO {FEEDBACK_LOG_TABLE}
@@ -475,7 +493,6 @@ def add_feedback(feedback_data):
                     str(feedback_data.get('reviewer', ''))
                 ])
                 conn.commit()
-                conn.close()
                 return True
         except Exception as e:
             add_debug_message(f"SQL Error in add_feedback: {e}")
@@ -500,11 +517,9 @@ def get_resignation_data():
     try:
         if USE_SQL:
             try:
-                conn = safe_get_conn()
-                if conn:
+                with sql_connection() as conn:
                     query = f"SELECT * FROM {RESIGNATION_LOG_TABLE} ORDER BY resignation_date DESC"
                     df = pd.read_sql(query, conn)
-                    conn.close()
 
                     # Ensure correct dtypes based on your SQL table
                     for col in ["employee_id", "employee_name", "department", "status", "complied_notice"]:
@@ -528,7 +543,7 @@ def get_resignation_data():
 
         # CSV fallback
         if os.path.exists(RESIGNATION_LOG_CSV):
-            df = pd.read_csv(RESIGNATION_LOG_CSV, dtype={"employee_id": str})
+            df = _read_local_table(RESIGNATION_LOG_TABLE, RESIGNATION_LOG_CSV)
 
             # Ensure correct dtypes
             for col in ["employee_id", "employee_name", "department", "status", "complied_notice"]:
@@ -562,12 +577,12 @@ def get_resignation_data():
         ])
 
 
+@invalidates(RESIGNATION_LOG_TABLE)
 def add_resignation_record(resignation_data):
     """Add resignation record to SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
                 insert_query = f"""
                 INSERT INTO {RESIGNATION_LOG_TABLE}
@@ -587,7 +602,6 @@ def add_resignation_record(resignation_data):
                     bool(resignation_data.get('admin_cleared', False))
                 ])
                 conn.commit()
-                conn.close()
                 return True
         except Exception as e:
             print(f"SQL Error in add_resignation_record: {e}")
@@ -605,12 +619,12 @@ def add_resignation_record(resignation_data):
         return False
 
 
+@invalidates(RESIGNATION_LOG_TABLE)
 def update_resignation_status(employee_id, new_status, admin_cleared=None):
     """Update resignation status for an employee"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
                 if admin_cleared is not None:
                     update_query = f"""
@@ -627,7 +641,6 @@ def update_resignation_status(employee_id, new_status, admin_cleared=None):
                     """
                     cursor.execute(update_query, [new_status, str(employee_id)])
                 conn.commit()
-                conn.close()
                 return True
         except Exception as e:
             print(f"SQL Error in update_resignation_status: {e}")
@@ -648,12 +661,12 @@ def update_resignation_status(employee_id, new_status, admin_cleared=None):
         return False
 
 
+@invalidates(RESIGNATION_LOG_TABLE)
 def update_resignation_compliance(employee_id, complied_notice):
     """Update resignation notice compliance for an employee"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
                 update_query = f"""
                 UPDATE {RESIGNATION_LOG_TABLE} 
@@ -662,7 +675,6 @@ def update_resignation_compliance(employee_id, complied_notice):
                 """
                 cursor.execute(update_query, [str(complied_notice), str(employee_id)])
                 conn.commit()
-                conn.close()
                 return True
         except Exception as e:
             print(f"SQL Error in update_resignation_compliance: {e}")
@@ -751,11 +763,9 @@ def get_verified_admins():
     """Get verified admins from SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 query = f"SELECT * FROM {VERIFIED_ADMIN_TABLE}"
                 df = pd.read_sql(query, conn)
-                conn.close()
                 return df
         except Exception as e:
             print(f"SQL Error in get_verified_admins: {e}")
@@ -774,7 +784,7 @@ def get_data_source_info():
     return {
         'using_sql': USE_SQL,
         'data_source': 'SQL Server' if USE_SQL else 'CSV Files',
-        'sql_available': bool(safe_get_conn()) if USE_SQL else False
+        'sql_available': test_data_connection()[0] if USE_SQL else False
     }
 
 
@@ -782,11 +792,9 @@ def test_data_connection():
     """Test the current data connection"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT 1")
-                conn.close()
                 return True, "SQL connection successful"
         except Exception as e:
             return False, f"SQL connection failed: {e}"
@@ -0,0 +1,380 @@
+# email_delivery.py
+"""
+Pooled, rate-limited delivery of payslip emails.
+
+utils/email_tools.send_email opens a connection, does STARTTLS and logs in for
+every single message. A DeliveryRun instead sends from a few worker threads,
+each keeping one authenticated SMTP session open for up to
+EMAIL_DELIVERY_SETTINGS["messages_per_session"] messages, paced by a shared
+rate limit. Temporary failures (dropped connections, 4xx replies) are retried
+with exponential backoff; 5xx replies and refused recipients fail at once. A
+login failure stops the run, leaving the rest of the batch queued.
+
+Everything is persisted under EMAIL_DELIVERY_SETTINGS["dir"]:
+- <batch_id>/<message_id>.pdf: the attachment, removed once it is sent
+- <batch_id>/sending.lock: lease held by the run sending the batch, released
+  when its workers finish (also when the process dies)
+- deliveries.csv: append-only log, one line per state change (queued, retry,
+  sent, failed); the latest line is a message's state
+
+so the unsent part of a batch can be resumed after failures or a restart. A
+batch whose lease is held is still being sent: it is not listed as unsent and
+resume() refuses it, so no message goes out twice. Failed messages (5xx
+replies, refused recipients, retries used up) are only resumed on request.
+SMTP passwords are never written; resuming needs the SMTP settings again
+(from the UI, or SMTP_HOST / SMTP_PORT / SMTP_USER / SMTP_PASSWORD /
+SMTP_SENDER / SMTP_STARTTLS on the command line).
+
+    python email_delivery.py status                    # every batch
+    python email_delivery.py status payslips_2025-07_20250801-101500
+    python email_delivery.py resume payslips_2025-07_20250801-101500
+    python email_delivery.py resume payslips_2025-07_20250801-101500 --include-failed
+"""
+import argparse
+import csv
+import os
+import queue
+import re
+import smtplib
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from config import EMAIL_DELIVERY_SETTINGS
+from utils.email_tools import build_payslip_message, open_smtp_session
+from utils.file_lock import acquire_lease, is_leased, release_lease
+
+DELIVERY_COLUMNS = ["logged_at", "batch_id", "message_id", "recipient", "filename", "status", "attempts", "error"]
+UNSENT_STATUSES = ("queued", "retry")  # "failed" is added only when asked for
+
+
+class BatchInProgressError(RuntimeError):
+    """Another run (this process or another one) is still sending the batch"""
+
+_log_lock = threading.Lock()
+
+
+# ==================== QUEUE ON DISK ====================
+
+def _queue_dir():
+    return EMAIL_DELIVERY_SETTINGS.get("dir", "data/email_queue")
+
+
+def _log_path():
+    return os.path.join(_queue_dir(), "deliveries.csv")
+
+
+def attachment_path(batch_id, message_id):
+    return os.path.join(_queue_dir(), batch_id, f"{message_id}.pdf")
+
+
+def _lease_path(batch_id):
+    return os.path.join(_queue_dir(), batch_id, "sending")
+
+
+def is_sending(batch_id):
+    """True while a run holds the batch's lease"""
+    return is_leased(_lease_path(batch_id))
+
+
+def _unsent_statuses(include_failed):
+    return UNSENT_STATUSES + ("failed",) if include_failed else UNSENT_STATUSES
+
+
+def new_batch_id(label):
+    """Unique, filesystem-safe id for a new batch, e.g. payslips_2025-07_20250801-101500"""
+    label = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(label)).strip("_")
+    return f"{label}_{datetime.now():%Y%m%d-%H%M%S}"
+
+
+def _log_events(rows):
+    path = _log_path()
+    with _log_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            if is_new:
+                writer.writerow(DELIVERY_COLUMNS)
+            writer.writerows(rows)
+
+
+def _log_event(batch_id, message_id, recipient, filename, status, attempts, error=""):
+    _log_events([[datetime.now().isoformat(timespec="seconds"), batch_id, message_id, recipient,
+                  filename, status, attempts, str(error).replace("\n", " ")]])
+
+
+def delivery_log(batch_id=None):
+    """Current state of every message (of one batch, or all), one row per message"""
+    path = _log_path()
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=DELIVERY_COLUMNS)
+    with _log_lock:
+        log = pd.read_csv(path, dtype=str, keep_default_na=False)
+    if batch_id is not None:
+        log = log[log["batch_id"] == batch_id]
+    log = log.drop_duplicates(["batch_id", "message_id"], keep="last")
+    log["attempts"] = pd.to_numeric(log["attempts"], errors="coerce").fillna(0).astype(int)
+    return log.reset_index(drop=True)
+
+
+def unsent_batches(include_failed=False):
+    """{batch_id: number of messages not yet sent}, oldest batch first; batches being sent are left out"""
+    log = delivery_log()
+    unsent = log[log["status"].isin(_unsent_statuses(include_failed))]
+    counts = unsent.groupby("batch_id", sort=True).size().to_dict()
+    return {batch_id: count for batch_id, count in counts.items() if not is_sending(batch_id)}
+
+
+# ==================== SENDING ====================
+
+class RateLimiter:
+    """Spaces calls evenly so that at most per_minute happen per minute (0 = no limit)"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _is_permanent(error):
+    """Failures a retry will not fix: refused recipients and 5xx replies"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+
+def _close_session(session):
+    if session is None:
+        return
+    try:
+        session.quit()
+    except Exception:
+        session.close()
+
+
+class DeliveryRun:
+    """
+    Sends one batch from a pool of worker threads. Add messages with submit()
+    (new) or put() (already queued on disk), then close() and poll wait() and
+    counts() from the caller's thread; workers never touch the UI.
+    Holds the batch's lease until the last worker exits; raises
+    BatchInProgressError when another run holds it.
+    """
+
+    def __init__(self, batch_id, smtp_config, workers=None):
+        self._lease = acquire_lease(_lease_path(batch_id))
+        if self._lease is None:
+            raise BatchInProgressError(f"Batch {batch_id} is still being sent")
+        self.batch_id = batch_id
+        self.smtp_config = smtp_config
+        self.error = None  # Set when the run had to stop early (e.g. SMTP login failed)
+        self._max_attempts = EMAIL_DELIVERY_SETTINGS.get("max_attempts", 5)
+        self._per_session = EMAIL_DELIVERY_SETTINGS.get("messages_per_session", 100)
+        self._limiter = RateLimiter(EMAIL_DELIVERY_SETTINGS.get("max_per_minute", 0))
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._counts_lock = threading.Lock()
+        self._counts = {"total": 0, "sent": 0, "failed": 0}
+
+        workers = max(1, workers or EMAIL_DELIVERY_SETTINGS.get("workers", 4))
+        self._live_workers = workers
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"email-delivery-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # ---------- Feeding ----------
+
+    def submit(self, message_id, recipient, filename, pdf_bytes):
+        """Persist a new message (attachment + queued log line) and queue it"""
+        path = attachment_path(self.batch_id, message_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(pdf_bytes)
+        _log_event(self.batch_id, message_id, recipient, filename, "queued", 0)
+        self.put(message_id, recipient, filename)
+
+    def put(self, message_id, recipient, filename, attempts=0):
+        """Queue a message whose attachment is already on disk"""
+        with self._counts_lock:
+            self._counts["total"] += 1
+        self._queue.put((message_id, recipient, filename, attempts))
+
+    def close(self):
+        """No more messages; workers exit once the queue is drained"""
+        for _ in self._threads:
+            self._queue.put(None)
+
+    def stop(self):
+        """Stop early; whatever is not sent yet stays queued for resume()"""
+        self._stop.set()
+        self.close()
+
+    # ---------- Progress ----------
+
+    def wait(self, timeout=None):
+        """Wait up to timeout seconds for the run to finish; True when it has"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def counts(self):
+        """{"total", "sent", "failed"} so far"""
+        with self._counts_lock:
+            return dict(self._counts)
+
+    def _count(self, key):
+        with self._counts_lock:
+            self._counts[key] += 1
+
+    # ---------- Workers ----------
+
+    def _worker(self):
+        session = None
+        sent_on_session = 0
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if self._stop.is_set():
+                    continue  # Left queued on disk
+                session, sent_on_session = self._deliver(item, session, sent_on_session)
+        finally:
+            _close_session(session)
+            with self._counts_lock:
+                self._live_workers -= 1
+                last = self._live_workers == 0
+            if last:
+                release_lease(self._lease)
+
+    def _deliver(self, item, session, sent_on_session):
+        message_id, recipient, filename, attempts = item
+        path = attachment_path(self.batch_id, message_id)
+        try:
+            with open(path, "rb") as f:
+                msg = build_payslip_message(f.read(), filename, recipient, self.smtp_config["sender"])
+        except OSError as e:
+            _log_event(self.batch_id, message_id, recipient, filename, "failed", attempts, f"Attachment missing: {e}")
+            self._count("failed")
+            return session, sent_on_session
+
+        for attempt in range(1, self._max_attempts + 1):
+            attempts += 1
+            self._limiter.wait()
+            try:
+                if session is None or sent_on_session >= self._per_session:
+                    _close_session(session)
+                    session, sent_on_session = None, 0
+                    session = open_smtp_session(self.smtp_config)
+                session.send_message(msg)
+                sent_on_session += 1
+            except (smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError) as e:
+                # Every other message would fail the same way; keep the batch for resume
+                self.error = f"SMTP login failed: {e}"
+                _log_event(self.batch_id, message_id, recipient, filename, "retry", attempts, self.error)
+                self._stop.set()
+                return None, 0
+            except Exception as e:
+                # The session may be half-way through a transaction; start a fresh one
+                _close_session(session)
+                session, sent_on_session = None, 0
+                if _is_permanent(e) or attempt == self._max_attempts:
+                    _log_event(self.batch_id, message_id, recipient, filename, "failed", attempts, e)
+                    self._count("failed")
+                    return session, sent_on_session
+                _log_event(self.batch_id, message_id, recipient, filename, "retry", attempts, e)
+                delay = min(EMAIL_DELIVERY_SETTINGS.get("backoff_seconds", 5) * 2 ** (attempt - 1),
+                            EMAIL_DELIVERY_SETTINGS.get("backoff_max_seconds", 300))
+                if self._stop.wait(delay):
+                    return session, sent_on_session
+                continue
+
+            _log_event(self.batch_id, message_id, recipient, filename, "sent", attempts)
+            self._count("sent")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return session, sent_on_session
+        return session, sent_on_session
+
+
+def resume(batch_id, smtp_config, workers=None, include_failed=False):
+    """
+    Start a run for every queued or retrying message of a batch, plus the failed
+    ones when include_failed. Raises BatchInProgressError while another run is
+    still sending the batch.
+    """
+    run = DeliveryRun(batch_id, smtp_config, workers=workers)  # Takes the lease before reading the log
+    log = delivery_log(batch_id)
+    for row in log[log["status"].isin(_unsent_statuses(include_failed))].itertuples():
+        run.put(row.message_id, row.recipient, row.filename, attempts=row.attempts)
+    run.close()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or resume queued payslip emails")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status_parser = subparsers.add_parser("status", help="Messages per batch and state")
+    status_parser.add_argument("batch_id", nargs="?")
+    resume_parser = subparsers.add_parser("resume", help="Send the unsent messages of a batch")
+    resume_parser.add_argument("batch_id")
+    resume_parser.add_argument("--workers", type=int, default=None)
+    resume_parser.add_argument("--include-failed", action="store_true",
+                               help="Also re-send messages that failed permanently")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        log = delivery_log(args.batch_id)
+        if log.empty:
+            print("No deliveries logged.")
+            return
+        print(log.groupby(["batch_id", "status"]).size().unstack(fill_value=0).to_string())
+        return
+
+    smtp_config = {
+        "host": os.getenv("SMTP_HOST", ""),
+        "port": int(os.getenv("SMTP_PORT", "587")),
+        "user": os.getenv("SMTP_USER", ""),
+        "password": os.getenv("SMTP_PASSWORD", ""),
+        "sender": os.getenv("SMTP_SENDER", os.getenv("SMTP_USER", "")),
+        "starttls": os.getenv("SMTP_STARTTLS", "1") not in ("0", "false", "False"),
+    }
+    if not smtp_config["host"]:
+        parser.error("Set SMTP_HOST (and SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_SENDER) to resume")
+
+    try:
+        run = resume(args.batch_id, smtp_config, workers=args.workers, include_failed=args.include_failed)
+    except BatchInProgressError as e:
+        parser.exit(1, f"{e}\n")
+    while not run.wait(timeout=2):
+        counts = run.counts()
+        print(f"{counts['sent'] + counts['failed']}/{counts['total']} done")
+    counts = run.counts()
+    print(f"Sent {counts['sent']}, failed {counts['failed']} of {counts['total']}")
+    if run.error:
+        print(run.error)
+
+
+if __name__ == "__main__":
+    main()
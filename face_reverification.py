@@ -0,0 +1,165 @@
+# face_reverification.py
+"""
+Offline re-verification of attendance punches.
+
+Re-scores the face match of employee_data records in a date range (e.g. after
+a badge photo was replaced or MOBILE_SETTINGS["face_match_threshold"] changed)
+and writes a CSV report.
+
+Punches whose camera snapshot was archived (FACE_SNAPSHOT_SETTINGS) are scored
+again against the current badge with compare_faces_batch; the others are judged
+from their stored confidence against the new threshold.
+
+    python face_reverification.py --start 2025-07-01 --end 2025-07-31
+    python face_reverification.py --start 2025-07-01 --end 2025-07-31 --threshold 40 --workers 4
+"""
+import argparse
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from config import (
+    BADGE_DIR, EMPLOYEE_DATA_TABLE, MOBILE_SETTINGS, FACE_SNAPSHOT_SETTINGS,
+)
+from repository import read_table
+from utils.biometric_utils import compare_faces_batch
+
+SNAPSHOT_EXTENSIONS = (".jpg", ".jpeg", ".png")
+REPORT_COLUMNS = [
+    "employee_id", "employee_name", "date_only", "method", "badge_path", "snapshot_path",
+    "stored_confidence", "stored_verified", "new_confidence", "new_verified",
+    "score_method", "status", "changed",
+]
+
+
+# ==================== SNAPSHOT ARCHIVE ====================
+
+def snapshot_path(employee_id, day, extension=".jpg"):
+    """Archive location of one employee's snapshot for a day"""
+    day = pd.Timestamp(day).strftime("%Y-%m-%d")
+    return os.path.join(FACE_SNAPSHOT_SETTINGS["dir"], str(employee_id).strip(), f"{day}{extension}")
+
+
+def archive_snapshot(employee_id, day, snapshot):
+    """
+    Store the camera snapshot of a verified punch as-is (no re-encoding), if
+    archiving is enabled. Returns the path written, or None.
+    """
+    if not FACE_SNAPSHOT_SETTINGS.get("archive_enabled"):
+        return None
+    data = snapshot.getvalue() if hasattr(snapshot, "getvalue") else bytes(snapshot)
+    path = snapshot_path(employee_id, day)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+    except OSError as e:
+        print(f"Could not archive snapshot for {employee_id}: {e}")
+        return None
+
+
+def find_snapshot(employee_id, day):
+    """Archived snapshot for (employee_id, day), or None"""
+    for extension in SNAPSHOT_EXTENSIONS:
+        path = snapshot_path(employee_id, day, extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def badge_path_for(employee_name):
+    """Badge photo location, named the same way the attendance view expects"""
+    return os.path.join(BADGE_DIR, f"{str(employee_name).lower().strip()}.jpg")
+
+
+# ==================== RE-VERIFICATION ====================
+
+def load_punches(start_date, end_date):
+    """Face-verified attendance records with date_only in [start_date, end_date]"""
+    df = read_table(EMPLOYEE_DATA_TABLE)
+    if df.empty:
+        return df
+    df["date_only"] = pd.to_datetime(df["date_only"], errors="coerce").dt.date
+    df = df[(df["date_only"] >= start_date) & (df["date_only"] <= end_date)]
+    # Manual entries never went through the camera
+    if "method" in df.columns:
+        df = df[df["method"].fillna("").astype(str).str.lower() != "manual"]
+    df["employee_id"] = df["employee_id"].astype(str).str.replace(r"\.0$", "", regex=True)
+    return df.reset_index(drop=True)
+
+
+def reverify(start_date, end_date, threshold=None, workers=None):
+    """Re-score every punch in the range; returns the report as a DataFrame"""
+    threshold = MOBILE_SETTINGS["face_match_threshold"] if threshold is None else threshold
+    punches = load_punches(start_date, end_date)
+
+    rows = []
+    pairs = []
+    for punch in punches.itertuples(index=False):
+        stored = pd.to_numeric(getattr(punch, "confidence", None), errors="coerce")
+        badge = badge_path_for(punch.employee_name)
+        snapshot = find_snapshot(punch.employee_id, punch.date_only)
+        row = {
+            "employee_id": punch.employee_id,
+            "employee_name": punch.employee_name,
+            "date_only": punch.date_only,
+            "method": getattr(punch, "method", None),
+            "badge_path": badge,
+            "snapshot_path": snapshot,
+            "stored_confidence": stored,
+            "stored_verified": bool(stored >= MOBILE_SETTINGS["face_match_threshold"]) if pd.notna(stored) else None,
+            "new_confidence": stored,
+            "new_verified": bool(stored >= threshold) if pd.notna(stored) else None,
+            "score_method": "stored",
+            "status": "no_snapshot",
+        }
+        if not os.path.exists(badge):
+            row["status"] = "no_badge"
+        elif snapshot is not None:
+            row["status"] = "rescored"
+            pairs.append((len(rows), badge, snapshot))
+        rows.append(row)
+
+    results = compare_faces_batch([(badge, snapshot) for _, badge, snapshot in pairs], threshold, workers)
+    for (index, _, _), result in zip(pairs, results):
+        rows[index].update(
+            new_confidence=round(result["confidence"], 2),
+            new_verified=result["verified"],
+            score_method=result["method"],
+        )
+
+    report = pd.DataFrame(rows, columns=REPORT_COLUMNS)
+    report["changed"] = report["stored_verified"].notna() & (report["stored_verified"] != report["new_verified"])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-verify face matches of attendance punches in a date range")
+    parser.add_argument("--start", required=True, help="First date (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, help="Last date (YYYY-MM-DD)")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Match threshold in percent (default: MOBILE_SETTINGS['face_match_threshold'])")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: FACE_MODEL_POOL_SIZE)")
+    parser.add_argument("--output", default=None, help="Report CSV path (default: logs/face_reverification_<start>_<end>.csv)")
+    args = parser.parse_args()
+
+    start_date = datetime.strptime(args.start, "%Y-%m-%d").date()
+    end_date = datetime.strptime(args.end, "%Y-%m-%d").date()
+    report = reverify(start_date, end_date, args.threshold, args.workers)
+
+    output = args.output or os.path.join(
+        FACE_SNAPSHOT_SETTINGS.get("report_dir", "logs"),
+        f"face_reverification_{start_date:%Y%m%d}_{end_date:%Y%m%d}.csv",
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    report.to_csv(output, index=False)
+
+    counts = report["status"].value_counts().to_dict()
+    print(f"Re-verified {len(report)} punches ({counts}); {int(report['changed'].sum())} changed outcome.")
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
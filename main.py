@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 import sys
 import os
 import pandas as pd
+import threading
 def login():
     st.title("🔒 Validex App Login")
     password = st.text_input("Enter password", type="password")
@@ -23,10 +24,13 @@ from views import admin, employee
 
 # Import config settings
 from config import (
-    USE_SQL, safe_get_conn,
+    USE_SQL, sql_connection, invalidate_schema,
     EMPLOYEE_MASTER_CSV, VERIFIED_ADMINS_CSV,
     EMPLOYEE_MASTER_TABLE, VERIFIED_ADMIN_TABLE
 )
+from repository import read_table
+from schema_migrations import run_migrations
+from utils.biometric_utils import warm_up_face_models
 # Inject manifest.json
 st.markdown(
     """
@@ -49,6 +53,33 @@ st.markdown(
 st.set_page_config(page_title="Secure Login | Shri Swami Samarth Pvt. Ltd", layout="wide")
 
 
+# ---------- FACE MODEL WARM-UP ----------
+@st.cache_resource
+def start_face_model_warm_up():
+    """Load the MediaPipe models once per server process, in the background"""
+    thread = threading.Thread(target=warm_up_face_models, name="face-model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+start_face_model_warm_up()
+
+
+# ---------- SCHEMA MIGRATIONS ----------
+@st.cache_resource
+def apply_schema_migrations():
+    """Run the table DDL once per server process instead of on every request (see schema_migrations.py)"""
+    if not USE_SQL:
+        return []
+    failures = run_migrations()
+    for name, error in failures:
+        print(f"Schema migration failed ({name}): {error}")
+    return failures
+
+
+apply_schema_migrations()
+
+
 # ---------- SECURITY HELPER FUNCTIONS (MOVED TO TOP) ----------
 def generate_session_token():
     """Generate a simple session token for additional security"""
@@ -110,20 +141,16 @@ def get_employee_master():
     """Get employee master data from SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
-                query = f"SELECT * FROM {EMPLOYEE_MASTER_TABLE}"
-                df = pd.read_sql(query, conn)
-                conn.close()
-                # Ensure proper column names
-                df.columns = df.columns.str.strip().str.lower()
-                return df
+            df = read_table(EMPLOYEE_MASTER_TABLE)
+            # Ensure proper column names
+            df.columns = df.columns.str.strip().str.lower()
+            return df
         except Exception as e:
             st.error(f"SQL Error: {e}. Falling back to CSV.")
 
     # CSV fallback or when USE_SQL is False
     if os.path.exists(EMPLOYEE_MASTER_CSV):
-        df = pd.read_csv(EMPLOYEE_MASTER_CSV, dtype={"employee_id": str})
+        df = read_table(EMPLOYEE_MASTER_TABLE, use_sql=False)
         df.columns = df.columns.str.strip().str.lower()
         return df
     else:
@@ -134,11 +161,9 @@ def get_verified_admins():
     """Get verified admins data from SQL or CSV based on config"""
     if USE_SQL:
         try:
-            conn = safe_get_conn()
-            if conn:
+            with sql_connection() as conn:
                 query = f"SELECT * FROM {VERIFIED_ADMIN_TABLE}"
                 df = pd.read_sql(query, conn)
-                conn.close()
                 # Ensure proper column names
                 df.columns = df.columns.str.strip().str.lower()
                 return df
@@ -330,12 +355,8 @@ if st.session_state.login_phase == "initial":
             st.write(f"**USE_SQL Setting:** {USE_SQL}")
             if USE_SQL:
                 try:
-                    conn = safe_get_conn()
-                    if conn:
+                    with sql_connection():
                         st.success("✅ SQL connection successful")
-                        conn.close()
-                    else:
-                        st.error("❌ SQL connection failed")
                 except Exception as e:
                     st.error(f"❌ SQL connection error: {e}")
             else:
@@ -381,12 +402,21 @@ elif st.session_state.login_phase == "verified":
                 emp_id = st.session_state.get("employee_id", "unknown")
                 st.text(f"Employee ID: {emp_id}")
 
+        if role == "admin" and USE_SQL:
+            with st.expander("🗄️ Database Schema"):
+                st.caption("Table and column lists are cached; refresh after changing tables by hand.")
+                if st.button("🔄 Refresh Schema Cache"):
+                    invalidate_schema()
+                    st.success("Schema will be re-read on next use")
+
         if role == "admin":
             st.markdown("### 🛠️ Admin Navigation")
             if st.button("📝 Manual Entry"):
                 st.session_state.active_view = "manual"
             if st.button("💼 Payroll"):
                 st.session_state.active_view = "payroll"
+            if st.button("🧪 Payroll What-If"):
+                st.session_state.active_view = "payrollsimulator"
             if st.button("📈 Appraisal Trends & Insights"):
                 st.session_state.active_view = "appraisal_analytics"
             if st.button("📋 Appraisal Audit"):
@@ -0,0 +1,220 @@
+# parquet_store.py
+"""
+Typed Parquet copies of the CSV tables, used in CSV mode when config.USE_PARQUET
+is on.
+
+The CSV files stay the write format (check-in/out appends single lines, several
+views rewrite them directly), so every existing writer keeps working. Each table
+gets a Parquet copy under PARQUET_DIR with datetime columns already parsed and
+employee_id stored as text. The copy remembers the size/mtime of the CSV it was
+built from and is rebuilt on the next read after the CSV changes, so a CSV is
+parsed once per change instead of once per read.
+
+Reads support column projection and filters on employee_id and month. Copies
+are sorted by month then employee, so the filters are pushed down to Parquet
+row-group statistics instead of being applied after loading everything.
+
+Convert all tables in one go (e.g. after deploying, or from cron):
+    python parquet_store.py            # build missing/stale copies
+    python parquet_store.py --force    # rebuild every copy
+"""
+import argparse
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import (
+    PARQUET_DIR, PARQUET_TABLE_SETTINGS, PARQUET_ROW_GROUP_SIZE, TABLE_CSV_PATHS,
+)
+
+# Schema metadata key holding the "<size>:<mtime_ns>" of the source CSV
+_SOURCE_KEY = b"validex.source_csv"
+_build_lock = threading.Lock()
+
+
+def parquet_path(table_name):
+    """Location of a table's Parquet copy"""
+    return os.path.join(PARQUET_DIR, f"{table_name.replace('dbo.', '')}.parquet")
+
+
+def csv_path(table_name):
+    """Location of the CSV file a table is built from"""
+    return TABLE_CSV_PATHS.get(table_name, f"data/{table_name.replace('dbo.', '')}.csv")
+
+
+def _csv_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _stored_signature(path):
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    value = metadata.get(_SOURCE_KEY)
+    return value.decode() if value else None
+
+
+def is_stale(table_name):
+    """True when the Parquet copy is missing or older than its CSV"""
+    source = csv_path(table_name)
+    if not os.path.exists(source):
+        return False
+    return _stored_signature(parquet_path(table_name)) != _csv_signature(source)
+
+
+# ==================== CONVERSION ====================
+
+def _typed_frame(df, table_name):
+    """Parse the configured datetime columns and sort for row-group pruning"""
+    settings = PARQUET_TABLE_SETTINGS.get(table_name, {})
+    for col in settings.get("datetime_columns", []):
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce", format="mixed")
+
+    sort_by = [col for col in settings.get("sort_by", []) if col in df.columns]
+    if sort_by:
+        df = df.sort_values(sort_by, kind="stable", na_position="last")
+    return df.reset_index(drop=True)
+
+
+def _to_arrow(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # Columns mixing text and numbers: store them as text
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def build_table(table_name):
+    """(Re)build a table's Parquet copy from its CSV. Returns the row count."""
+    source = csv_path(table_name)
+    signature = _csv_signature(source)  # taken before reading, so later edits still look stale
+    # employee_id is read as text, exactly like the CSV readers do
+    df = _typed_frame(pd.read_csv(source, dtype={"employee_id": str}), table_name)
+
+    table = _to_arrow(df)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_SOURCE_KEY] = signature.encode()
+    table = table.replace_schema_metadata(metadata)
+
+    target = parquet_path(table_name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        pq.write_table(table, tmp_path, row_group_size=PARQUET_ROW_GROUP_SIZE, compression="zstd")
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return table.num_rows
+
+
+def ensure_table(table_name, missing_ok=False):
+    """Return the path of an up-to-date Parquet copy (None if there is no CSV and missing_ok)"""
+    if not os.path.exists(csv_path(table_name)):
+        if missing_ok:
+            return None
+        raise FileNotFoundError(f"CSV file not found: {csv_path(table_name)}")
+    if is_stale(table_name):
+        with _build_lock:
+            if is_stale(table_name):
+                build_table(table_name)
+    return parquet_path(table_name)
+
+
+# ==================== READS ====================
+
+def _employee_id_variants(employee_id):
+    """IDs are stored both as "1" and "1.0" in the CSVs; match either form"""
+    value = str(employee_id).strip()
+    variants = {value}
+    try:
+        number = float(value)
+        if number.is_integer():
+            variants.update({str(int(number)), f"{int(number)}.0"})
+    except ValueError:
+        pass
+    return sorted(variants)
+
+
+def _month_filters(field, month):
+    """Filters selecting one month ("YYYY-MM", date or Period) on the given column"""
+    period = pd.Period(month, freq="M")
+    if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type):
+        start = period.start_time
+        end = (period + 1).start_time
+        return [(field.name, ">=", start), (field.name, "<", end)]
+    return [(field.name, "==", str(period))]
+
+
+def read_table(table_name, columns=None, employee_id=None, month=None, missing_ok=False):
+    """
+    Read a table from its Parquet copy, rebuilding the copy first if the CSV changed.
+
+    columns: only load these columns (unknown names are ignored).
+    employee_id: only rows for this employee ("1" and "1.0" both match).
+    month: only rows in this month, using the table's configured month_column.
+    """
+    path = ensure_table(table_name, missing_ok=missing_ok)
+    if path is None:
+        return pd.DataFrame()
+
+    schema = pq.read_schema(path)
+    filters = []
+    if employee_id is not None and "employee_id" in schema.names:
+        filters.append(("employee_id", "in", _employee_id_variants(employee_id)))
+    month_column = PARQUET_TABLE_SETTINGS.get(table_name, {}).get("month_column")
+    if month is not None and month_column in schema.names:
+        filters.extend(_month_filters(schema.field(month_column), month))
+
+    if columns is not None:
+        columns = [col for col in columns if col in schema.names]
+
+    table = pq.read_table(path, columns=columns, filters=filters or None)
+    return table.to_pandas()
+
+
+# ==================== MIGRATION ====================
+
+def migrate_csv_to_parquet(tables=None, force=False):
+    """
+    Build Parquet copies for the given tables (default: every table with a CSV).
+    Returns {table_name: row count, "skipped" or an error message}.
+    """
+    results = {}
+    for table_name in tables or list(TABLE_CSV_PATHS):
+        if not os.path.exists(csv_path(table_name)):
+            results[table_name] = "skipped (no CSV)"
+            continue
+        if not force and not is_stale(table_name):
+            results[table_name] = "up to date"
+            continue
+        try:
+            with _build_lock:
+                results[table_name] = build_table(table_name)
+        except Exception as e:
+            results[table_name] = f"failed: {e}"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert data/*.csv tables into typed Parquet copies")
+    parser.add_argument("tables", nargs="*", help="Tables to convert, e.g. dbo.employee_data (default: all)")
+    parser.add_argument("--force", action="store_true", help="Rebuild copies that are already up to date")
+    args = parser.parse_args()
+
+    for table_name, result in migrate_csv_to_parquet(args.tables, force=args.force).items():
+        status = f"{result} rows" if isinstance(result, int) else result
+        print(f"{table_name:<28} -> {parquet_path(table_name)}: {status}")
+
+
+if __name__ == "__main__":
+    main()
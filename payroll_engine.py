@@ -0,0 +1,436 @@
+# payroll_engine.py
+"""
+Month-end payroll for the whole workforce in one pass.
+
+views/payroll.build_salary_row_monthly_corrected_lop works one employee at a
+time: every call re-filters the full attendance table, normalizes the status
+column again and walks each day of the month in Python, so a month-end run is
+O(employees x attendance rows). compute_monthly_payroll() groups the month's
+attendance by employee once and computes counts, LOP, extra pay and statutory
+deductions as column operations.
+
+The formulas (and the order the floating point operations happen in) mirror
+the per-row function, so each row it returns has the same values the per-row
+function produces for that employee. Keep the two in step when the rules change.
+
+Preview a month from the command line:
+    python payroll_engine.py 2025-07                      # summary per department
+    python payroll_engine.py 2025-07 --output july.csv    # full salary rows
+"""
+import argparse
+import calendar
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import work_calendar
+from attendance_log import normalize_employee_id
+
+# ---------- Rules ----------
+# Every rate and threshold the salary formulas use, here and in the per-row
+# functions in views/payroll.py. What-if scenarios override some of them (see
+# PayrollSimulator); real payroll always uses these.
+PAYROLL_PARAMETERS = {
+    "basic_percentage": 0.60,
+    "da_percentage": 0.21,
+    "hra_percentage": 0.10,
+    "performance_percentage": 0.09,
+    "pf_rate": 0.12,  # employee and employer share, on basic + DA up to the ceiling
+    "pf_ceiling": 15000,
+    "pf_admin_rate": 0.0065,
+    "esi_ceiling": 21000,  # ESI applies when gross earnings are at or below this
+    "esi_employee_rate": 0.0075,
+    "esi_employer_rate": 0.0325,
+    "mlwf_threshold": 3000,
+    "tax_rate": 0.05,
+    "monthly_leave_accrual": 1.2,
+}
+
+# Credit towards days worked when computing LOP; anything else counts as absent
+LOP_DAY_CREDIT = {"full day": 1.0, "late mark": 1.0, "half day": 0.5}
+
+SALARY_ROW_COLUMNS = [
+    "employee_id", "employee_name", "salary_month", "data_date", "timestamp", "entry_time",
+    "fixed_salary", "basic_salary", "da", "hra", "cell_allowance", "petrol_allowance",
+    "attendance_allowance", "performance_allowance", "ot_hours_amount", "rd_allowance",
+    "lic_allowance", "arrears_allowance", "other_allowance", "gross_earnings", "base_salary",
+    "extra_pay", "festival_bonus", "tuesday_bonus", "tuesday_count", "employee_pf", "employer_pf",
+    "pf_admin_charges", "employee_esi", "employer_esi", "tax_deduction", "mlwf_employee",
+    "mlwf_employer", "advance_deduction", "loan_deduction", "loan_cutting", "fine_deduction",
+    "extra_deduction", "total_deductions", "net_salary", "ctc", "extra_hours", "late_marks",
+    "full_days", "half_days", "earned_leave_taken", "leave_accrued", "leave_balance",
+    "lop_deduction", "leave_encashment", "leave_concession", "leave_concession_amount",
+    "action_type", "description", "lop_days", "days_in_month", "working_days", "total_earnings",
+]
+
+
+def month_bounds(year, month):
+    """(days_in_month, working_days, month_start, month_end) from the shared working-day calendar"""
+    info = work_calendar.month_info(year, month)
+    return info["days_in_month"], info["working_days"], info["month_start"], info["month_end"]
+
+
+def resolve_monthly_salary(new_salary, fixed_salary):
+    """new_salary when it is set and positive, else fixed_salary, else 0.0"""
+    try:
+        if pd.notnull(new_salary) and float(new_salary) > 0:
+            return float(new_salary)
+        if pd.notnull(fixed_salary) and float(fixed_salary) > 0:
+            return float(fixed_salary)
+    except (TypeError, ValueError):
+        pass
+    return 0.0
+
+
+# ==================== ATTENDANCE ====================
+
+def _group_sums(keys, values):
+    """
+    Sum values per key, giving exactly what Series.sum() gives on each key's rows.
+
+    groupby().sum() adds in a different order than NumPy's pairwise summation,
+    which changes the last digits of amounts like extra pay. Summing each key's
+    rows as one contiguous slice, in their original order, keeps them identical.
+    """
+    codes, uniques = pd.factorize(keys, sort=False)
+    order = np.argsort(codes, kind="stable")
+    filled = pd.Series(values).fillna(0).to_numpy(dtype=float)[order]
+    ends = np.cumsum(np.bincount(codes, minlength=len(uniques)))
+    starts = ends - np.bincount(codes, minlength=len(uniques))
+    return pd.Series(
+        [filled[start:end].sum() for start, end in zip(starts, ends)],
+        index=pd.Index(uniques, name="employee_id"), dtype=float,
+    )
+
+
+def summarize_month_attendance(attendance, year, month):
+    """
+    Per-employee attendance figures for one month, indexed by employee_id:
+    full_days, half_days, late_marks, extra_pay, extra_hours and lop_days
+    (raw LOP, before the leave concession).
+
+    employee_id is matched exactly as stored, like the per-row function does.
+    """
+    columns = ["full_days", "half_days", "late_marks", "extra_pay", "extra_hours", "lop_days"]
+    if attendance.empty:
+        return pd.DataFrame(columns=columns, index=pd.Index([], name="employee_id"))
+
+    days_in_month, working_days, month_start, month_end = month_bounds(year, month)
+    month_start = pd.Timestamp(month_start)
+    month_end = pd.Timestamp(month_end)
+
+    dates = pd.to_datetime(attendance["date_only"], errors="coerce")
+    days = dates.dt.normalize()
+    # Only rows dated within the month matter; narrow down before the string work
+    on_day = days.notna() & (days >= month_start) & (days <= month_end)
+    attendance, dates, days = attendance[on_day], dates[on_day], days[on_day]
+    status = attendance["attendance_status"].str.lower().str.strip()
+
+    # Counts and extra pay use rows dated within [first day, last day 00:00]
+    in_month = dates <= month_end
+    month_ids = attendance["employee_id"][in_month]
+    summary = pd.DataFrame({
+        "employee_id": month_ids,
+        "full_days": (status[in_month] == "full day").astype(int),
+        "half_days": (status[in_month] == "half day").astype(int),
+        "late_marks": (status[in_month] == "late mark").astype(int),
+    }).groupby("employee_id", sort=False).sum()
+    for col in ("extra_pay", "extra_hours"):
+        summary[col] = _group_sums(month_ids, attendance[col][in_month]) if col in attendance.columns else 0.0
+
+    # LOP looks at calendar days: the last record per employee and day wins,
+    # Tuesdays are skipped and missing days count as absent
+    daily = pd.DataFrame({
+        "employee_id": attendance["employee_id"],
+        "day": days,
+        "credit": status.map(LOP_DAY_CREDIT).fillna(0.0),
+    }).drop_duplicates(["employee_id", "day"], keep="last")
+    daily = daily[~work_calendar.weekly_off_mask(daily["day"])]
+    effective_days = daily.groupby("employee_id", sort=False)["credit"].sum()
+
+    summary = summary.reindex(summary.index.union(effective_days.index, sort=False), fill_value=0)
+    summary["lop_days"] = np.maximum(0, working_days - effective_days.reindex(summary.index, fill_value=0.0))
+    return summary[columns]
+
+
+# ==================== PAYROLL ====================
+
+def payroll_parameters(overrides=None):
+    """PAYROLL_PARAMETERS with overrides applied; unknown names are an error"""
+    params = dict(PAYROLL_PARAMETERS)
+    for name, value in (overrides or {}).items():
+        if name not in params:
+            raise ValueError(f"Unknown payroll parameter: {name}")
+        params[name] = float(value)
+    return params
+
+
+def employee_monthly_salaries(employees):
+    """Monthly salary per employee row (resolve_monthly_salary over the master)"""
+    new_salary = employees["new_salary"] if "new_salary" in employees.columns else pd.Series(None, index=employees.index)
+    fixed_salary = employees["fixed_salary"] if "fixed_salary" in employees.columns else pd.Series(0, index=employees.index)
+    return pd.Series(
+        [resolve_monthly_salary(new, fixed) for new, fixed in zip(new_salary, fixed_salary)],
+        index=employees.index, dtype=float,
+    )
+
+
+def _attendance_for(employee_ids, summary, working_days):
+    """Month summary aligned to employee_ids, plus raw LOP days"""
+    worked = summary.reindex(employee_ids).reset_index(drop=True)
+    # No attendance at all: absent on every working day
+    lop_days = worked["lop_days"].astype(float).fillna(float(working_days))
+    worked = worked.fillna(0)
+    for col in ("full_days", "half_days", "late_marks"):
+        worked[col] = worked[col].astype(int)
+    return worked, lop_days
+
+
+def salary_figures(monthly_salary, extra_pay, lop_days, days_in_month, params=None):
+    """
+    The salary formulas as column operations: a dict of Series (one value per
+    employee) for earnings, LOP, statutory deductions, net salary and CTC.
+    """
+    p = params or PAYROLL_PARAMETERS
+
+    # Salary components (calculate_salary_components, with OT from attendance)
+    basic_salary = monthly_salary * p["basic_percentage"]
+    da = monthly_salary * p["da_percentage"]
+    hra = monthly_salary * p["hra_percentage"]
+    performance_allowance = monthly_salary * p["performance_percentage"]
+    ot_hours_amount = extra_pay
+    gross_earnings = basic_salary + da + hra + performance_allowance + ot_hours_amount
+
+    # LOP and leave concession
+    daily_rate = monthly_salary / days_in_month
+    leave_concession = np.minimum(lop_days, p["monthly_leave_accrual"])
+    lop_days_final = np.maximum(0, lop_days - leave_concession)
+    lop_deduction = lop_days_final * daily_rate
+    leave_concession_amount = leave_concession * daily_rate
+    total_earnings = (gross_earnings - lop_deduction) + leave_concession_amount
+
+    # Statutory deductions (calculate_statutory_deductions) on gross earnings
+    pf_eligible_amount = np.minimum(basic_salary + da, p["pf_ceiling"])
+    employee_pf = pf_eligible_amount * p["pf_rate"]
+    employer_pf = pf_eligible_amount * p["pf_rate"]
+    pf_admin_charges = pf_eligible_amount * p["pf_admin_rate"]
+    esi_eligible = gross_earnings <= p["esi_ceiling"]
+    employee_esi = (gross_earnings * p["esi_employee_rate"]).where(esi_eligible, 0)
+    employer_esi = (gross_earnings * p["esi_employer_rate"]).where(esi_eligible, 0)
+    mlwf = (gross_earnings > p["mlwf_threshold"]).astype(int)
+
+    tax_deduction = total_earnings * p["tax_rate"]
+    total_deductions = employee_pf + employee_esi + mlwf + tax_deduction
+    net_salary = total_earnings - total_deductions
+    ctc = total_earnings + employer_pf + employer_esi + mlwf + pf_admin_charges
+
+    return {
+        "basic_salary": basic_salary,
+        "da": da,
+        "hra": hra,
+        "performance_allowance": performance_allowance,
+        "ot_hours_amount": ot_hours_amount,
+        "gross_earnings": gross_earnings,
+        "base_salary": daily_rate,
+        "employee_pf": employee_pf,
+        "employer_pf": employer_pf,
+        "pf_admin_charges": pf_admin_charges,
+        "employee_esi": employee_esi,
+        "employer_esi": employer_esi,
+        "tax_deduction": tax_deduction,
+        "mlwf_employee": mlwf,
+        "mlwf_employer": mlwf,
+        "total_deductions": total_deductions,
+        "net_salary": net_salary,
+        "ctc": ctc,
+        "lop_deduction": lop_deduction,
+        "leave_concession": leave_concession,
+        "leave_concession_amount": leave_concession_amount,
+        "lop_days": lop_days_final,
+        "total_earnings": total_earnings,
+    }
+
+
+def compute_monthly_payroll(master, attendance, selected_date):
+    """
+    Salary rows for every employee in `master` for the month of selected_date,
+    as a DataFrame in master order with the columns of SALARY_ROW_COLUMNS
+    (the dicts build_salary_row_monthly_corrected_lop returns, one per row).
+    """
+    year, month = selected_date.year, selected_date.month
+    days_in_month, working_days, _, month_end = month_bounds(year, month)
+    if master.empty:
+        return pd.DataFrame(columns=SALARY_ROW_COLUMNS)
+
+    employees = master.reset_index(drop=True)
+    monthly_salary = employee_monthly_salaries(employees)
+    summary = summarize_month_attendance(attendance, year, month)
+    worked, lop_days = _attendance_for(employees["employee_id"], summary, working_days)
+    figures = salary_figures(monthly_salary, worked["extra_pay"], lop_days, days_in_month)
+
+    now = datetime.datetime.now()
+    rows = pd.DataFrame({
+        "employee_id": employees["employee_id"],
+        "employee_name": employees["employee_name"],
+        "salary_month": f"{year}-{month:02d}",
+        "data_date": month_end,
+        "timestamp": now,
+        "entry_time": now.time(),
+        "fixed_salary": monthly_salary,
+        **figures,
+        "extra_pay": worked["extra_pay"],
+        "extra_hours": worked["extra_hours"],
+        "late_marks": worked["late_marks"],
+        "full_days": worked["full_days"],
+        "half_days": worked["half_days"],
+        "leave_accrued": PAYROLL_PARAMETERS["monthly_leave_accrual"],
+        "action_type": "finalized",
+        "description": f"Auto-generated payroll for {calendar.month_name[month]} {year}",
+        "days_in_month": days_in_month,
+        "working_days": working_days,
+    })
+    # Allowances and deductions this payroll doesn't compute yet
+    return rows.reindex(columns=SALARY_ROW_COLUMNS, fill_value=0)
+
+
+# ==================== WHAT-IF SIMULATION ====================
+
+def month_range(start, end):
+    """'YYYY-MM' strings from start to end inclusive (dates, Periods or strings)"""
+    return [str(period) for period in pd.period_range(pd.Period(start, freq="M"), pd.Period(end, freq="M"), freq="M")]
+
+
+class PayrollSimulator:
+    """
+    What-if payroll for the whole workforce over a range of months, for HR
+    questions like "HRA at 12%" or "leave accrual of 1.5 days". Nothing is saved.
+
+    Attendance is summarized once per month when the simulator is built; each
+    scenario then only re-evaluates the salary formulas (salary_figures) on
+    whole columns, so one scenario over thousands of employees and a year of
+    months takes milliseconds.
+    """
+
+    TOTAL_COLUMNS = ["gross_earnings", "total_deductions", "net_salary", "ctc", "employer_pf", "employer_esi"]
+
+    def __init__(self, master, attendance, months):
+        employees = master.reset_index(drop=True)
+        if "department" in employees.columns:
+            departments = employees["department"].fillna("").astype(str).str.strip().str.title()
+            self.departments = departments.replace("", "Unassigned")
+        else:
+            self.departments = pd.Series("Unassigned", index=employees.index)
+        self.months = list(months)
+        self.monthly_salary = employee_monthly_salaries(employees)
+        self._inputs = []  # (days_in_month, extra_pay, lop_days) per month
+        for month in self.months:
+            period = pd.Period(month, freq="M")
+            days_in_month, working_days, _, _ = month_bounds(period.year, period.month)
+            summary = summarize_month_attendance(attendance, period.year, period.month)
+            worked, lop_days = _attendance_for(employees["employee_id"], summary, working_days)
+            self._inputs.append((days_in_month, worked["extra_pay"], lop_days))
+
+    def totals(self, overrides=None):
+        """Sum of TOTAL_COLUMNS per department over all months, for one parameter set"""
+        params = payroll_parameters(overrides)
+        totals = pd.DataFrame(0.0, index=self.monthly_salary.index, columns=self.TOTAL_COLUMNS)
+        for days_in_month, extra_pay, lop_days in self._inputs:
+            figures = salary_figures(self.monthly_salary, extra_pay, lop_days, days_in_month, params)
+            for col in self.TOTAL_COLUMNS:
+                totals[col] += figures[col]
+        return totals.groupby(self.departments).sum()
+
+    def run(self, overrides, baseline=None):
+        """
+        Department totals for the scenario vs the baseline (default: current rules).
+        Columns: headcount, then <figure>_baseline, <figure>_scenario and
+        <figure>_delta for each of TOTAL_COLUMNS, with an "All departments" row.
+        """
+        before = self.totals(baseline)
+        after = self.totals(overrides)
+        result = pd.DataFrame({"headcount": self.departments.value_counts()}).reindex(before.index)
+        for col in self.TOTAL_COLUMNS:
+            result[f"{col}_baseline"] = before[col]
+            result[f"{col}_scenario"] = after[col]
+            result[f"{col}_delta"] = after[col] - before[col]
+        result.loc["All departments"] = result.sum()
+        result.index.name = "department"
+        return result
+
+
+def simulate_payroll(master, attendance, months, overrides, baseline=None):
+    """One-off what-if run; build a PayrollSimulator to compare many scenarios"""
+    return PayrollSimulator(master, attendance, months).run(overrides, baseline)
+
+
+# ==================== INCREMENTAL RECOMPUTE ====================
+
+def recompute_entries(master, attendance, salary_log, keys):
+    """
+    Rebuild the salary rows for the given (employee_id, salary_month) keys, e.g.
+    the dirty keys from attendance_journal.dirty_keys().
+
+    Returns (new rows, diff report). The report has one line per rebuilt row
+    with the old and new net salary; keys whose employee is no longer in the
+    master are skipped.
+    """
+    months = {}
+    for employee_id, month in keys:
+        months.setdefault(str(month), set()).add(normalize_employee_id(employee_id))
+
+    master_ids = master["employee_id"].map(normalize_employee_id)
+    parts = [
+        compute_monthly_payroll(master[master_ids.isin(ids)], attendance, pd.Period(month, freq="M").start_time)
+        for month, ids in sorted(months.items())
+    ]
+    parts = [part for part in parts if not part.empty]
+    new_rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=SALARY_ROW_COLUMNS)
+
+    report = pd.DataFrame({
+        "employee_id": new_rows["employee_id"],
+        "employee_name": new_rows["employee_name"],
+        "salary_month": new_rows["salary_month"],
+        "key": new_rows["employee_id"].map(normalize_employee_id),
+        "new_net_salary": new_rows["net_salary"].astype(float),
+    })
+    if not salary_log.empty:
+        old = pd.DataFrame({
+            "key": salary_log["employee_id"].map(normalize_employee_id),
+            "salary_month": salary_log["salary_month"].astype(str),
+            "old_net_salary": pd.to_numeric(salary_log["net_salary"], errors="coerce"),
+        }).drop_duplicates(["key", "salary_month"], keep="last")
+        report = report.merge(old, on=["key", "salary_month"], how="left")
+    else:
+        report["old_net_salary"] = np.nan
+    report["difference"] = report["new_net_salary"] - report["old_net_salary"]
+    report = report[["employee_id", "employee_name", "salary_month", "old_net_salary", "new_net_salary", "difference"]]
+    return new_rows, report
+
+
+def main():
+    from repository import read_table
+    from config import EMPLOYEE_MASTER_TABLE, EMPLOYEE_DATA_TABLE
+
+    parser = argparse.ArgumentParser(description="Compute month-end payroll for every employee (nothing is saved)")
+    parser.add_argument("month", help="Month to compute, YYYY-MM")
+    parser.add_argument("--output", help="Write the salary rows to this CSV file")
+    args = parser.parse_args()
+
+    master = read_table(EMPLOYEE_MASTER_TABLE)
+    attendance = read_table(EMPLOYEE_DATA_TABLE)
+    for df in (master, attendance):
+        df["employee_id"] = df["employee_id"].astype(str)
+        df["employee_name"] = df["employee_name"].str.strip().str.lower()
+
+    rows = compute_monthly_payroll(master, attendance, pd.Period(args.month, freq="M").start_time)
+    if args.output:
+        rows.to_csv(args.output, index=False)
+        print(f"Wrote {len(rows)} salary rows to {args.output}")
+
+    by_department = rows.assign(department=master["department"].values if "department" in master.columns else "")
+    print(by_department.groupby("department")[["gross_earnings", "lop_deduction", "net_salary", "ctc"]].sum().round(2))
+
+
+if __name__ == "__main__":
+    main()
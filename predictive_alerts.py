@@ -0,0 +1,345 @@
+# predictive_alerts.py
+"""
+Predictive HR alerts for every employee and salary month in one pass.
+
+views/predictivealerts used to walk the selected department one employee at a
+time: filter salary_log for the current month, sort the employee's history to
+find the previous row, count the month's working days, then build the flags in
+Python. compute_alerts() instead takes the whole salary log, keeps one row per
+(employee, salary month), gets the previous month's figures with a
+groupby-shift and computes every flag as column operations, for all
+departments and months at once. The page filters the result by department and
+month, so changing either selectbox does not recompute anything.
+
+Flags (thresholds in ALERT_RULES):
+- High LOP: working days - (full + 0.5 x half + leave concession) above lop_days
+- Attendance Drop: attendance rate down by attendance_drop or more on the previous month
+- Late Spike: more late marks than the previous month
+- Bonus eligible: full_days >= bonus_full_days, a Tuesday bonus, no late marks, no LOP
+- Might need a break: extra_hours >= burnout_extra_hours and no leave
+  concession this month or the previous one
+
+"Previous month" is the employee's previous salary month; an employee's first
+month is compared with itself, so it never shows a drop or spike. Blank
+figures never raise a flag, as on the per-employee screen. risk_streak counts
+the consecutive calendar months (up to and including this one) with a risk
+flag; a month missing from the salary log breaks the run.
+
+Scoring is a batch job: score_alerts() computes every month and saves the rows
+to the alert store (PREDICTIVE_ALERTS_TABLE in SQL mode, the Parquet file in
+PREDICTIVE_ALERTS_SETTINGS otherwise), replacing the months it scored and
+keeping all others as history. The alerts page, the admin overview and the
+exports only read the store.
+
+Score from the command line or cron, and print a month from the store:
+    python predictive_alerts.py score                      # every salary month
+    python predictive_alerts.py score --months 2025-06 2025-07
+    python predictive_alerts.py show 2025-07 --department Sales --output alerts.csv
+
+e.g. nightly at 02:00:
+    0 2 * * * cd /path/to/validex-app && python predictive_alerts.py score
+"""
+import argparse
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import config
+import work_calendar
+from attendance_log import normalize_employee_id
+from config import (
+    EMPLOYEE_MASTER_TABLE, PREDICTIVE_ALERTS_SETTINGS, PREDICTIVE_ALERTS_TABLE, SALARY_LOG_TABLE, sql_connection,
+)
+from repository import invalidate_table, read_table
+from schema_migrations import ensure_migrated
+
+ALERT_RULES = {
+    "lop_days": 2,  # High LOP above this many unpaid working days
+    "attendance_drop": 0.10,  # Drop in attendance rate (0-1) vs the previous month
+    "bonus_full_days": 22,
+    "burnout_extra_hours": 10,
+}
+
+RISK_STATUS = "🔥 Risk Alert"
+BONUS_STATUS = "🌟 Bonus Eligible"
+BURNOUT_STATUS = "🧘 Might Need Break"
+HEALTHY_STATUS = "✅ Healthy"
+
+# Risk flag -> label in the Risk Factors column, in display order
+RISK_FACTORS = {"lop_risk": "High LOP", "attendance_drop": "Attendance Drop", "late_spike": "Late Spike"}
+
+# Salary log figures the rules read; a missing column counts as 0
+ALERT_FIGURES = ["full_days", "half_days", "leave_concession", "late_marks", "tuesday_bonus", "lop_days", "extra_hours"]
+
+# Report column -> alerts column, as shown on the page and in the CSV export
+REPORT_COLUMNS = {
+    "Employee": "employee_name",
+    "Full Days": "full_days",
+    "LOP": "lop_days",
+    "Late Marks": "late_marks",
+    "Tues Bonus": "tuesday_bonus",
+    "Extra Hours": "extra_hours",
+    "Risk Factors": "risk_factors",
+    "Months Flagged": "risk_streak",
+    "Status": "status",
+}
+
+# Columns kept in the alert store, one row per employee and month
+STORE_COLUMNS = [
+    "employee_id", "employee_name", "department", "month", "working_days",
+    "full_days", "half_days", "leave_concession", "late_marks", "tuesday_bonus", "lop_days", "extra_hours",
+    "actual_lop", "attendance_rate", "previous_attendance_rate", "previous_late_marks",
+    "lop_risk", "attendance_drop", "late_spike", "risk_flag", "bonus_flag", "burnout_flag",
+    "risk_streak", "risk_factors", "status", "scored_at",
+]
+FLAG_COLUMNS = ["lop_risk", "attendance_drop", "late_spike", "risk_flag", "bonus_flag", "burnout_flag"]
+STORE_BATCH_SIZE = 1000  # rows per fast_executemany call
+
+_store_cache = None  # (Parquet file signature, DataFrame)
+_store_lock = threading.Lock()
+
+
+def _working_days(months):
+    """Working days of each salary month (Series of month-start Timestamps)"""
+    by_month = {month: work_calendar.working_days_in_month(month.year, month.month) for month in months.unique()}
+    return months.map(by_month).astype(float)
+
+
+def _attendance_rate(figures, working_days):
+    return (figures["full_days"] + 0.5 * figures["half_days"]) / working_days
+
+
+def compute_alerts(salary_log, master):
+    """
+    One row per employee and salary month: the month's figures, the previous
+    month's attendance rate, each flag, the risk factors and the status.
+    Rows without a valid salary_month are left out.
+    """
+    alerts = salary_log.copy()
+    alerts["salary_month"] = pd.to_datetime(alerts["salary_month"], errors="coerce")
+    alerts = alerts[alerts["salary_month"].notna()].copy()
+    alerts["salary_month"] = alerts["salary_month"].dt.to_period("M").dt.start_time
+    alerts["month"] = alerts["salary_month"].dt.strftime("%Y-%m")
+    alerts["employee_id"] = alerts["employee_id"].map(normalize_employee_id)
+    if "employee_name" not in alerts.columns:
+        alerts["employee_name"] = alerts["employee_id"]
+
+    # First row of each month wins, as on the per-employee screen
+    alerts = alerts.drop_duplicates(["employee_id", "month"], keep="first")
+    alerts = alerts.sort_values(["employee_id", "salary_month"], kind="stable").reset_index(drop=True)
+    for column in ALERT_FIGURES:
+        alerts[column] = pd.to_numeric(alerts[column], errors="coerce") if column in alerts.columns else 0.0
+    alerts["extra_hours"] = alerts["extra_hours"].fillna(0)
+
+    departments = master.reindex(columns=["employee_id", "department"])
+    departments["employee_id"] = departments["employee_id"].map(normalize_employee_id)
+    departments = departments.drop_duplicates("employee_id")
+    alerts = alerts.drop(columns=["department"], errors="ignore").merge(departments, on="employee_id", how="left")
+
+    # ---------- Lag features ----------
+    alerts["working_days"] = _working_days(alerts["salary_month"])
+    by_employee = alerts.groupby("employee_id", sort=False)
+    lag_columns = ["full_days", "half_days", "late_marks", "leave_concession", "working_days"]
+    previous = by_employee[lag_columns].shift(1)
+    first_month = by_employee.cumcount() == 0
+    previous.loc[first_month] = alerts.loc[first_month, lag_columns]
+
+    alerts["actual_lop"] = alerts["working_days"] - (
+        alerts["full_days"] + 0.5 * alerts["half_days"] + alerts["leave_concession"]
+    )
+    alerts["attendance_rate"] = _attendance_rate(alerts, alerts["working_days"])
+    alerts["previous_attendance_rate"] = _attendance_rate(previous, previous["working_days"])
+    alerts["previous_late_marks"] = previous["late_marks"]
+
+    # ---------- Flags ----------
+    alerts["lop_risk"] = alerts["actual_lop"] > ALERT_RULES["lop_days"]
+    alerts["attendance_drop"] = (
+        alerts["previous_attendance_rate"] - alerts["attendance_rate"] >= ALERT_RULES["attendance_drop"]
+    )
+    alerts["late_spike"] = alerts["late_marks"] > previous["late_marks"]
+    alerts["risk_flag"] = alerts["lop_risk"] | alerts["attendance_drop"] | alerts["late_spike"]
+    # Months in a row with a risk flag: an unflagged month, or a calendar month
+    # missing from the salary log before this one, starts a new run
+    month_number = alerts["salary_month"].dt.year * 12 + alerts["salary_month"].dt.month
+    month_gap = month_number.groupby(alerts["employee_id"], sort=False).diff() != 1
+    run_id = (~alerts["risk_flag"] | month_gap).groupby(alerts["employee_id"], sort=False).cumsum()
+    alerts["risk_streak"] = alerts["risk_flag"].astype(int).groupby([alerts["employee_id"], run_id], sort=False).cumsum()
+    alerts["bonus_flag"] = (
+        (alerts["full_days"] >= ALERT_RULES["bonus_full_days"]) & (alerts["tuesday_bonus"] > 0)
+        & (alerts["late_marks"] == 0) & (alerts["lop_days"] == 0)
+    )
+    alerts["burnout_flag"] = (
+        (alerts["extra_hours"] >= ALERT_RULES["burnout_extra_hours"])
+        & (alerts["leave_concession"] == 0) & (previous["leave_concession"] == 0)
+    )
+
+    # "High LOP, Late Spike" etc.: each true flag contributes its label
+    factors = alerts[list(RISK_FACTORS)].rename(columns=RISK_FACTORS)
+    alerts["risk_factors"] = factors.dot(factors.columns + ", ").str[:-2].replace("", "-")
+    alerts["status"] = np.select(
+        [alerts["risk_flag"], alerts["bonus_flag"], alerts["burnout_flag"]],
+        [RISK_STATUS, BONUS_STATUS, BURNOUT_STATUS],
+        default=HEALTHY_STATUS,
+    )
+    return alerts
+
+
+def alert_report(alerts, department=None, month=None):
+    """The page/export table: one row per employee for a department and month"""
+    if department is not None:
+        alerts = alerts[alerts["department"] == department]
+    if month is not None:
+        alerts = alerts[alerts["month"] == month]
+    return alerts[list(REPORT_COLUMNS.values())].set_axis(list(REPORT_COLUMNS), axis=1).reset_index(drop=True)
+
+
+# ==================== ALERT STORE ====================
+
+def _parquet_path():
+    return PREDICTIVE_ALERTS_SETTINGS.get("parquet_path", "data/predictive_alerts.parquet")
+
+
+def _empty_store():
+    return pd.DataFrame(columns=STORE_COLUMNS)
+
+
+def _read_parquet():
+    global _store_cache
+    path = _parquet_path()
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return _empty_store()
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _store_lock:
+        if _store_cache is not None and _store_cache[0] == signature:
+            return _store_cache[1].copy()
+        stored = pd.read_parquet(path)
+        _store_cache = (signature, stored)
+        return stored.copy()
+
+
+def read_alerts(use_sql=None):
+    """
+    Every stored alert row, one per employee and scored month; empty before
+    the first scoring run. SQL reads go through the shared table cache.
+    """
+    if use_sql is None:
+        use_sql = config.USE_SQL
+    if use_sql:
+        stored = read_table(PREDICTIVE_ALERTS_TABLE, missing_ok=True, use_sql=True)
+        if stored.empty:
+            return _empty_store()
+        stored = stored.reindex(columns=STORE_COLUMNS)
+        stored[FLAG_COLUMNS] = stored[FLAG_COLUMNS].fillna(False).astype(bool)
+        stored["scored_at"] = pd.to_datetime(stored["scored_at"], errors="coerce")
+        return stored
+    return _read_parquet()
+
+
+def _write_parquet(rows, months):
+    path = _parquet_path()
+    with _store_lock:
+        stored = pd.read_parquet(path) if os.path.exists(path) else _empty_store()
+        kept = stored[~stored["month"].isin(months)]
+        combined = pd.concat([kept, rows], ignore_index=True) if not kept.empty else rows
+        combined = combined.sort_values(["month", "employee_id"], kind="stable").reset_index(drop=True)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        combined.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+
+def _write_sql(rows, months):
+    ensure_migrated()
+    values = rows.astype(object).where(rows.notna(), None)
+    values[FLAG_COLUMNS] = rows[FLAG_COLUMNS].astype(int)
+    params = [tuple(row) for row in values.itertuples(index=False)]
+
+    columns = ", ".join(STORE_COLUMNS)
+    placeholders = ", ".join("?" * len(STORE_COLUMNS))
+    with sql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # One transaction: readers see either the old or the new scoring of a month
+            cursor.executemany(f"DELETE FROM {PREDICTIVE_ALERTS_TABLE} WHERE month = ?", [(m,) for m in months])
+            cursor.fast_executemany = True
+            for start in range(0, len(params), STORE_BATCH_SIZE):
+                cursor.executemany(
+                    f"INSERT INTO {PREDICTIVE_ALERTS_TABLE} ({columns}) VALUES ({placeholders})",
+                    params[start:start + STORE_BATCH_SIZE],
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def save_alerts(alerts, months=None, use_sql=None):
+    """
+    Replace the stored rows of these months (default: every month in alerts)
+    with the scored rows; other months are kept. Returns rows written.
+    """
+    if use_sql is None:
+        use_sql = config.USE_SQL
+    months = sorted(alerts["month"].unique()) if months is None else sorted(months)
+    rows = alerts[alerts["month"].isin(months)].reindex(columns=STORE_COLUMNS)
+    rows["scored_at"] = pd.Timestamp(datetime.now().replace(microsecond=0))
+    if use_sql:
+        _write_sql(rows, months)
+        invalidate_table(PREDICTIVE_ALERTS_TABLE)
+    else:
+        _write_parquet(rows.reset_index(drop=True), months)
+    return len(rows)
+
+
+def score_alerts(months=None, use_sql=None):
+    """
+    The batch job: compute alerts from the current salary log and employee
+    master and save them. months limits which months are replaced (previous
+    months are still read for the lag features). Returns rows written.
+    """
+    # refresh=True: the job may run in a long-lived process next to writers
+    salary_log = read_table(SALARY_LOG_TABLE, use_sql=use_sql, refresh=True)
+    master = read_table(EMPLOYEE_MASTER_TABLE, use_sql=use_sql, refresh=True)
+    return save_alerts(compute_alerts(salary_log, master), months, use_sql=use_sql)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score predictive alerts, or show a scored month")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    score_parser = subparsers.add_parser("score", help="Compute alerts and save them to the alert store")
+    score_parser.add_argument("--months", nargs="+", help="Only replace these months (YYYY-MM); default all")
+    show_parser = subparsers.add_parser("show", help="Print a month from the alert store")
+    show_parser.add_argument("month", help="Salary month, YYYY-MM")
+    show_parser.add_argument("--department", help="Only this department")
+    show_parser.add_argument("--output", help="Write the report to this CSV file")
+    args = parser.parse_args()
+
+    if args.command == "score":
+        written = score_alerts(args.months)
+        print(f"Saved {written} alert rows")
+        return
+
+    month = read_alerts()
+    month = month[month["month"] == args.month]
+    if month.empty:
+        print(f"No scored alerts for {args.month}; run: python predictive_alerts.py score")
+        return
+    if args.department is None:
+        print(month.groupby("department")["status"].value_counts().unstack(fill_value=0).to_string())
+    report = alert_report(month, args.department)
+    if args.output:
+        report.to_csv(args.output, index=False)
+        print(f"Wrote {len(report)} rows to {args.output}")
+    elif args.department is not None:
+        print(report.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# repository.py
+"""
+Process-wide cached access to whole tables, on top of the same SQL/CSV
+sources used by data_utils.
+
+Streamlit re-runs every view script on each widget click, and most views
+start by re-reading entire tables. read_table() keeps one in-memory copy of
+each table per process (shared by all sessions) and only reloads it when:
+- CSV mode: the file's mtime/size changed (with USE_PARQUET the table is read
+  from its typed Parquet copy, see parquet_store.py), or
+- SQL mode: a writer called config.bump_table_version() for that table, or the
+  copy is older than TABLE_CACHE_SETTINGS["sql_max_age_seconds"]
+  (writes made by other processes).
+
+Callers always get their own DataFrame copy, so in-place cleanup in a view
+never leaks into the cache.
+"""
+import os
+import threading
+import time
+
+import pandas as pd
+
+import config
+import parquet_store
+import attendance_log
+import attendance_journal
+from config import (
+    sql_connection, table_exists, get_table_version, bump_table_version,
+    TABLE_CSV_PATHS, TABLE_CACHE_SETTINGS,
+)
+
+# (table_name, use_sql) -> (version_key, loaded_at, DataFrame)
+_cache = {}
+_cache_lock = threading.Lock()
+_load_locks = {}
+
+
+def _load_lock(cache_key):
+    """One lock per table so concurrent sessions don't load the same table twice"""
+    with _cache_lock:
+        return _load_locks.setdefault(cache_key, threading.Lock())
+
+
+def _csv_path(table_name):
+    return TABLE_CSV_PATHS.get(table_name, f"data/{table_name.replace('dbo.', '')}.csv")
+
+
+def _version_key(table_name, use_sql):
+    """Cache key for the current state of a table"""
+    if use_sql:
+        return ("sql", get_table_version(table_name))
+    if table_name == config.EMPLOYEE_DATA_TABLE and attendance_log.is_enabled():
+        return ("csv", get_table_version(table_name), attendance_log.signature())
+    path = _csv_path(table_name)
+    try:
+        stat = os.stat(path)
+        return ("csv", get_table_version(table_name), stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return ("csv", get_table_version(table_name), None, None)
+
+
+def _is_fresh(entry, key):
+    cached_key, loaded_at, _ = entry
+    if cached_key != key:
+        return False
+    if key[0] == "sql":
+        return time.monotonic() - loaded_at < TABLE_CACHE_SETTINGS.get("sql_max_age_seconds", 300)
+    return True
+
+
+def _load_table(table_name, missing_ok, use_sql):
+    """Read a whole table straight from SQL, Parquet or CSV (no caching)"""
+    if use_sql:
+        with sql_connection() as conn:
+            if missing_ok and not table_exists(conn, table_name):
+                return pd.DataFrame()
+            df = pd.read_sql(f"SELECT * FROM {table_name}", conn)
+            return attendance_journal.drop_tracking_column(df) if table_name == config.EMPLOYEE_DATA_TABLE else df
+
+    if table_name == config.EMPLOYEE_DATA_TABLE and attendance_log.is_enabled():
+        return attendance_log.read_attendance()
+    if config.USE_PARQUET:
+        return parquet_store.read_table(table_name, missing_ok=missing_ok)
+
+    path = _csv_path(table_name)
+    if not os.path.exists(path):
+        if missing_ok:
+            return pd.DataFrame()
+        raise FileNotFoundError(f"CSV file not found: {path}")
+    return pd.read_csv(path, dtype={"employee_id": str})
+
+
+def read_table(table_name, missing_ok=False, use_sql=None, refresh=False):
+    """
+    Return a copy of the whole table, served from the process cache when fresh.
+
+    use_sql defaults to config.USE_SQL; pass use_sql=False to read the CSV copy
+    (e.g. as a fallback when SQL is down). refresh=True always reloads from the
+    source (and updates the cache), for callers that need writes made by other
+    processes. SQL errors (and a missing CSV file, unless missing_ok) are raised
+    to the caller, which keeps its own fallback handling. Failed loads are
+    never cached.
+    """
+    if use_sql is None:
+        use_sql = config.USE_SQL
+    if not TABLE_CACHE_SETTINGS.get("enabled", True):
+        return _load_table(table_name, missing_ok, use_sql)
+
+    cache_key = (table_name, use_sql)
+    key = _version_key(table_name, use_sql)
+    with _cache_lock:
+        entry = _cache.get(cache_key)
+    if not refresh and entry is not None and _is_fresh(entry, key):
+        return entry[2].copy()
+
+    with _load_lock(cache_key):
+        # Another session may have loaded it while we waited
+        key = _version_key(table_name, use_sql)
+        with _cache_lock:
+            entry = _cache.get(cache_key)
+        if not refresh and entry is not None and _is_fresh(entry, key):
+            return entry[2].copy()
+
+        df = _load_table(table_name, missing_ok, use_sql)
+        with _cache_lock:
+            _cache[cache_key] = (key, time.monotonic(), df)
+        return df.copy()
+
+
+def invalidate_table(table_name):
+    """Drop the cached copy of a table; call after writing to it"""
+    bump_table_version(table_name)
+    with _cache_lock:
+        for use_sql in (True, False):
+            _cache.pop((table_name, use_sql), None)
+
+
+def clear_cache():
+    """Drop every cached table (e.g. after switching USE_SQL or restoring a backup)"""
+    with _cache_lock:
+        _cache.clear()
+
+
+def cache_info():
+    """Row counts and age of each cached table, for admin/debug screens"""
+    now = time.monotonic()
+    with _cache_lock:
+        return {
+            f"{table_name} ({'sql' if use_sql else 'csv'})": {"rows": len(df), "age_seconds": round(now - loaded_at, 1)}
+            for (table_name, use_sql), (_, loaded_at, df) in _cache.items()
+        }
+
+
+# ==================== TABLE SHORTCUTS ====================
+
+def get_employee_master():
+    """Cached employee master table"""
+    return read_table(config.EMPLOYEE_MASTER_TABLE)
+
+
+def get_attendance():
+    """Cached attendance (employee_data) table"""
+    return read_table(config.EMPLOYEE_DATA_TABLE)
+
+
+def get_salary_log(missing_ok=True):
+    """Cached salary log table"""
+    return read_table(config.SALARY_LOG_TABLE, missing_ok=missing_ok)
+
+
+def get_feedback_log():
+    """Cached feedback log table"""
+    return read_table(config.FEEDBACK_LOG_TABLE, missing_ok=True)
@@ -0,0 +1,242 @@
+# schema_migrations.py
+"""
+One-time DDL for the SQL tables the app creates or extends itself.
+
+Views used to probe INFORMATION_SCHEMA and run CREATE/ALTER statements on
+every load and save. The statements now live here as idempotent migrations
+(IF OBJECT_ID / IF COL_LENGTH guards), and run_migrations() applies them once
+per process: at startup from main.py and, as a safety net, the first time a
+view calls ensure_migrated(). The schema cache in config.py is dropped
+afterwards so new tables and columns are visible immediately.
+
+Apply them by hand, e.g. right after deploying:
+    python schema_migrations.py
+"""
+import threading
+
+import attendance_journal
+from config import (
+    FEEDBACK_LOG_TABLE, FEEDBACK_RAW_TABLE, PREDICTIVE_ALERTS_TABLE, SALARY_LOG_TABLE, invalidate_schema,
+    sql_connection,
+)
+
+SALARY_LOG_DDL = f"""
+IF OBJECT_ID(N'{SALARY_LOG_TABLE}', N'U') IS NULL
+CREATE TABLE {SALARY_LOG_TABLE} (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    employee_id NVARCHAR(50) NOT NULL,
+    employee_name NVARCHAR(255),
+    salary_month NVARCHAR(7), -- YYYY-MM format
+    data_date DATE,
+    timestamp DATETIME2,
+    entry_time TIME,
+    fixed_salary DECIMAL(15,2) DEFAULT 0,
+    basic_salary DECIMAL(15,2) DEFAULT 0,
+    da DECIMAL(15,2) DEFAULT 0,
+    hra DECIMAL(15,2) DEFAULT 0,
+    cell_allowance DECIMAL(15,2) DEFAULT 0,
+    petrol_allowance DECIMAL(15,2) DEFAULT 0,
+    attendance_allowance DECIMAL(15,2) DEFAULT 0,
+    performance_allowance DECIMAL(15,2) DEFAULT 0,
+    ot_hours_amount DECIMAL(15,2) DEFAULT 0,
+    rd_allowance DECIMAL(15,2) DEFAULT 0,
+    lic_allowance DECIMAL(15,2) DEFAULT 0,
+    arrears_allowance DECIMAL(15,2) DEFAULT 0,
+    other_allowance DECIMAL(15,2) DEFAULT 0,
+    gross_earnings DECIMAL(15,2) DEFAULT 0,
+    base_salary DECIMAL(15,2) DEFAULT 0,
+    extra_pay DECIMAL(15,2) DEFAULT 0,
+    festival_bonus DECIMAL(15,2) DEFAULT 0,
+    tuesday_bonus DECIMAL(15,2) DEFAULT 0,
+    tuesday_count INT DEFAULT 0,
+    employee_pf DECIMAL(15,2) DEFAULT 0,
+    employer_pf DECIMAL(15,2) DEFAULT 0,
+    pf_admin_charges DECIMAL(15,2) DEFAULT 0,
+    employee_esi DECIMAL(15,2) DEFAULT 0,
+    employer_esi DECIMAL(15,2) DEFAULT 0,
+    tax_deduction DECIMAL(15,2) DEFAULT 0,
+    mlwf_employee DECIMAL(15,2) DEFAULT 0,
+    mlwf_employer DECIMAL(15,2) DEFAULT 0,
+    advance_deduction DECIMAL(15,2) DEFAULT 0,
+    loan_deduction DECIMAL(15,2) DEFAULT 0,
+    loan_cutting DECIMAL(15,2) DEFAULT 0,
+    fine_deduction DECIMAL(15,2) DEFAULT 0,
+    extra_deduction DECIMAL(15,2) DEFAULT 0,
+    total_deductions DECIMAL(15,2) DEFAULT 0,
+    net_salary DECIMAL(15,2) DEFAULT 0,
+    ctc DECIMAL(15,2) DEFAULT 0,
+    extra_hours DECIMAL(8,2) DEFAULT 0,
+    late_marks INT DEFAULT 0,
+    full_days INT DEFAULT 0,
+    half_days INT DEFAULT 0,
+    earned_leave_taken DECIMAL(8,2) DEFAULT 0,
+    leave_accrued DECIMAL(8,2) DEFAULT 0,
+    leave_balance DECIMAL(8,2) DEFAULT 0,
+    lop_deduction DECIMAL(15,2) DEFAULT 0,
+    leave_encashment DECIMAL(15,2) DEFAULT 0,
+    leave_concession DECIMAL(8,2) DEFAULT 0,
+    leave_concession_amount DECIMAL(15,2) DEFAULT 0,
+    action_type NVARCHAR(50),
+    description NVARCHAR(500),
+    lop_days DECIMAL(8,2) DEFAULT 0,
+    days_in_month INT DEFAULT 0,
+    working_days INT DEFAULT 0,
+    total_earnings DECIMAL(15,2) DEFAULT 0,
+    source_version BIGINT NULL -- attendance_journal version the row was computed from
+)
+"""
+
+FEEDBACK_LOG_DDL = f"""
+IF OBJECT_ID(N'{FEEDBACK_LOG_TABLE}', N'U') IS NULL
+CREATE TABLE {FEEDBACK_LOG_TABLE} (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    timestamp DATETIME NOT NULL,
+    employee_name NVARCHAR(100) NOT NULL,
+    related_date DATE NOT NULL,
+    issue_type NVARCHAR(50) NOT NULL,
+    description NVARCHAR(MAX),
+    status NVARCHAR(20) DEFAULT 'Pending',
+    resolution NVARCHAR(MAX) DEFAULT '-',
+    follow_up NVARCHAR(MAX) DEFAULT '-',
+    created_at DATETIME DEFAULT GETDATE(),
+    updated_at DATETIME DEFAULT GETDATE()
+)
+"""
+
+FEEDBACK_RAW_DDL = f"""
+IF OBJECT_ID(N'{FEEDBACK_RAW_TABLE}', N'U') IS NULL
+CREATE TABLE {FEEDBACK_RAW_TABLE} (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    timestamp DATETIME NOT NULL,
+    category NVARCHAR(100),
+    department NVARCHAR(100),
+    sender NVARCHAR(100),
+    message NVARCHAR(MAX),
+    status NVARCHAR(50) DEFAULT 'Pending',
+    created_date DATETIME DEFAULT GETDATE()
+)
+"""
+
+# Written by predictive_alerts.score_alerts(); one row per employee and scored month
+PREDICTIVE_ALERTS_DDL = f"""
+IF OBJECT_ID(N'{PREDICTIVE_ALERTS_TABLE}', N'U') IS NULL
+CREATE TABLE {PREDICTIVE_ALERTS_TABLE} (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    employee_id NVARCHAR(50) NOT NULL,
+    employee_name NVARCHAR(255),
+    department NVARCHAR(100),
+    month NVARCHAR(7) NOT NULL, -- YYYY-MM format
+    working_days FLOAT,
+    full_days FLOAT,
+    half_days FLOAT,
+    leave_concession FLOAT,
+    late_marks FLOAT,
+    tuesday_bonus FLOAT,
+    lop_days FLOAT,
+    extra_hours FLOAT,
+    actual_lop FLOAT,
+    attendance_rate FLOAT,
+    previous_attendance_rate FLOAT,
+    previous_late_marks FLOAT,
+    lop_risk BIT NOT NULL DEFAULT 0,
+    attendance_drop BIT NOT NULL DEFAULT 0,
+    late_spike BIT NOT NULL DEFAULT 0,
+    risk_flag BIT NOT NULL DEFAULT 0,
+    bonus_flag BIT NOT NULL DEFAULT 0,
+    burnout_flag BIT NOT NULL DEFAULT 0,
+    risk_streak INT NOT NULL DEFAULT 0,
+    risk_factors NVARCHAR(200),
+    status NVARCHAR(50),
+    scored_at DATETIME2,
+    CONSTRAINT UQ_predictive_alerts_employee_month UNIQUE (month, employee_id)
+)
+"""
+
+
+def _add_column(table_name, column, definition):
+    return (f"IF COL_LENGTH('{table_name}', '{column}') IS NULL "
+            f"ALTER TABLE {table_name} ADD {column} {definition}")
+
+
+# (name, SQL statement or function(conn)), applied in order
+MIGRATIONS = [
+    ("salary_log: create table", SALARY_LOG_DDL),
+    # Tables created before change tracking lack source_version
+    ("salary_log: source_version", _add_column(SALARY_LOG_TABLE, "source_version", "BIGINT NULL")),
+    ("feedback_log: create table", FEEDBACK_LOG_DDL),
+    ("feedback_log: created_at", _add_column(FEEDBACK_LOG_TABLE, "created_at", "DATETIME DEFAULT GETDATE()")),
+    ("feedback_log: updated_at", _add_column(FEEDBACK_LOG_TABLE, "updated_at", "DATETIME DEFAULT GETDATE()")),
+    ("feedback_raw: create table", FEEDBACK_RAW_DDL),
+    ("employee_data: row version", attendance_journal.ensure_sql_tracking),
+    ("predictive_alerts: create table", PREDICTIVE_ALERTS_DDL),
+]
+
+_migrated = False
+_migrate_lock = threading.Lock()
+
+
+def _apply(conn, migration):
+    if callable(migration):
+        migration(conn)
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute(migration)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def run_migrations(conn=None):
+    """
+    Apply every migration; returns [(name, error)] for those that failed.
+    Failed migrations are reported, not retried, until the next process start
+    (or another explicit call); a failed connection is retried next time.
+    """
+    global _migrated
+    with _migrate_lock:
+        try:
+            if conn is None:
+                with sql_connection() as new_conn:
+                    failures = _run_all(new_conn)
+            else:
+                failures = _run_all(conn)
+        except Exception as e:
+            return [("connect", e)]
+        _migrated = True
+        return failures
+
+
+def _run_all(conn):
+    failures = []
+    try:
+        for name, migration in MIGRATIONS:
+            try:
+                _apply(conn, migration)
+            except Exception as e:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                failures.append((name, e))
+    finally:
+        invalidate_schema()
+    return failures
+
+
+def ensure_migrated(conn=None):
+    """Run the migrations unless this process already has; [(name, error)] of failures"""
+    if _migrated:
+        return []
+    return run_migrations(conn)
+
+
+def main():
+    failures = run_migrations()
+    for name, error in failures:
+        print(f"FAILED  {name}: {error}")
+    print(f"{len(MIGRATIONS) - len(failures)}/{len(MIGRATIONS)} migrations applied")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,12 @@ import mediapipe as mp
 import cv2
 import numpy as np
 from PIL import Image
-import tempfile
+import hashlib
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from sklearn.metrics.pairwise import cosine_similarity
 
 # Initialize MediaPipe Face Detection and Face Mesh
@@ -10,28 +15,161 @@ mp_face_detection = mp.solutions.face_detection
 mp_face_mesh = mp.solutions.face_mesh
 
 
-def extract_face_landmarks(image_path):
-    """Extract face landmarks using MediaPipe"""
-    try:
-        # Read image
-        if isinstance(image_path, str):
-            image = cv2.imread(image_path)
+# ===== Warm Model Pool =====
+# Building a FaceMesh/FaceDetection loads the TFLite model and allocates the
+# graph, which used to happen on every punch. Instances are now created lazily,
+# kept warm and shared by all sessions; each one is used by one thread at a time.
+# static_image_mode=True keeps every process() call independent of the last.
+FACE_MODEL_POOL_SIZE = int(os.getenv("FACE_MODEL_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+FACE_MODEL_ACQUIRE_TIMEOUT = 30  # seconds to wait when every instance is busy
+
+
+class _ModelPool:
+    """Thread-safe pool of up to `size` warm instances built by `factory`"""
+
+    def __init__(self, factory, size):
+        self._factory = factory
+        self._size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self._size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=FACE_MODEL_ACQUIRE_TIMEOUT)
+
+    def _discard(self, model):
+        with self._lock:
+            self._created -= 1
+        try:
+            model.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def borrow(self):
+        """Use a warm instance for the duration of the with block"""
+        model = self._acquire()
+        try:
+            yield model
+        except Exception:
+            # The graph may be in a bad state after an error; build a fresh one next time
+            self._discard(model)
+            raise
         else:
-            # If it's already an image array
-            image = np.array(image_path)
+            self._idle.put(model)
+
+    def warm(self, count=None):
+        """Create instances up front (all of them by default)"""
+        models = []
+        for _ in range(min(count or self._size, self._size)):
+            with self._lock:
+                if self._created >= self._size:
+                    break
+                self._created += 1
+            try:
+                models.append(self._factory())
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        for model in models:
+            self._idle.put(model)
+        return len(models)
+
+    def close(self):
+        """Close every idle instance"""
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+_face_mesh_pool = _ModelPool(
+    lambda: mp_face_mesh.FaceMesh(
+        static_image_mode=True,
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5
+    ),
+    FACE_MODEL_POOL_SIZE,
+)
+_face_detection_pool = _ModelPool(
+    lambda: mp_face_detection.FaceDetection(min_detection_confidence=0.3),
+    FACE_MODEL_POOL_SIZE,
+)
+
+
+def warm_up_face_models(count=1):
+    """
+    Build `count` FaceMesh/FaceDetection instances per pool and run them once on a
+    blank frame, so the first punch doesn't pay for model loading. Call at app start.
+    """
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    try:
+        _face_mesh_pool.warm(count)
+        _face_detection_pool.warm(count)
+        with _face_mesh_pool.borrow() as face_mesh:
+            face_mesh.process(blank)
+        with _face_detection_pool.borrow() as face_detection:
+            face_detection.process(blank)
+        return True
+    except Exception as e:
+        print(f"Face model warm-up failed: {e}")
+        return False
+
+
 
+def decode_image(source):
+    """
+    Decode an image once into a BGR array (OpenCV convention).
+
+    Accepts a file path, raw encoded bytes, a file-like object such as the
+    st.camera_input upload, a PIL Image, or an array that is already decoded
+    (returned as is). Returns None if it can't be decoded.
+    """
+    if source is None:
+        return None
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, str):
+        return cv2.imread(source)
+    if isinstance(source, Image.Image):
+        return cv2.cvtColor(np.array(source.convert("RGB")), cv2.COLOR_RGB2BGR)
+    if hasattr(source, "getvalue"):
+        source = source.getvalue()
+    elif hasattr(source, "read"):
+        source = source.read()
+    buffer = np.frombuffer(bytes(source), dtype=np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+
+
+def extract_face_landmarks(image_source):
+    """Extract face landmarks using MediaPipe (path, bytes or decoded BGR array)"""
+    try:
+        image = decode_image(image_source)
         if image is None:
             return None
 
         # Convert BGR to RGB
         rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-        with mp_face_mesh.FaceMesh(
-                static_image_mode=True,
-                max_num_faces=1,
-                refine_landmarks=True,
-                min_detection_confidence=0.5
-        ) as face_mesh:
+        with _face_mesh_pool.borrow() as face_mesh:
             results = face_mesh.process(rgb_image)
 
             if results.multi_face_landmarks:
@@ -50,18 +188,19 @@ def extract_face_landmarks(image_path):
 
 def compare_faces_simple_fallback(badge_path, snapshot_path, threshold=30):
     """
-    Fallback method using simple face detection and histogram comparison
+    Fallback method using simple face detection and histogram comparison.
+    Either image may be a path, bytes or an already decoded BGR array.
     """
     try:
-        # Load images
-        img1 = cv2.imread(badge_path)
-        img2 = cv2.imread(snapshot_path)
+        # Load images (arrays are used as is, without another decode)
+        img1 = decode_image(badge_path)
+        img2 = decode_image(snapshot_path)
 
         if img1 is None or img2 is None:
             return False, 0.0
 
         # Detect faces and extract regions
-        with mp_face_detection.FaceDetection(min_detection_confidence=0.3) as face_detection:
+        with _face_detection_pool.borrow() as face_detection:
             # Process first image
             rgb_img1 = cv2.cvtColor(img1, cv2.COLOR_BGR2RGB)
             results1 = face_detection.process(rgb_img1)
@@ -131,87 +270,98 @@ def compare_faces_simple_fallback(badge_path, snapshot_path, threshold=30):
         return False, 0.0
 
 
-def compare_faces_simple_fallback(badge_path, snapshot_path, threshold=30):
-    """
-    Fallback method using simple face detection and histogram comparison
-    """
-    try:
-        # Load images
-        img1 = cv2.imread(badge_path)
-        img2 = cv2.imread(snapshot_path)
+# ===== Badge Embedding Cache =====
+# Badge photos rarely change, so their landmarks are computed once per file
+# content and kept in memory and on disk next to the badge
+# (<badge dir>/.embeddings/<badge file>.<sha1>.npy). A verification then only
+# has to run the face mesh on the live snapshot.
+EMBEDDING_DIR_NAME = ".embeddings"
+_embedding_cache = {}  # absolute badge path -> (size, mtime_ns, sha1, embedding or None)
+_embedding_lock = threading.Lock()
 
-        if img1 is None or img2 is None:
-            return False, 0.0
 
-        # Detect faces and extract regions
-        with mp_face_detection.FaceDetection(min_detection_confidence=0.3) as face_detection:
-            # Process first image
-            rgb_img1 = cv2.cvtColor(img1, cv2.COLOR_BGR2RGB)
-            results1 = face_detection.process(rgb_img1)
+def _embedding_path(badge_path, digest):
+    directory = os.path.join(os.path.dirname(badge_path), EMBEDDING_DIR_NAME)
+    return os.path.join(directory, f"{os.path.basename(badge_path)}.{digest}.npy")
 
-            # Process second image
-            rgb_img2 = cv2.cvtColor(img2, cv2.COLOR_BGR2RGB)
-            results2 = face_detection.process(rgb_img2)
 
-            if not (results1.detections and results2.detections):
-                # No faces detected, return low confidence
-                return False, 0.0
-
-            # Get face bounding boxes
-            h1, w1, _ = img1.shape
-            h2, w2, _ = img2.shape
-
-            # Extract first face from each image
-            bbox1 = results1.detections[0].location_data.relative_bounding_box
-            bbox2 = results2.detections[0].location_data.relative_bounding_box
-
-            # Convert to pixel coordinates and extract face regions
-            x1 = max(0, int(bbox1.xmin * w1))
-            y1 = max(0, int(bbox1.ymin * h1))
-            w1_face = int(bbox1.width * w1)
-            h1_face = int(bbox1.height * h1)
-            face1 = img1[y1:y1 + h1_face, x1:x1 + w1_face]
-
-            x2 = max(0, int(bbox2.xmin * w2))
-            y2 = max(0, int(bbox2.ymin * h2))
-            w2_face = int(bbox2.width * w2)
-            h2_face = int(bbox2.height * h2)
-            face2 = img2[y2:y2 + h2_face, x2:x2 + w2_face]
-
-            if face1.size == 0 or face2.size == 0:
-                return False, 0.0
-
-            # Resize faces to same size for comparison
-            target_size = (100, 100)
-            face1_resized = cv2.resize(face1, target_size)
-            face2_resized = cv2.resize(face2, target_size)
-
-            # Convert to grayscale for comparison
-            face1_gray = cv2.cvtColor(face1_resized, cv2.COLOR_BGR2GRAY)
-            face2_gray = cv2.cvtColor(face2_resized, cv2.COLOR_BGR2GRAY)
-
-            # Calculate histogram correlation
-            hist1 = cv2.calcHist([face1_gray], [0], None, [256], [0, 256])
-            hist2 = cv2.calcHist([face2_gray], [0], None, [256], [0, 256])
-
-            # Normalize histograms
-            cv2.normalize(hist1, hist1, 0, 1, cv2.NORM_MINMAX)
-            cv2.normalize(hist2, hist2, 0, 1, cv2.NORM_MINMAX)
-
-            # Calculate correlation
-            correlation = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
-
-            # Convert to percentage and adjust scale to match original expectations
-            confidence = max(0, correlation * 100)
-
-            # Apply threshold
-            is_verified = confidence >= threshold
-
-            return is_verified, confidence
+def _save_embedding(badge_path, npy_path, embedding):
+    """Write the .npy file and drop ones left over from older versions of the badge"""
+    try:
+        directory = os.path.dirname(npy_path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{npy_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, embedding)
+        os.replace(tmp_path, npy_path)
+
+        prefix = f"{os.path.basename(badge_path)}."
+        for name in os.listdir(directory):
+            stale = os.path.join(directory, name)
+            if name.startswith(prefix) and name.endswith(".npy") and stale != npy_path:
+                os.remove(stale)
+    except OSError as e:
+        print(f"Could not store badge embedding for {badge_path}: {e}")
+
+
+def get_badge_embedding(badge_path):
+    """
+    Landmark embedding of a badge photo, cached by path + file hash.
+    Returns None if the file is missing or no face was found.
+    """
+    path = os.path.abspath(badge_path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
 
-    except Exception as e:
-        print(f"Error in fallback comparison: {str(e)}")
-        return False, 0.0
+    entry = _embedding_cache.get(path)
+    if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+        return entry[3]
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+
+    if entry is not None and entry[2] == digest:
+        # File was touched but its content is the same
+        embedding = entry[3]
+    else:
+        embedding = None
+        npy_path = _embedding_path(path, digest)
+        if os.path.exists(npy_path):
+            try:
+                embedding = np.load(npy_path)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable badge embedding {npy_path}: {e}")
+
+        if embedding is None:
+            image = decode_image(data)
+            embedding = extract_face_landmarks(image) if image is not None else None
+            # "No face" is only remembered in memory, so a transient failure isn't stored for good
+            if embedding is not None:
+                _save_embedding(path, npy_path, embedding)
+
+    with _embedding_lock:
+        _embedding_cache[path] = (stat.st_size, stat.st_mtime_ns, digest, embedding)
+    return embedding
+
+
+def precompute_badge_embeddings(badge_dir):
+    """Compute and store embeddings for every badge photo (e.g. after uploading badges)"""
+    results = {}
+    if not os.path.isdir(badge_dir):
+        return results
+    for name in sorted(os.listdir(badge_dir)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            results[name] = get_badge_embedding(os.path.join(badge_dir, name)) is not None
+    return results
+
+
+def clear_badge_embedding_cache():
+    """Forget the in-memory embeddings (the .npy files stay valid while the badge is unchanged)"""
+    with _embedding_lock:
+        _embedding_cache.clear()
 
 
 def compare_faces(badge_path, snapshot_img, threshold=30):
@@ -221,38 +371,25 @@ def compare_faces(badge_path, snapshot_img, threshold=30):
 
     Args:
         badge_path (str): Path to the badge/reference image
-        snapshot_img (str or PIL.Image): Path to snapshot image or PIL Image object
+        snapshot_img: Path, raw bytes, camera upload, PIL Image or BGR array
         threshold (float): Similarity threshold (0-100)
 
     Returns:
         tuple: (is_verified: bool, confidence_percentage: float)
     """
     try:
-        # Handle snapshot_img - it could be a file path or PIL Image
-        if isinstance(snapshot_img, str):
-            # It's a file path
-            img2_path = snapshot_img
-        else:
-            # It's likely a PIL Image, save it temporarily
-            if hasattr(snapshot_img, 'save'):
-                # It's a PIL Image
-                with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_img:
-                    snapshot_img.save(temp_img.name)
-                    img2_path = temp_img.name
-            else:
-                # Try to open it as PIL Image (in case it's passed differently)
-                img2 = Image.open(snapshot_img)
-                with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_img:
-                    img2.save(temp_img.name)
-                    img2_path = temp_img.name
-
-        # Extract landmarks from both images
-        landmarks1 = extract_face_landmarks(badge_path)
-        landmarks2 = extract_face_landmarks(img2_path)
+        # Decode the snapshot once, in memory; the mesh and the fallback share the array
+        snapshot = decode_image(snapshot_img)
+        if snapshot is None:
+            return False, 0.0
+
+        # Badge landmarks come from the embedding cache; only the snapshot is processed
+        landmarks1 = get_badge_embedding(badge_path)
+        landmarks2 = extract_face_landmarks(snapshot)
 
         if landmarks1 is None or landmarks2 is None:
             # Fallback to simple face detection comparison
-            return compare_faces_simple_fallback(badge_path, img2_path, threshold)
+            return compare_faces_simple_fallback(badge_path, snapshot, threshold)
 
         # Calculate similarity using cosine similarity
         similarity = cosine_similarity([landmarks1], [landmarks2])[0][0]
@@ -270,3 +407,92 @@ def compare_faces(badge_path, snapshot_img, threshold=30):
         print(f"Error in face comparison: {str(e)}")
         # Return same format as original function
         return False, 0.0
+
+
+# ===== Batch Verification =====
+# For re-verifying many punches at once (see face_reverification.py). Snapshots
+# are processed in a pool of worker processes, each with its own warm models;
+# the landmark similarities are then computed in one vectorized pass instead of
+# a cosine_similarity call per pair.
+def _batch_worker_init():
+    warm_up_face_models()
+
+
+def _score_snapshot(item):
+    """
+    Worker step for one pair: ("landmarks", snapshot landmarks) when both faces
+    have landmarks, otherwise ("fallback", confidence) or ("error", 0.0).
+    """
+    badge_path, snapshot, badge_has_landmarks = item
+    try:
+        image = decode_image(snapshot)
+        if image is None:
+            return "error", 0.0
+        landmarks = extract_face_landmarks(image) if badge_has_landmarks else None
+        if landmarks is not None:
+            return "landmarks", landmarks
+        _, confidence = compare_faces_simple_fallback(badge_path, image)
+        return "fallback", confidence
+    except Exception as e:
+        print(f"Error scoring snapshot against {badge_path}: {e}")
+        return "error", 0.0
+
+
+def _rowwise_cosine(a, b):
+    """Cosine similarity of each row of a with the same row of b"""
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    dots = np.einsum("ij,ij->i", a, b)
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+
+def compare_faces_batch(pairs, threshold=30, workers=None):
+    """
+    Verify many (badge_path, snapshot) pairs; snapshots may be paths, bytes or arrays.
+
+    Scores match compare_faces pair by pair. workers defaults to
+    FACE_MODEL_POOL_SIZE; workers=1 runs everything in this process.
+
+    Returns a list (same order as pairs) of dicts with
+    verified, confidence and method ("landmarks", "fallback" or "error").
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return []
+
+    # Badges repeat across punches and are cached, so load them here once
+    badge_embeddings = {path: get_badge_embedding(path) for path in {badge for badge, _ in pairs}}
+    items = [(badge, snapshot, badge_embeddings[badge] is not None) for badge, snapshot in pairs]
+
+    workers = workers or FACE_MODEL_POOL_SIZE
+    if workers <= 1 or len(items) < 2 * workers:
+        scored = [_score_snapshot(item) for item in items]
+    else:
+        chunksize = max(1, len(items) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_batch_worker_init) as executor:
+            scored = list(executor.map(_score_snapshot, items, chunksize=chunksize))
+
+    confidences = np.zeros(len(items))
+    methods = [method for method, _ in scored]
+    landmark_rows = {}  # (badge length, snapshot length) -> row indexes
+    for i, (method, value) in enumerate(scored):
+        if method == "landmarks":
+            key = (len(badge_embeddings[pairs[i][0]]), len(value))
+            landmark_rows.setdefault(key, []).append(i)
+        else:
+            confidences[i] = value
+
+    for (badge_len, snapshot_len), rows in landmark_rows.items():
+        if badge_len != snapshot_len:
+            # Landmark sets that can't be compared; score those pairs by the fallback
+            for i in rows:
+                methods[i] = "fallback"
+                confidences[i] = compare_faces_simple_fallback(pairs[i][0], pairs[i][1])[1]
+            continue
+        badges = np.stack([badge_embeddings[pairs[i][0]] for i in rows])
+        snapshots = np.stack([scored[i][1] for i in rows])
+        confidences[rows] = np.maximum(0, _rowwise_cosine(badges, snapshots) * 100)
+
+    return [
+        {"verified": bool(conf >= threshold), "confidence": float(conf), "method": method}
+        for conf, method in zip(confidences, methods)
+    ]
@@ -3,10 +3,11 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import smtplib
 
-def send_email(buffer, filename, recipient, smtp_config):
+
+def build_payslip_message(buffer, filename, recipient, sender):
     msg = MIMEMultipart()
     msg["Subject"] = f"Payslip for {filename}"
-    msg["From"] = smtp_config["sender"]
+    msg["From"] = sender
     msg["To"] = recipient
 
     msg.attach(MIMEText(
@@ -17,8 +18,27 @@ def send_email(buffer, filename, recipient, smtp_config):
     part = MIMEApplication(buffer, _subtype="pdf")
     part.add_header("Content-Disposition", "attachment", filename=filename)
     msg.attach(part)
+    return msg
+
 
-    with smtplib.SMTP(smtp_config["host"], smtp_config["port"]) as server:
-        server.starttls()
-        server.login(smtp_config["user"], smtp_config["password"])
+def open_smtp_session(smtp_config):
+    """
+    Connected (and, when a user is set, logged-in) SMTP session. STARTTLS is on
+    unless smtp_config["starttls"] is False, e.g. for a local test server.
+    """
+    server = smtplib.SMTP(smtp_config["host"], int(smtp_config["port"]), timeout=smtp_config.get("timeout", 30))
+    try:
+        if smtp_config.get("starttls", True):
+            server.starttls()
+        if smtp_config.get("user"):
+            server.login(smtp_config["user"], smtp_config["password"])
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def send_email(buffer, filename, recipient, smtp_config):
+    msg = build_payslip_message(buffer, filename, recipient, smtp_config["sender"])
+    with open_smtp_session(smtp_config) as server:
         server.send_message(msg)
@@ -0,0 +1,89 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path, poll_seconds=0.05):
+    """
+    Exclusive OS-level lock on "<path>.lock", held for the with-block.
+
+    Unlike a threading.Lock this also serializes separate processes (a second
+    Streamlit worker, the cron compactor). Each call opens its own handle, so
+    threads of one process exclude each other too. Blocks until acquired.
+    """
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, "a+b") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(poll_seconds)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _lock_nowait(handle):
+    """Take the lock on an open handle without waiting; False when it is held elsewhere"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def acquire_lease(path):
+    """
+    Non-blocking exclusive lock on "<path>.lock" that outlives a with-block, e.g.
+    for as long as a background job runs. Returns the handle to give to
+    release_lease(), or None when another handle (thread or process) holds it.
+    """
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    handle = open(lock_path, "a+b")
+    if _lock_nowait(handle):
+        return handle
+    handle.close()
+    return None
+
+
+def release_lease(handle):
+    if fcntl is not None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    else:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    handle.close()
+
+
+def is_leased(path):
+    """True while someone holds the lease on path"""
+    if not os.path.exists(f"{path}.lock"):
+        return False
+    handle = acquire_lease(path)
+    if handle is None:
+        return True
+    release_lease(handle)
+    return False
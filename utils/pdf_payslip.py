@@ -1,11 +1,97 @@
 from fpdf import FPDF
+from fontTools import subset as ftsubset, ttLib
 from datetime import datetime, date
+from functools import lru_cache
 import calendar
+import copy
+import hashlib
+import io
+import json
 import os
 import re
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import work_calendar
+from attendance_log import normalize_employee_id
+from config import PAYSLIP_CACHE_SETTINGS
 
 FONT_PATH = "fonts"
 FONT_NAME = "DejaVu"
+FONT_FILES = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf", "I": "DejaVuSans-Oblique.ttf"}
+
+# ===== Font Cache =====
+# Parsing the DejaVu TTFs took most of the time of every payslip, and embedding
+# meant cutting a subset out of the full 6000-glyph fonts again. Each process
+# now parses them once and keeps, per style, the parsed font and a small copy
+# holding only the glyphs payslips use (Latin text, digits, punctuation,
+# currency). Documents embed their subset from the small copy; one that uses a
+# glyph outside it embeds from the full font file instead, so coverage is unchanged.
+# This reaches into fpdf2's font objects (SubsetMap, subset, ttfont, ttffile), so
+# the fpdf2 imports live inside the fallback handling: anything missing means
+# plain Arial, as when the font files are absent.
+PAYSLIP_FONT_UNICODES = (
+    list(range(0x20, 0x7F))  # Basic Latin
+    + list(range(0xA0, 0x180))  # Latin-1 Supplement, Latin Extended-A
+    + list(range(0x2010, 0x2040))  # Dashes, quotes, bullets
+    + list(range(0x20A0, 0x20C0))  # Currency symbols (incl. the Rupee sign)
+)
+
+_font_cache = None  # {fontkey: (parsed TTFFont, common-glyph font bytes, its glyph names)}; {} if unavailable
+_font_cache_lock = threading.Lock()
+
+
+def _build_font_cache():
+    font_paths = {style: os.path.join(FONT_PATH, name) for style, name in FONT_FILES.items()}
+    if not all(os.path.exists(path) for path in font_paths.values()):
+        print(f"Font files not found in {FONT_PATH}. Using Arial fallback.")
+        return {}
+
+    from fpdf.fonts import SubsetMap  # noqa: F401 - fpdf2 only; fails (-> Arial) under legacy fpdf
+
+    loader = FPDF()
+    cache = {}
+    for style, path in font_paths.items():
+        loader.add_font(FONT_NAME, style, path)
+        fontkey = f"{FONT_NAME.lower()}{style}"
+
+        common = ttLib.TTFont(path, recalcTimestamp=False, fontNumber=0, lazy=True)
+        # Same glyph names and metrics as the full font; tables the PDF never uses are dropped
+        options = ftsubset.Options(notdef_outline=True, recommended_glyphs=True, glyph_names=True,
+                                   name_IDs=["*"], name_languages=["*"], layout_features=[])
+        options.drop_tables += ["FFTM", "GDEF", "GPOS", "GSUB", "kern"]
+        subsetter = ftsubset.Subsetter(options)
+        subsetter.populate(unicodes=PAYSLIP_FONT_UNICODES)
+        subsetter.subset(common)
+        buffer = io.BytesIO()
+        common.save(buffer)
+        cache[fontkey] = (loader.fonts[fontkey], buffer.getvalue(), frozenset(common.getGlyphOrder()))
+    print("Custom DejaVu fonts loaded successfully.")
+    return cache
+
+
+def cached_fonts():
+    """The per-process font cache, built on first use"""
+    global _font_cache
+    if _font_cache is None:
+        with _font_cache_lock:
+            if _font_cache is None:
+                try:
+                    _font_cache = _build_font_cache()
+                except Exception as e:
+                    print(f"Custom fonts not available: {e}. Using Arial fallback.")
+                    _font_cache = {}
+    return _font_cache
+
+
+@lru_cache(maxsize=24)
+def month_calendar_grid(year, month):
+    """Calendar rows of the month, Monday first: 7-tuples of day numbers, None outside the month"""
+    return tuple(
+        tuple(day or None for day in week)
+        for week in calendar.Calendar().monthdayscalendar(year, month)
+    )
 
 
 class PayslipPDF(FPDF):
@@ -23,29 +109,40 @@ class PayslipPDF(FPDF):
         self.add_page()
 
     def _load_custom_fonts(self):
-        """Try to load custom DejaVu fonts with proper error handling"""
+        """Register the DejaVu fonts from the per-process cache (parsed once, not per payslip)"""
+        fonts = cached_fonts()
+        if not fonts:
+            return
         try:
-            # Check if font files exist
-            regular_font = os.path.join(FONT_PATH, "DejaVuSans.ttf")
-            bold_font = os.path.join(FONT_PATH, "DejaVuSans-Bold.ttf")
-            italic_font = os.path.join(FONT_PATH, "DejaVuSans-Oblique.ttf")
-
-            if all(os.path.exists(f) for f in [regular_font, bold_font, italic_font]):
-                # Try to load custom fonts
-                self.add_font(FONT_NAME, "", regular_font, uni=True)
-                self.add_font(FONT_NAME, "B", bold_font, uni=True)
-                self.add_font(FONT_NAME, "I", italic_font, uni=True)
-                self.custom_fonts_loaded = True
-                self.font_family = FONT_NAME
-                print("Custom DejaVu fonts loaded successfully.")
-            else:
-                print(f"Font files not found in {FONT_PATH}. Using Arial fallback.")
-
+            from fpdf.fonts import SubsetMap
+
+            for fontkey, (parsed, common_font, _) in fonts.items():
+                # Share the parsed metrics; glyph usage and the font to embed are per document
+                font = copy.copy(parsed)
+                font.i = len(self.fonts) + 1
+                font.subset = SubsetMap(font)
+                font.missing_glyphs = []
+                font.ttfont = ttLib.TTFont(io.BytesIO(common_font), recalcTimestamp=False, fontNumber=0, lazy=True)
+                self.fonts[fontkey] = font
+            self.custom_fonts_loaded = True
+            self.font_family = FONT_NAME
         except Exception as e:
             print(f"Custom fonts not available: {e}. Using Arial fallback.")
+            for fontkey in fonts:
+                self.fonts.pop(fontkey, None)
             self.custom_fonts_loaded = False
             self.font_family = "Arial"
 
+    def output(self, *args, **kwargs):
+        # Embed from the full font file when a glyph is missing from the common-glyph copy
+        if not self.custom_fonts_loaded:
+            return super().output(*args, **kwargs)
+        for fontkey, (_, _, common_glyphs) in cached_fonts().items():
+            font = self.fonts.get(fontkey)
+            if font is not None and not common_glyphs.issuperset(font.subset.get_all_glyph_names()):
+                font.ttfont = ttLib.TTFont(font.ttffile, recalcTimestamp=False, fontNumber=0, lazy=True)
+        return super().output(*args, **kwargs)
+
     def safe_set_font(self, style="", size=10):
         """Safely set font with robust fallback handling"""
         try:
@@ -103,31 +200,25 @@ class PayslipPDF(FPDF):
         self.ln()
 
         # Calendar grid
-        first_weekday, total_days = calendar.monthrange(year, month)
-        current_day = 1
-        row_count = 0
+        default_markers = work_calendar.default_markers(year, month)
 
-        while current_day <= total_days:
+        for row_count, week in enumerate(month_calendar_grid(year, month)):
             # Alternate row colors
             self.set_fill_color(255, 255, 255) if row_count % 2 == 0 else self.set_fill_color(248, 248, 248)
 
-            for weekday in range(7):
-                if (current_day == 1 and weekday < first_weekday) or current_day > total_days:
+            for current_day in week:
+                if current_day is None:
                     self.cell(25.7, 5, txt="", border=1, fill=True)  # Reduced height from 6
                 else:
                     dt = date(year, month, current_day)
                     marker = attendance_map.get(current_day, "")
 
-                    # Default marker logic
+                    # Default marker logic (Tuesday off, same working days as payroll)
                     if not marker:
-                        if dt.weekday() == 1:  # Tuesday
-                            marker = "-"
-                        elif dt.weekday() == 6:  # Sunday
-                            marker = "-"
-                        elif dt.isoformat() in holidays:
+                        if dt.isoformat() in holidays:
                             marker = "-"
                         else:
-                            marker = "A"
+                            marker = str(default_markers[current_day - 1])
 
                     # Color coding for different attendance types
                     if marker == "F":
@@ -143,9 +234,7 @@ class PayslipPDF(FPDF):
 
                     label = f"{current_day:02d} {marker}"
                     self.cell(25.7, 5, txt=label, border=1, align="C", fill=True)  # Reduced height from 6
-                    current_day += 1
 
-            row_count += 1
             self.ln()
 
         self.ln(2)  # Reduced from 3
@@ -388,7 +477,7 @@ class PayslipPDF(FPDF):
 
         self.ln(3)  # Reduced from 8
 
-    def add_footer(self, emp_id, month_str):
+    def add_footer(self, emp_id, month_str, generated_at=None):
         # Calculate position to place footer at bottom without overflow
         footer_height = 20
         max_y = 297 - footer_height  # A4 height minus footer space
@@ -408,17 +497,45 @@ class PayslipPDF(FPDF):
 
         # Company footer
         self.safe_set_font("I", 7)  # Reduced from 8
-        generated_on = datetime.now().strftime("%d-%m-%Y %H:%M")
-        footer_text = f"Shri Swami Samarth Pvt. Ltd. | Generated: {generated_on} | Doc ID: SSPL-{emp_id}-{month_str.replace(' ', '-')}"
+        # Stamp the salary row's finalize time, not the render time, so cached PDFs match a fresh render
+        generated_text = f" | Generated: {generated_at.strftime('%d-%m-%Y %H:%M')}" if generated_at else ""
+        footer_text = f"Shri Swami Samarth Pvt. Ltd.{generated_text} | Doc ID: SSPL-{emp_id}-{month_str.replace(' ', '-')}"
         self.cell(0, 3, footer_text, ln=True, align="C")  # Reduced height from 4
 
 
+def _salary_row_time(value):
+    """Finalize time of a salary row as a datetime, None when missing or unreadable"""
+    if value is None or isinstance(value, float) or str(value) in ("", "NaT", "nan", "None"):
+        return None
+    try:
+        value = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+    return datetime(*value.timetuple()[:6])  # Plain datetime; fpdf cannot take a pandas Timestamp
+
+
 def generate_payslip_pdf(name, emp_id, monthly_data):
     """
-    Generate a comprehensive PDF payslip that fits on a single page
+    Generate a comprehensive PDF payslip that fits on a single page.
+    Served from the payslip cache when the same payslip was rendered before.
     """
+    # An unparseable month renders the current month's calendar, which the
+    # cache key does not cover, so such payslips are never cached
+    cacheable = _payslip_month(monthly_data) != "unknown"
+    cache_key = payslip_cache_key(name, emp_id, monthly_data) if cacheable else None
+    if cacheable:
+        cached = read_cached_payslip(cache_key, emp_id, monthly_data)
+        if cached is not None:
+            return cached
+
     try:
         pdf = PayslipPDF()
+        # fpdf would otherwise stamp the render time into the document info as well
+        generated_at = _salary_row_time(monthly_data.get("timestamp"))
+        if generated_at:
+            pdf.set_creation_date(generated_at)
+        else:
+            pdf.creation_date = None
 
         # Extract month information
         month_str = monthly_data.get("Month", "N/A")
@@ -442,10 +559,13 @@ def generate_payslip_pdf(name, emp_id, monthly_data):
         pdf.add_attendance_summary(monthly_data)
         pdf.add_statutory_info(monthly_data)
         pdf.add_notes_and_disclaimers(monthly_data)
-        pdf.add_footer(emp_id, month_str)
+        pdf.add_footer(emp_id, month_str, generated_at)
 
         # Return PDF as bytes
-        return bytes(pdf.output(dest="S"))
+        pdf_bytes = bytes(pdf.output(dest="S"))
+        if cacheable:
+            store_cached_payslip(cache_key, emp_id, monthly_data, pdf_bytes)
+        return pdf_bytes
 
     except Exception as e:
         print(f"Error generating PDF: {e}")
@@ -461,4 +581,199 @@ def generate_payslip_pdf(name, emp_id, monthly_data):
         except Exception as e2:
             print(f"Critical error even generating error PDF: {e2}")
             # Return empty bytes if everything fails
-            return b""
\ No newline at end of file
+            return b""
+
+# ===== Payslip Cache =====
+# Employees open "My Payslip" again and again, and bulk runs re-render whole
+# months, mostly for payslips that have not changed. Rendered PDFs are kept on
+# disk under a hash of everything that goes into them (name, ID, salary row,
+# attendance map, template version):
+#     <dir>/<YYYY-MM>/<employee_id>/<hash>.pdf
+# A hit is a file read. Files are touched on every hit and the least recently
+# used are removed once the cache grows past PAYSLIP_CACHE_SETTINGS max_mb.
+# Changed data hashes differently, so stale files are never served; finalizing
+# payroll also removes the affected employees' files (invalidate_payslips).
+PAYSLIP_TEMPLATE_VERSION = 1  # Bump whenever the layout or wording of the PDF changes
+
+_payslip_cache_bytes = None  # Approximate size of the cache directory, counted on first write
+_payslip_cache_lock = threading.Lock()
+
+
+def _payslip_cache_dir():
+    return PAYSLIP_CACHE_SETTINGS.get("dir", "data/payslip_cache")
+
+
+def _payslip_month(monthly_data):
+    try:
+        return datetime.strptime(str(monthly_data.get("Month", "")), "%B %Y").strftime("%Y-%m")
+    except ValueError:
+        return "unknown"
+
+
+def _payslip_folder(salary_month, emp_id):
+    employee = re.sub(r"[^A-Za-z0-9_.-]+", "_", normalize_employee_id(emp_id)) or "_"
+    return os.path.join(_payslip_cache_dir(), str(salary_month), employee)
+
+
+def payslip_cache_key(name, emp_id, monthly_data):
+    """Hash of everything the PDF is rendered from"""
+    content = json.dumps(
+        [PAYSLIP_TEMPLATE_VERSION, str(name), str(emp_id), monthly_data],
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def read_cached_payslip(cache_key, emp_id, monthly_data):
+    """Cached PDF bytes, or None on a miss"""
+    if not PAYSLIP_CACHE_SETTINGS.get("enabled", True):
+        return None
+    path = os.path.join(_payslip_folder(_payslip_month(monthly_data), emp_id), f"{cache_key}.pdf")
+    try:
+        with open(path, "rb") as f:
+            pdf_bytes = f.read()
+        os.utime(path)  # Recently used
+    except OSError:
+        return None
+    return pdf_bytes or None
+
+
+def store_cached_payslip(cache_key, emp_id, monthly_data, pdf_bytes):
+    """Keep a rendered PDF; caching problems never fail the payslip itself"""
+    global _payslip_cache_bytes
+    if not PAYSLIP_CACHE_SETTINGS.get("enabled", True) or not pdf_bytes:
+        return
+    folder = _payslip_folder(_payslip_month(monthly_data), emp_id)
+    path = os.path.join(folder, f"{cache_key}.pdf")
+    try:
+        os.makedirs(folder, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(temp_path, path)  # Other processes only ever see complete files
+    except OSError as e:
+        print(f"Could not cache payslip for {emp_id}: {e}")
+        return
+
+    with _payslip_cache_lock:
+        if _payslip_cache_bytes is None:
+            _payslip_cache_bytes = sum(size for _, size, _ in _cached_payslip_files())
+        else:
+            _payslip_cache_bytes += len(pdf_bytes)
+        if _payslip_cache_bytes > PAYSLIP_CACHE_SETTINGS.get("max_mb", 500) * 1024 * 1024:
+            _payslip_cache_bytes = _evict_payslips()
+
+
+def _cached_payslip_files():
+    """(path, size, last used) of every cached PDF"""
+    files = []
+    for folder, _, names in os.walk(_payslip_cache_dir()):
+        for file_name in names:
+            if file_name.endswith(".pdf"):
+                path = os.path.join(folder, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+    return files
+
+
+def _evict_payslips():
+    """Remove least recently used PDFs until the cache is at 80% of max_mb; returns its new size"""
+    files = sorted(_cached_payslip_files(), key=lambda item: item[2])
+    total = sum(size for _, size, _ in files)
+    target = PAYSLIP_CACHE_SETTINGS.get("max_mb", 500) * 1024 * 1024 * 0.8
+    for path, size, _ in files:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+
+def invalidate_payslips(keys):
+    """Drop cached PDFs of (employee_id, "YYYY-MM") pairs, e.g. after payroll was finalized for them"""
+    global _payslip_cache_bytes
+    removed = 0
+    for emp_id, salary_month in keys:
+        folder = _payslip_folder(salary_month, emp_id)
+        if os.path.isdir(folder):
+            shutil.rmtree(folder, ignore_errors=True)
+            removed += 1
+    if removed:
+        with _payslip_cache_lock:
+            _payslip_cache_bytes = None  # Recount on the next write
+    return removed
+
+
+def clear_payslip_cache():
+    """Drop every cached PDF, e.g. after the whole salary log was rewritten"""
+    global _payslip_cache_bytes
+    shutil.rmtree(_payslip_cache_dir(), ignore_errors=True)
+    with _payslip_cache_lock:
+        _payslip_cache_bytes = None
+
+
+# ===== Parallel Bulk Rendering =====
+# fpdf is pure Python, so a single process renders one payslip at a time no
+# matter how many threads it has. Bulk runs spread the rendering over a process
+# pool and hand each PDF back as soon as it is ready, so the caller can write it
+# into the ZIP and move the progress bar while the rest are still rendering.
+PAYSLIP_RENDER_WORKERS = int(os.getenv("PAYSLIP_RENDER_WORKERS", str(os.cpu_count() or 1)))
+PAYSLIP_JOBS_PER_WORKER = 4  # jobs handed to the pool at a time, per worker
+
+
+def _render_payslip_job(job):
+    """Worker step for one payslip: (key, pdf_bytes, None) or (key, None, error message)"""
+    key, name, emp_id, monthly_data = job
+    try:
+        pdf_bytes = generate_payslip_pdf(name, emp_id, monthly_data)
+    except Exception as e:
+        return key, None, str(e)
+    if not pdf_bytes:
+        return key, None, "PDF generator returned no data"
+    return key, pdf_bytes, None
+
+
+def render_payslips(jobs, workers=None):
+    """
+    Render many payslips; jobs are (key, name, emp_id, monthly_data) tuples.
+
+    Yields (key, pdf_bytes, error) as each payslip finishes, so results arrive
+    out of order and should be matched by key. error is None on success.
+    workers defaults to PAYSLIP_RENDER_WORKERS; workers=1 renders in this process.
+    """
+    jobs = list(jobs)
+    workers = min(workers or PAYSLIP_RENDER_WORKERS, len(jobs))
+    if workers <= 1:
+        for job in jobs:
+            yield _render_payslip_job(job)
+        return
+
+    queued = deque(jobs)
+    limit = workers * PAYSLIP_JOBS_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        while queued or pending:
+            # Top up the pool; once a crashed worker breaks it, every remaining job is reported as failed
+            while queued and len(pending) < limit:
+                job = queued.popleft()
+                try:
+                    pending[executor.submit(_render_payslip_job, job)] = job[0]
+                except Exception as e:
+                    yield job[0], None, f"Worker pool unavailable: {e}"
+            if not pending:
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = key, None, f"Worker failed: {e}"
+                yield result
@@ -1,5 +1,5 @@
 import streamlit as st
-from views import manual_entry, payroll, bulkpayslip, feedbackcenter, adminaudit
+from views import manual_entry, payroll, payrollsimulator, bulkpayslip, feedbackcenter, adminaudit
 from views import companyinsights, predictivealerts, resignation, leavevisualizer, analytics, appraisal_analytics, \
     appraisal_audit_log1
 from data_utils import (
@@ -11,6 +11,8 @@ from datetime import datetime,timedelta
 from data_utils import get_resignation_data
 from data_utils import get_salary_log
 from employee_qr_generator import display_employee_qr_interface
+from config import PREDICTIVE_ALERTS_SETTINGS
+from predictive_alerts import read_alerts, RISK_STATUS
 
 def run_dashboard(view, admin_name=None):
     """Main admin dashboard router that handles all admin views"""
@@ -42,6 +44,11 @@ def run_dashboard(view, admin_name=None):
         st.write("Manage payroll records and generate salaries.")
         payroll.run_payroll()
 
+    elif view == "payrollsimulator":
+        st.title("🧪 Payroll What-If")
+        st.write("Try out changes to salary rules before applying them.")
+        payrollsimulator.run_payrollsimulator()
+
     elif view == "appraisal_analytics":
         st.title("📈 Appraisal Trends & Insights")
         st.write("Analyze performance ratings, salary hike distributions, and reviewer patterns.")
@@ -156,6 +163,24 @@ def show_admin_overview(admin_name=None):
         else:
             st.info(f"Next payroll update is due on **{last_day.strftime('%d %b %Y')}**.")
 
+        # 🔮 Predictive alerts, as last scored by the batch job
+        st.subheader("🔮 Predictive Alerts")
+        try:
+            alerts = read_alerts()
+            if not alerts.empty:
+                latest_month = alerts["month"].max()
+                latest = alerts[alerts["month"] == latest_month]
+                repeat_months = PREDICTIVE_ALERTS_SETTINGS.get("repeat_months", 3)
+                col1, col2, col3 = st.columns(3)
+                col1.metric(f"🔥 Risk Alerts ({latest_month})", int((latest["status"] == RISK_STATUS).sum()))
+                col2.metric(f"🔁 Flagged {repeat_months}+ Months Running", int((latest["risk_streak"] >= repeat_months).sum()))
+                col3.metric("🌟 Bonus Eligible", int(latest["bonus_flag"].sum()))
+                st.caption(f"Last scored: {alerts['scored_at'].max():%d %b %Y %H:%M}")
+            else:
+                st.info("Alerts not scored yet (run `python predictive_alerts.py score`)")
+        except Exception as e:
+            st.warning(f"Could not load predictive alerts: {e}")
+
         # Recent activity
         st.subheader("📊 Quick Stats")
 
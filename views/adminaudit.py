@@ -5,10 +5,12 @@ import plotly.express as px
 import os
 from datetime import datetime
 from config import (
-    USE_SQL, get_sql_connection,
+    USE_SQL, sql_connection,
     EMPLOYEE_DATA_CSV, EMPLOYEE_MASTER_CSV, VERIFIED_ADMINS_CSV,
     EMPLOYEE_DATA_TABLE, EMPLOYEE_MASTER_TABLE, VERIFIED_ADMIN_TABLE
 )
+from repository import read_table
+from attendance_journal import drop_tracking_column
 
 def run_adminaudit():
     st.set_page_config(page_title="Admin Audit Logs", layout="wide")
@@ -20,21 +22,21 @@ def run_adminaudit():
     # -------------------- LOADERS --------------------
     def load_employee_data():
         if USE_SQL:
-            with get_sql_connection() as conn:
-                return pd.read_sql(f"SELECT * FROM {EMPLOYEE_DATA_TABLE}", conn)
+            with sql_connection() as conn:
+                return drop_tracking_column(pd.read_sql(f"SELECT * FROM {EMPLOYEE_DATA_TABLE}", conn))
         else:
-            return pd.read_csv(EMPLOYEE_DATA_CSV)
+            return read_table(EMPLOYEE_DATA_TABLE, use_sql=False)
 
     def load_employee_master():
         if USE_SQL:
-            with get_sql_connection() as conn:
+            with sql_connection() as conn:
                 return pd.read_sql(f"SELECT * FROM {EMPLOYEE_MASTER_TABLE}", conn)
         else:
             return pd.read_csv(EMPLOYEE_MASTER_CSV)
 
     def load_verified_admins():
         if USE_SQL:
-            with get_sql_connection() as conn:
+            with sql_connection() as conn:
                 df = pd.read_sql(f"SELECT admin_user FROM {VERIFIED_ADMIN_TABLE}", conn)
         else:
             if not os.path.exists(VERIFIED_ADMINS_CSV):
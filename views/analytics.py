@@ -5,12 +5,17 @@ import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import os
 from config import (
-    USE_SQL, safe_get_conn, table_exists, safe_float, safe_datetime_for_sql,
+    USE_SQL, sql_connection, table_exists, table_columns, safe_float, safe_datetime_for_sql,
     EMPLOYEE_MASTER_CSV, EMPLOYEE_DATA_CSV, SALARY_LOG_CSV, FEEDBACK_RAW_CSV ,FEEDBACK_REVIEWED_CSV,
     VERIFIED_ADMINS_CSV, RESIGNATION_LOG_CSV, BADGE_DIR,
     EMPLOYEE_MASTER_TABLE, EMPLOYEE_DATA_TABLE, SALARY_LOG_TABLE,
     FEEDBACK_RAW_TABLE,FEEDBACK_REVIEWED_TABLE, VERIFIED_ADMIN_TABLE, RESIGNATION_LOG_TABLE
 )
+import attendance_log
+import attendance_journal
+import attendance_rollup
+from repository import read_table
+from schema_migrations import ensure_migrated
 
 
 # -------------------------------
@@ -18,24 +23,10 @@ from config import (
 # -------------------------------
 
 def get_table_columns(conn, table_name):
-    """Get list of columns that actually exist in the table"""
+    """Get list of columns that actually exist in the table (from the schema cache)"""
     try:
-        if "." in table_name:
-            schema, tname = table_name.split(".", 1)
-        else:
-            schema, tname = "dbo", table_name
-
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT COLUMN_NAME 
-            FROM INFORMATION_SCHEMA.COLUMNS 
-            WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
-            ORDER BY ORDINAL_POSITION
-        """, (schema.strip("[]"), tname.strip("[]")))
-
-        columns = [row[0] for row in cursor.fetchall()]
-        return columns
-
+        # The ROWVERSION tracking column is binary; never select it
+        return [col for col in table_columns(conn, table_name) if col != attendance_journal.tracking_column()]
     except Exception as e:
         st.error(f"Error getting table columns: {str(e)}")
         return []
@@ -67,49 +58,47 @@ def build_safe_query(table_name, desired_columns, conn):
         return None, []
 
 
-def load_attendance_data():
-    """Load attendance data from SQL or CSV based on USE_SQL setting"""
+def load_attendance_data(start_date=None, end_date=None, department=None, employee_id=None):
+    """
+    Load attendance data from SQL or CSV based on USE_SQL setting, optionally
+    only punch-ins on start_date..end_date, of one department or one employee.
+    In SQL mode the filters run on the server.
+    """
     try:
         if USE_SQL:
-            conn = safe_get_conn()
-            if conn is None:
-                st.error("Failed to connect to SQL Server. Check your configuration.")
-                return pd.DataFrame()
-
-            # Check if tables exist
-            if not table_exists(conn, EMPLOYEE_DATA_TABLE):
-                st.error(f"Table {EMPLOYEE_DATA_TABLE} does not exist in database.")
-                conn.close()
-                return pd.DataFrame()
+            with sql_connection() as conn:
+                # Check if tables exist
+                if not table_exists(conn, EMPLOYEE_DATA_TABLE):
+                    st.error(f"Table {EMPLOYEE_DATA_TABLE} does not exist in database.")
+                    return pd.DataFrame()
 
-            if not table_exists(conn, EMPLOYEE_MASTER_TABLE):
-                st.error(f"Table {EMPLOYEE_MASTER_TABLE} does not exist in database.")
-                conn.close()
-                return pd.DataFrame()
+                if not table_exists(conn, EMPLOYEE_MASTER_TABLE):
+                    st.error(f"Table {EMPLOYEE_MASTER_TABLE} does not exist in database.")
+                    return pd.DataFrame()
 
-            # Build safe queries using available columns (updated to use extra_hours)
-            punch_desired_cols = ["employee_id", "employee_name", "start_datetime", "exit_datetime",
-                                  "attendance_status", "late_mark", "extra_hours"]
-            master_desired_cols = ["employee_id", "employee_name", "department", "designation",
-                                   "hire_date", "salary", "contact_number", "email"]
+                # Build safe queries using available columns (updated to use extra_hours)
+                punch_desired_cols = ["employee_id", "employee_name", "start_datetime", "exit_datetime",
+                                      "attendance_status", "late_mark", "extra_hours"]
+                master_desired_cols = ["employee_id", "employee_name", "department", "designation",
+                                       "hire_date", "salary", "contact_number", "email"]
 
-            punch_query, punch_cols = build_safe_query(EMPLOYEE_DATA_TABLE, punch_desired_cols, conn)
-            master_query, master_cols = build_safe_query(EMPLOYEE_MASTER_TABLE, master_desired_cols, conn)
+                punch_query, punch_cols = build_safe_query(EMPLOYEE_DATA_TABLE, punch_desired_cols, conn)
+                master_query, master_cols = build_safe_query(EMPLOYEE_MASTER_TABLE, master_desired_cols, conn)
 
-            if not punch_query or not master_query:
-                st.error("Could not build valid queries for the tables.")
-                conn.close()
-                return pd.DataFrame()
+                if not punch_query or not master_query:
+                    st.error("Could not build valid queries for the tables.")
+                    return pd.DataFrame()
 
-            # Add WHERE clause if start_datetime column exists
-            if "start_datetime" in punch_cols:
-                punch_query += " WHERE start_datetime IS NOT NULL"
+                # Filter on the server (see attendance_rollup.punch_filters)
+                punch_params = []
+                if "start_datetime" in punch_cols:
+                    where, punch_params = attendance_rollup.punch_filters(start_date, end_date, department, employee_id)
+                    punch_query += f" WHERE {where}"
 
-            st.info(f"Loading data with available columns: {', '.join(punch_cols)}")
+                st.info(f"Loading data with available columns: {', '.join(punch_cols)}")
 
-            punch_df = pd.read_sql(punch_query, conn)
-            master_df = pd.read_sql(master_query, conn)
-            conn.close()
+                punch_df = pd.read_sql(punch_query, conn, params=punch_params)
+                master_df = pd.read_sql(master_query, conn)
 
             # Convert datetime columns if they exist
             for col in ["start_datetime", "exit_datetime", "hire_date"]:
@@ -120,7 +109,7 @@ def load_attendance_data():
 
         else:
             # Load from CSV files
-            if not os.path.exists(EMPLOYEE_DATA_CSV):
+            if not os.path.exists(EMPLOYEE_DATA_CSV) and not attendance_log.is_enabled():
                 st.error(f"CSV file {EMPLOYEE_DATA_CSV} not found.")
                 return pd.DataFrame()
 
@@ -128,8 +117,9 @@ def load_attendance_data():
                 st.error(f"CSV file {EMPLOYEE_MASTER_CSV} not found.")
                 return pd.DataFrame()
 
-            punch_df = pd.read_csv(EMPLOYEE_DATA_CSV)
-            master_df = pd.read_csv(EMPLOYEE_MASTER_CSV)
+            # Attendance may live in the monthly event log; read_table knows where
+            punch_df = read_table(EMPLOYEE_DATA_TABLE, use_sql=False)
+            master_df = read_table(EMPLOYEE_MASTER_TABLE, use_sql=False)
 
             # Convert datetime columns if they exist
             datetime_cols = ["start_datetime", "exit_datetime", "hire_date"]
@@ -160,11 +150,24 @@ def load_attendance_data():
             merged = punch_df.copy()
             st.warning("Could not merge employee master data - no common employee_id column")
 
-        # Create derived columns if possible
+        # Create derived columns if possible (start_datetime is already parsed above)
         if "start_datetime" in merged.columns:
-            merged["date_only"] = pd.to_datetime(merged["start_datetime"], errors="coerce").dt.date
-            merged["weekday"] = pd.to_datetime(merged["start_datetime"], errors="coerce").dt.day_name()
-            merged["hour"] = pd.to_datetime(merged["start_datetime"], errors="coerce").dt.hour
+            start = merged["start_datetime"]
+            merged["date_only"] = start.dt.date
+            merged["weekday"] = start.dt.day_name()
+            merged["hour"] = start.dt.hour
+
+        # CSV mode: same filters as the SQL query
+        if not USE_SQL:
+            if start_date is not None and "date_only" in merged.columns:
+                merged = merged[merged["date_only"].notna() & (merged["date_only"] >= start_date)]
+            if end_date is not None and "date_only" in merged.columns:
+                merged = merged[merged["date_only"].notna() & (merged["date_only"] <= end_date)]
+            if department is not None and "department" in merged.columns:
+                merged = merged[merged["department"] == department]
+            if employee_id is not None:
+                wanted = attendance_log.normalize_employee_id(employee_id)
+                merged = merged[merged["employee_id"].map(attendance_log.normalize_employee_id) == wanted]
 
         return merged
 
@@ -173,39 +176,41 @@ def load_attendance_data():
         return pd.DataFrame()
 
 
+def load_attendance_rollups():
+    """Pre-aggregated attendance (see attendance_rollup.py), brought up to date with punches since the last visit"""
+    try:
+        return attendance_rollup.load_rollups()
+    except Exception as e:
+        st.error(f"Error loading attendance data: {str(e)}")
+        return attendance_rollup.AttendanceRollups([])
+
+
 def load_resignation_data():
     """Load resignation data from SQL or CSV based on USE_SQL setting"""
     try:
         if USE_SQL:
-            conn = safe_get_conn()
-            if conn is None:
-                st.warning("Failed to connect to SQL Server for resignation data.")
-                return pd.DataFrame()
-
-            if not table_exists(conn, RESIGNATION_LOG_TABLE):
-                st.warning(f"Table {RESIGNATION_LOG_TABLE} does not exist. Creating empty DataFrame.")
-                conn.close()
-                return pd.DataFrame()
+            with sql_connection() as conn:
+                if not table_exists(conn, RESIGNATION_LOG_TABLE):
+                    st.warning(f"Table {RESIGNATION_LOG_TABLE} does not exist. Creating empty DataFrame.")
+                    return pd.DataFrame()
 
-            # Build safe query using available columns
-            desired_cols = ["employee_id", "employee_name", "department", "notice_issued_date",
-                            "resignation_date", "reason", "status", "admin_cleared", "clearance_notes"]
+                # Build safe query using available columns
+                desired_cols = ["employee_id", "employee_name", "department", "notice_issued_date",
+                                "resignation_date", "reason", "status", "admin_cleared", "clearance_notes"]
 
-            query, available_cols = build_safe_query(RESIGNATION_LOG_TABLE, desired_cols, conn)
+                query, available_cols = build_safe_query(RESIGNATION_LOG_TABLE, desired_cols, conn)
 
-            if not query:
-                st.warning("Could not build valid query for resignation table.")
-                conn.close()
-                return pd.DataFrame()
+                if not query:
+                    st.warning("Could not build valid query for resignation table.")
+                    return pd.DataFrame()
 
-            # Add WHERE clause if notice_issued_date exists
-            if "notice_issued_date" in available_cols:
-                query += " WHERE notice_issued_date IS NOT NULL"
+                # Add WHERE clause if notice_issued_date exists
+                if "notice_issued_date" in available_cols:
+                    query += " WHERE notice_issued_date IS NOT NULL"
 
-            st.info(f"Loading resignation data with columns: {', '.join(available_cols)}")
+                st.info(f"Loading resignation data with columns: {', '.join(available_cols)}")
 
-            df = pd.read_sql(query, conn)
-            conn.close()
+                df = pd.read_sql(query, conn)
 
             # Convert datetime columns if they exist
             for col in ["notice_issued_date", "resignation_date"]:
@@ -240,30 +245,24 @@ def load_salary_data():
     """Load salary data from SQL or CSV based on USE_SQL setting"""
     try:
         if USE_SQL:
-            conn = safe_get_conn()
-            if conn is None:
-                return pd.DataFrame()
-
-            if not table_exists(conn, SALARY_LOG_TABLE):
-                conn.close()
-                return pd.DataFrame()
+            with sql_connection() as conn:
+                if not table_exists(conn, SALARY_LOG_TABLE):
+                    return pd.DataFrame()
 
-            # Build safe query using available columns
-            desired_cols = ["employee_id", "employee_name", "department", "salary_date",
-                            "base_salary", "overtime_pay", "deductions", "net_salary"]
+                # Build safe query using available columns
+                desired_cols = ["employee_id", "employee_name", "department", "salary_date",
+                                "base_salary", "overtime_pay", "deductions", "net_salary"]
 
-            query, available_cols = build_safe_query(SALARY_LOG_TABLE, desired_cols, conn)
+                query, available_cols = build_safe_query(SALARY_LOG_TABLE, desired_cols, conn)
 
-            if not query:
-                conn.close()
-                return pd.DataFrame()
+                if not query:
+                    return pd.DataFrame()
 
-            # Add ORDER BY if salary_date exists
-            if "salary_date" in available_cols:
-                query += " ORDER BY salary_date DESC"
+                # Add ORDER BY if salary_date exists
+                if "salary_date" in available_cols:
+                    query += " ORDER BY salary_date DESC"
 
-            df = pd.read_sql(query, conn)
-            conn.close()
+                df = pd.read_sql(query, conn)
 
             # Convert datetime columns if they exist
             if "salary_date" in df.columns:
@@ -290,17 +289,14 @@ def load_salary_data():
 # 📊 Enhanced Analytics Functions
 # -------------------------------
 
-def show_cxo_summary(df, resign_df):
+def show_cxo_summary(att, resign_df):
     st.subheader("🧠 CXO Snapshot")
 
     col1, col2, col3, col4 = st.columns(4)
 
     with col1:
-        if "hour" in df.columns:
-            avg_hour = df["hour"].dropna().mean()
-            st.metric("⏰ Avg Punch-In", f"{avg_hour:.1f}:00" if pd.notnull(avg_hour) else "N/A")
-        else:
-            st.metric("⏰ Avg Punch-In", "N/A")
+        avg_hour = att.avg_hour()
+        st.metric("⏰ Avg Punch-In", f"{avg_hour:.1f}:00" if avg_hour is not None else "N/A")
 
     with col2:
         if not resign_df.empty and "status" in resign_df.columns and "admin_cleared" in resign_df.columns:
@@ -313,60 +309,51 @@ def show_cxo_summary(df, resign_df):
         st.metric("🗂️ Pending Clearances", pending_clearances)
 
     with col3:
-        if not df.empty and "date_only" in df.columns and "employee_id" in df.columns:
-            last_punch = df.groupby("employee_id")["date_only"].max()
-            cutoff = pd.Timestamp.today().date() - pd.Timedelta(days=5)
-            inactive = (last_punch < cutoff).sum()
+        if not att.employees.empty:
+            cutoff = pd.Timestamp.today().normalize() - pd.Timedelta(days=5)
+            inactive = int((att.employees["last_date"] < cutoff).sum())
         else:
             inactive = 0
         st.metric("😴 Inactive Employees", inactive)
 
     with col4:
-        total_employees = df["employee_id"].nunique() if not df.empty and "employee_id" in df.columns else 0
-        st.metric("👥 Total Employees", total_employees)
+        st.metric("👥 Total Employees", len(att.employees))
 
 
-def show_kpis(df):
+def show_kpis(att):
     st.subheader("📌 Key Performance Indicators")
 
-    if df.empty:
+    if att.empty:
         st.info("No data available for KPIs")
         return
 
     col1, col2, col3, col4 = st.columns(4)
 
     with col1:
-        avg_punch_hour = df["hour"].dropna().mean() if "hour" in df.columns else None
-        st.metric("Avg Punch-In Hour", f"{avg_punch_hour:.2f}" if pd.notnull(avg_punch_hour) else "N/A")
+        avg_punch_hour = att.avg_hour()
+        st.metric("Avg Punch-In Hour", f"{avg_punch_hour:.2f}" if avg_punch_hour is not None else "N/A")
 
     with col2:
-        full_day_count = df[df["attendance_status"] == "Full Day"].shape[0] if "attendance_status" in df.columns else 0
-        st.metric("Full Day Attendance", full_day_count)
+        st.metric("Full Day Attendance", int(att.daily["full_day"].sum()))
 
     with col3:
-        late_count = df[df["late_mark"] == True].shape[0] if "late_mark" in df.columns else 0
-        st.metric("Late Arrivals", late_count)
+        st.metric("Late Arrivals", int(att.daily["late"].sum()))
 
     with col4:
-        # Use extra_hours instead of overtime_hours
-        if "extra_hours" in df.columns:
-            extra_hours = df["extra_hours"].sum()
-            st.metric("Total Extra Hours", f"{extra_hours:.1f}")
-        else:
-            st.metric("Total Extra Hours", "N/A")
+        st.metric("Total Extra Hours", f"{att.daily['extra_hours'].sum():.1f}")
 
 
-def show_attendance_heatmap(df):
+def show_attendance_heatmap(att):
     """Enhanced attendance heatmap with better error handling"""
     st.subheader("📆 Attendance Heatmap")
 
-    if df.empty or "weekday" not in df.columns or "hour" not in df.columns:
-        st.info("No attendance data available for heatmap - missing weekday or hour columns")
+    if att.hourly.empty:
+        st.info("No attendance data available for heatmap")
         return
 
     try:
         # Create heatmap data
-        heatmap_data = df.groupby(["weekday", "hour"]).size().unstack(fill_value=0)
+        heatmap_data = att.weekday_hour_counts().unstack(fill_value=0)
 
         if heatmap_data.empty:
             st.info("No data available for heatmap visualization")
@@ -390,55 +377,47 @@ def show_attendance_heatmap(df):
         st.error(f"Error creating heatmap: {str(e)}")
 
 
-def show_late_punch_trend(df):
+def show_late_punch_trend(att):
     st.subheader("⏰ Late Arrival Trend Analysis")
 
-    if df.empty or "late_mark" not in df.columns:
+    if att.empty:
         st.info("No late arrival data available")
         return
 
-    late_df = df[df["late_mark"] == True]
+    late_df = att.daily[att.daily["late"] > 0]
 
     if late_df.empty:
         st.success("✅ No late arrivals recorded in the selected period!")
         return
 
     # Trend by date
-    if "date_only" in late_df.columns:
-        late_trend = late_df.groupby("date_only").size()
-        st.bar_chart(late_trend)
+    late_trend = late_df.groupby(late_df["date_only"].dt.date)["late"].sum()
+    st.bar_chart(late_trend)
 
     # Department-wise late arrivals
-    if "department" in late_df.columns:
-        dept_late = late_df.groupby("department").size().sort_values(ascending=False)
+    dept_late = late_df.groupby("department")["late"].sum().sort_values(ascending=False)
+    if not dept_late.empty:
         st.subheader("Late Arrivals by Department")
         st.bar_chart(dept_late)
 
 
-def show_insights_summary(df):
+def show_insights_summary(att):
     st.subheader("🧾 Attendance Analytics Summary")
 
-    if df.empty:
+    if att.hourly.empty:
         st.info("📭 No attendance data available for insights.")
         return
 
-    if "weekday" not in df.columns or "hour" not in df.columns:
-        st.info("📭 No detailed punch data available for insights.")
-        return
-
-    punch_counts = df.groupby(["weekday", "hour"]).size().reset_index(name="count")
-
-    if punch_counts.empty:
-        st.info("📭 No detailed punch data available.")
-        return
+    punch_counts = att.weekday_hour_counts().reset_index(name="count")
 
     # Find peak and quiet times
     busiest = punch_counts.loc[punch_counts["count"].idxmax()]
     quietest = punch_counts.loc[punch_counts["count"].idxmin()]
 
     # Activity analysis
-    morning_shift = df[(df["hour"] >= 8) & (df["hour"] <= 10)].shape[0] if "hour" in df.columns else 0
-    evening_activity = df[df["hour"] >= 18].shape[0] if "hour" in df.columns else 0
+    hourly = att.hourly
+    morning_shift = int(hourly.loc[(hourly["hour"] >= 8) & (hourly["hour"] <= 10), "punches"].sum())
+    evening_activity = int(hourly.loc[hourly["hour"] >= 18, "punches"].sum())
 
     # Display summary
     col1, col2 = st.columns(2)
@@ -462,37 +441,36 @@ def show_insights_summary(df):
         """)
 
 
-def export_attendance_summary(df, dept):
+def export_attendance_summary(att, dept):
     st.subheader("📤 Export Attendance Data")
 
-    if df.empty:
+    if att.empty:
         st.info("No data available for export")
         return
 
-    # Prepare export data
-    export_df = df.copy()
-
-    # Add summary statistics - only use columns that exist
+    active_dates = att.active_dates()
     summary_stats = {
-        'Total Records': len(export_df),
-        'Date Range': f"{export_df['date_only'].min()} to {export_df['date_only'].max()}" if 'date_only' in export_df.columns else "N/A",
-        'Department': dept
+        'Total Records': att.punches,
+        'Date Range': f"{active_dates.min().date()} to {active_dates.max().date()}",
+        'Department': dept,
+        'Unique Employees': len(att.employees),
     }
 
-    if 'employee_id' in export_df.columns:
-        summary_stats['Unique Employees'] = export_df['employee_id'].nunique()
-
     col1, col2 = st.columns(2)
 
     with col1:
-        filename = f"{dept.lower().replace(' ', '_')}_attendance_summary_{datetime.now().strftime('%Y%m%d')}.csv"
-        st.download_button(
-            label="📥 Download Detailed CSV",
-            data=export_df.to_csv(index=False).encode("utf-8"),
-            file_name=filename,
-            mime="text/csv",
-            key="attendance_download"
-        )
+        # The dashboard itself only reads rollups; raw punches are loaded when someone asks for them
+        if st.button("📄 Prepare Detailed CSV", key="attendance_prepare"):
+            export_df = load_attendance_data(att.start.date(), att.end.date(), att.department)
+
+            filename = f"{dept.lower().replace(' ', '_')}_attendance_summary_{datetime.now().strftime('%Y%m%d')}.csv"
+            st.download_button(
+                label="📥 Download Detailed CSV",
+                data=export_df.to_csv(index=False).encode("utf-8"),
+                file_name=filename,
+                mime="text/csv",
+                key="attendance_download"
+            )
 
     with col2:
         # Export summary only
@@ -599,61 +577,53 @@ def export_clearance_report(df, key):
 # 🧠 Enhanced Behavioral Analytics
 # -------------------------------
 
-def show_punch_consistency(df):
+def show_punch_consistency(att):
     st.subheader("📏 Employee Attendance Consistency")
 
-    if df.empty or "employee_id" not in df.columns or "date_only" not in df.columns:
-        st.info("No data available for consistency analysis - missing employee_id or date_only columns")
+    if att.employees.empty:
+        st.info("No data available for consistency analysis")
         return
 
     # Calculate consistency scores
-    employee_punch_days = df.groupby("employee_id")["date_only"].nunique()
-    total_days = df["date_only"].nunique()
+    total_days = len(att.active_dates())
 
     if total_days == 0:
         st.info("No valid dates found for consistency calculation")
         return
 
+    employees = att.employees
     consistency_df = pd.DataFrame({
-        'employee_id': employee_punch_days.index,
-        'days_present': employee_punch_days.values,
+        'employee_id': employees["employee_id"],
+        'employee_name': employees["employee_name"],
+        'days_present': employees["active_days"],
         'total_days': total_days,
-        'consistency_score': (employee_punch_days.values / total_days * 100).round(1)
+        'consistency_score': (employees["active_days"] / total_days * 100).round(1)
     })
 
-    # Merge with employee names if available
-    if "employee_name" in df.columns:
-        name_mapping = df.groupby("employee_id")["employee_name"].first()
-        consistency_df["employee_name"] = consistency_df["employee_id"].map(name_mapping)
-
     # Show top and bottom performers
     col1, col2 = st.columns(2)
+    display_cols = ['employee_id', 'employee_name', 'consistency_score']
 
     with col1:
         st.subheader("🏆 Most Consistent")
         top_5 = consistency_df.nlargest(5, 'consistency_score')
-        display_cols = ['employee_id', 'consistency_score']
-        if 'employee_name' in consistency_df.columns:
-            display_cols = ['employee_id', 'employee_name', 'consistency_score']
         st.dataframe(top_5[display_cols].fillna('N/A'))
 
     with col2:
         st.subheader("⚠️ Needs Attention")
         bottom_5 = consistency_df.nsmallest(5, 'consistency_score')
-        display_cols = ['employee_id', 'consistency_score']
-        if 'employee_name' in consistency_df.columns:
-            display_cols = ['employee_id', 'employee_name', 'consistency_score']
         st.dataframe(bottom_5[display_cols].fillna('N/A'))
 
 
-def show_weekend_activity(df):
+def show_weekend_activity(att):
     st.subheader("🌤️ Weekend Work Pattern Analysis")
 
-    if df.empty or "weekday" not in df.columns:
+    if att.empty:
         st.info("No weekday data available for weekend analysis")
         return
 
-    weekends = df[df["weekday"].isin(["Saturday", "Sunday"])]
+    weekday = att.daily["date_only"].dt.day_name()
+    weekends = att.daily[weekday.isin(["Saturday", "Sunday"])]
 
     if weekends.empty:
         st.info("📅 No weekend activity recorded")
@@ -662,56 +632,35 @@ def show_weekend_activity(df):
     col1, col2 = st.columns(2)
 
     with col1:
-        weekend_summary = weekends["weekday"].value_counts()
+        weekend_summary = weekends.groupby(weekday[weekends.index])["punches"].sum().sort_values(ascending=False)
         st.bar_chart(weekend_summary)
-        st.metric("Total Weekend Punches", len(weekends))
+        st.metric("Total Weekend Punches", int(weekends["punches"].sum()))
 
     with col2:
-        # Department-wise weekend activity - only if department column exists
-        if "department" in weekends.columns:
-            dept_weekend = weekends.groupby("department").size().sort_values(ascending=False)
+        # Department-wise weekend activity
+        dept_weekend = weekends.groupby("department")["punches"].sum().sort_values(ascending=False)
+        if not dept_weekend.empty:
             st.subheader("Weekend Activity by Department")
             st.bar_chart(dept_weekend)
         else:
             st.info("Department data not available for weekend analysis")
 
 
-def show_department_summary(df):
+def show_department_summary(att):
     st.subheader("🏢 Department-wise Activity Overview")
 
-    if df.empty or "department" not in df.columns:
-        st.info("No department data available - department column not found in the dataset")
+    daily = att.daily.dropna(subset=["department"]) if not att.empty else att.daily
+    if daily.empty:
+        st.info("No department data available for the selected period")
         return
 
-    # Basic department stats - only use columns that exist
-    agg_dict = {
-        "employee_id": "nunique",
-        "date_only": "nunique" if "date_only" in df.columns else lambda x: 0
-    }
-
-    # Add late_mark aggregation only if column exists
-    if "late_mark" in df.columns:
-        agg_dict["late_mark"] = lambda x: x.sum() if x.dtype == bool else 0
-
-    # Add extra_hours aggregation only if column exists (changed from overtime_hours)
-    if "extra_hours" in df.columns:
-        agg_dict["extra_hours"] = lambda x: x.sum() if pd.api.types.is_numeric_dtype(x) else 0
-
-    dept_summary = df.groupby("department").agg(agg_dict)
-
-    # Rename columns
-    column_names = {
-        "employee_id": "unique_employees",
-        "date_only": "active_days"
-    }
-
-    if "late_mark" in agg_dict:
-        column_names["late_mark"] = "late_arrivals"
-
-    if "extra_hours" in agg_dict:
-        column_names["extra_hours"] = "total_extra_hours"
-
-    dept_summary = dept_summary.rename(columns=column_names)
+    dept_summary = daily.groupby("department").agg(
+        active_days=("date_only", "nunique"),
+        late_arrivals=("late", "sum"),
+        total_extra_hours=("extra_hours", "sum"),
+    )
+    employee_counts = att.employees.groupby("department")["employee_id"].nunique()
+    dept_summary.insert(0, "unique_employees", employee_counts.reindex(dept_summary.index, fill_value=0))
 
     st.dataframe(dept_summary)
 
@@ -724,53 +673,51 @@ def show_department_summary(df):
 
     with col2:
         st.subheader("Late Arrivals by Department")
-        if "late_arrivals" in dept_summary.columns and dept_summary["late_arrivals"].sum() > 0:
+        if dept_summary["late_arrivals"].sum() > 0:
             st.bar_chart(dept_summary["late_arrivals"])
         else:
             st.info("No late arrivals recorded or late arrival data not available")
 
 
-def show_hr_alerts(df):
+def show_hr_alerts(att):
     st.subheader("⚠️ HR Alert System")
 
-    if df.empty:
+    if att.empty:
         st.info("No data available for HR alerts")
         return
 
     alerts = []
+    daily = att.daily
+    today = pd.Timestamp.today().normalize()
 
-    # Check for departments with no recent activity - only if department column exists
-    if "department" in df.columns and "date_only" in df.columns:
-        yesterday = pd.Timestamp.today().date() - timedelta(days=1)
-        recent_activity = df[df["date_only"] >= yesterday - timedelta(days=2)]
+    # Check for departments with no recent activity
+    yesterday = today - timedelta(days=1)
+    recent_activity = daily[daily["date_only"] >= yesterday - timedelta(days=2)]
 
-        if not recent_activity.empty:
-            active_depts = recent_activity["department"].dropna().unique()
-            all_depts = df["department"].dropna().unique()
-            missing_depts = [d for d in all_depts if d not in active_depts]
+    if not recent_activity.empty:
+        active_depts = recent_activity["department"].dropna().unique()
+        all_depts = daily["department"].dropna().unique()
+        missing_depts = [d for d in all_depts if d not in active_depts]
 
-            if missing_depts:
-                alerts.append(f"🛑 No recent activity from: {', '.join(missing_depts)}")
+        if missing_depts:
+            alerts.append(f"🛑 No recent activity from: {', '.join(missing_depts)}")
 
     # Check for inactive employees
-    if "employee_id" in df.columns and "date_only" in df.columns:
-        last_punch = df.groupby("employee_id")["date_only"].max()
-        cutoff = pd.Timestamp.today().date() - timedelta(days=7)
-        inactive_employees = last_punch[last_punch < cutoff]
+    if not att.employees.empty:
+        inactive_employees = att.employees[att.employees["last_date"] < today - timedelta(days=7)]
 
         if not inactive_employees.empty:
             alerts.append(f"⏳ {len(inactive_employees)} employees inactive for 7+ days")
 
-    # Check for excessive late arrivals - only if late_mark column exists
-    if "late_mark" in df.columns and "date_only" in df.columns:
-        recent_week = df[df["date_only"] >= pd.Timestamp.today().date() - timedelta(days=7)]
-        if not recent_week.empty:
-            late_count = recent_week[recent_week["late_mark"] == True].shape[0]
-            total_punches = len(recent_week)
+    # Check for excessive late arrivals
+    recent_week = daily[daily["date_only"] >= today - timedelta(days=7)]
+    if not recent_week.empty:
+        late_count = int(recent_week["late"].sum())
+        total_punches = int(recent_week["punches"].sum())
 
-            if total_punches > 0 and (late_count / total_punches) > 0.2:
-                alerts.append(
-                    f"🚨 High late arrival rate: {late_count}/{total_punches} ({late_count / total_punches * 100:.1f}%)")
+        if total_punches > 0 and (late_count / total_punches) > 0.2:
+            alerts.append(
+                f"🚨 High late arrival rate: {late_count}/{total_punches} ({late_count / total_punches * 100:.1f}%)")
 
     # Display alerts
     if alerts:
@@ -801,68 +748,44 @@ def log_feedback(category, department, message, sender="Anonymous", path="data/f
         }
 
         if USE_SQL:
-            conn = safe_get_conn()
-            if conn is None:
-                st.error("Failed to connect to database for feedback logging")
-                return False
-
-            # Check what columns actually exist in the table
-            existing_columns = get_table_columns(conn, FEEDBACK_RAW_TABLE)
-
-            if not existing_columns:
-                # Table doesn't exist, create it with all columns
-                create_query = f"""
-                CREATE TABLE {FEEDBACK_RAW_TABLE} (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    timestamp DATETIME NOT NULL,
-                    category NVARCHAR(100),
-                    department NVARCHAR(100),
-                    sender NVARCHAR(100),
-                    message NVARCHAR(MAX),
-                    status NVARCHAR(50) DEFAULT 'Pending',
-                    created_date DATETIME DEFAULT GETDATE()
-                )
-                """
-                conn.execute(create_query)
-                conn.commit()
-                existing_columns = ["timestamp", "category", "department", "sender", "message", "status"]
-
-            # Build insert query with only existing columns
-            insert_columns = []
-            insert_values = []
-            insert_placeholders = []
-
-            column_mapping = {
-                "timestamp": safe_datetime_for_sql(new_entry["timestamp"]),
-                "category": new_entry["category"],
-                "department": new_entry["department"],
-                "sender": new_entry["sender"],
-                "message": new_entry["message"],
-                "status": new_entry["status"]
-            }
-
-            for col, value in column_mapping.items():
-                if col in existing_columns:
-                    insert_columns.append(col)
-                    insert_values.append(value)
-                    insert_placeholders.append("?")
-
-            if insert_columns:
-                insert_query = f"""
-                    INSERT INTO {FEEDBACK_RAW_TABLE} 
-                    ({', '.join(insert_columns)})
-                    VALUES ({', '.join(insert_placeholders)})
-                """
-
-                conn.execute(insert_query, insert_values)
-                conn.commit()
-                st.success(f"Feedback logged with available columns: {', '.join(insert_columns)}")
-            else:
-                st.error("No compatible columns found in feedback table")
-                conn.close()
-                return False
-
-            conn.close()
+            with sql_connection() as conn:
+                # The table is created by schema_migrations.py; check what columns actually exist in it
+                ensure_migrated(conn)
+                existing_columns = get_table_columns(conn, FEEDBACK_RAW_TABLE)
+
+                # Build insert query with only existing columns
+                insert_columns = []
+                insert_values = []
+                insert_placeholders = []
+
+                column_mapping = {
+                    "timestamp": safe_datetime_for_sql(new_entry["timestamp"]),
+                    "category": new_entry["category"],
+                    "department": new_entry["department"],
+                    "sender": new_entry["sender"],
+                    "message": new_entry["message"],
+                    "status": new_entry["status"]
+                }
+
+                for col, value in column_mapping.items():
+                    if col in existing_columns:
+                        insert_columns.append(col)
+                        insert_values.append(value)
+                        insert_placeholders.append("?")
+
+                if insert_columns:
+                    insert_query = f"""
+                        INSERT INTO {FEEDBACK_RAW_TABLE} 
+                        ({', '.join(insert_columns)})
+                        VALUES ({', '.join(insert_placeholders)})
+                    """
+
+                    conn.execute(insert_query, insert_values)
+                    conn.commit()
+                    st.success(f"Feedback logged with available columns: {', '.join(insert_columns)}")
+                else:
+                    st.error("No compatible columns found in feedback table")
+                    return False
 
         else:
             # CSV fallback - Using your original two-file approach
@@ -937,31 +860,25 @@ def load_feedback_data():
     """Load feedback data from SQL or CSV - maintains your original two-file logic"""
     try:
         if USE_SQL:
-            conn = safe_get_conn()
-            if conn is None:
-                return pd.DataFrame()
-
-            if not table_exists(conn, FEEDBACK_REVIEWED_TABLE):
-                conn.close()
-                return pd.DataFrame()
+            with sql_connection() as conn:
+                if not table_exists(conn, FEEDBACK_REVIEWED_TABLE):
+                    return pd.DataFrame()
 
-            # Use the safe query approach like other functions
-            desired_cols = ["timestamp", "category", "department", "sender", "message", "status"]
-            query, available_cols = build_safe_query(FEEDBACK_REVIEWED_TABLE, desired_cols, conn)
+                # Use the safe query approach like other functions
+                desired_cols = ["timestamp", "category", "department", "sender", "message", "status"]
+                query, available_cols = build_safe_query(FEEDBACK_REVIEWED_TABLE, desired_cols, conn)
 
-            if not query:
-                st.warning("Could not build valid query for feedback table.")
-                conn.close()
-                return pd.DataFrame()
+                if not query:
+                    st.warning("Could not build valid query for feedback table.")
+                    return pd.DataFrame()
 
-            # Add ORDER BY if timestamp exists
-            if "timestamp" in available_cols:
-                query += " ORDER BY timestamp DESC"
+                # Add ORDER BY if timestamp exists
+                if "timestamp" in available_cols:
+                    query += " ORDER BY timestamp DESC"
 
-            st.info(f"Loading feedback data with columns: {', '.join(available_cols)}")
+                st.info(f"Loading feedback data with columns: {', '.join(available_cols)}")
 
-            df = pd.read_sql(query, conn)
-            conn.close()
+                df = pd.read_sql(query, conn)
 
             # Convert timestamp column if it exists
             if "timestamp" in df.columns:
@@ -995,30 +912,25 @@ def update_feedback_status(feedback_df, row_index, new_status, reviewed_path="da
     """Update feedback status - handles both SQL and CSV"""
     try:
         if USE_SQL:
-            conn = safe_get_conn()
-            if conn is None:
-                return False
-
-            # Get the timestamp to identify the record
-            timestamp = feedback_df.iloc[row_index]["timestamp"]
-
-            # Check if status column exists
-            existing_columns = get_table_columns(conn, FEEDBACK_REVIEWED_TABLE)
-
-            if "status" in existing_columns:
-                update_query = f"""
-                    UPDATE {FEEDBACK_REVIEWED_TABLE} 
-                    SET status = ?
-                    WHERE timestamp = ?
-                """
-                conn.execute(update_query, (new_status, timestamp))
-            else:
-                st.warning("Status column not found in feedback table - update skipped")
-                conn.close()
-                return False
+            with sql_connection() as conn:
+                # Get the timestamp to identify the record
+                timestamp = feedback_df.iloc[row_index]["timestamp"]
+
+                # Check if status column exists
+                existing_columns = get_table_columns(conn, FEEDBACK_REVIEWED_TABLE)
+
+                if "status" in existing_columns:
+                    update_query = f"""
+                        UPDATE {FEEDBACK_REVIEWED_TABLE} 
+                        SET status = ?
+                        WHERE timestamp = ?
+                    """
+                    conn.execute(update_query, (new_status, timestamp))
+                else:
+                    st.warning("Status column not found in feedback table - update skipped")
+                    return False
 
-            conn.commit()
-            conn.close()
+                conn.commit()
             return True
 
         else:
@@ -1083,19 +995,19 @@ def run_analytics():
 
     # Load data with error handling
     with st.spinner("Loading data..."):
-        df = load_attendance_data()
+        rollups = load_attendance_rollups()
         resign_df = load_resignation_data()
         salary_df = load_salary_data()
 
     # Debug mode toggle
     if st.sidebar.checkbox("🛠️ Debug Mode"):
         st.sidebar.subheader("Data Status")
-        st.sidebar.write(f"Attendance records: {len(df)}")
+        st.sidebar.write(f"Attendance records: {int(rollups.daily['punches'].sum()) if not rollups.empty else 0}")
         st.sidebar.write(f"Resignation records: {len(resign_df)}")
         st.sidebar.write(f"Salary records: {len(salary_df)}")
 
-        if not df.empty:
-            st.sidebar.write("Attendance columns:", df.columns.tolist())
+        st.sidebar.write(f"Rollup months: {len(rollups.months)}")
+        st.sidebar.write(f"Last refresh: {attendance_rollup.read_state().get('refreshed_at', 'never')}")
 
         if st.sidebar.button("Show Sample Data"):
             st.subheader("🔍 Sample Data Preview")
@@ -1103,7 +1015,7 @@ def run_analytics():
             col1, col2 = st.columns(2)
             with col1:
                 st.write("**Attendance Data Sample:**")
-                st.dataframe(df.head(3) if not df.empty else pd.DataFrame({"Status": ["No data"]}))
+                st.dataframe(rollups.daily.head(3) if not rollups.empty else pd.DataFrame({"Status": ["No data"]}))
 
             with col2:
                 st.write("**Resignation Data Sample:**")
@@ -1113,7 +1025,7 @@ def run_analytics():
     st.title("📊 Validex HR Analytics Dashboard")
     st.markdown("### Comprehensive workforce insights and analytics")
 
-    if df.empty:
+    if rollups.empty:
         st.error("❌ No attendance data available. Please check your data source configuration.")
         st.stop()
 
@@ -1125,34 +1037,26 @@ def run_analytics():
 
     with col1:
         # Date range selection
-        df_dates = df.dropna(subset=["date_only"]) if "date_only" in df.columns else pd.DataFrame()
-        if not df_dates.empty:
-            min_date = df_dates["date_only"].min()
-            max_date = df_dates["date_only"].max()
-
-            date_range = st.date_input(
-                "Select Date Range:",
-                value=(min_date, max_date),
-                min_value=min_date,
-                max_value=max_date,
-                key="date_filter"
-            )
+        min_date, max_date = rollups.date_bounds()
+        start_date, end_date = min_date, max_date
+
+        date_range = st.date_input(
+            "Select Date Range:",
+            value=(min_date, max_date),
+            min_value=min_date,
+            max_value=max_date,
+            key="date_filter"
+        )
 
-            if len(date_range) == 2:
+        if len(date_range) == 2:
+            if date_range[0] <= date_range[1]:
                 start_date, end_date = date_range
-                if start_date <= end_date:
-                    df = df[(df["date_only"] >= start_date) & (df["date_only"] <= end_date)]
-                else:
-                    st.warning("⚠️ Start date must be before or equal to end date")
-        else:
-            st.warning("⚠️ No valid dates found in attendance data")
+            else:
+                st.warning("⚠️ Start date must be before or equal to end date")
 
     with col2:
         # Department filter
-        if "department" in df.columns:
-            departments = ["All Departments"] + sorted(df["department"].dropna().unique().tolist())
-        else:
-            departments = ["All Departments"]
+        departments = ["All Departments"] + rollups.departments()
 
         selected_dept = st.selectbox(
             "📁 Filter by Department:",
@@ -1160,18 +1064,17 @@ def run_analytics():
             key="dept_filter"
         )
 
-        if selected_dept != "All Departments" and "department" in df.columns:
-            filtered_df = df[df["department"] == selected_dept].copy()
+        if selected_dept != "All Departments":
+            att = rollups.select(start_date, end_date, selected_dept)
             filtered_resign_df = resign_df[resign_df[
                                                "department"] == selected_dept].copy() if not resign_df.empty and "department" in resign_df.columns else pd.DataFrame()
         else:
-            filtered_df = df.copy()
+            att = rollups.select(start_date, end_date)
             filtered_resign_df = resign_df.copy()
 
     # Display current filter status
-    date_range_info = len(filtered_df['date_only'].dropna().unique()) if 'date_only' in filtered_df.columns else 0
     st.info(
-        f"📊 Showing data for **{selected_dept}** | Records: {len(filtered_df)} | Date range: {date_range_info} days")
+        f"📊 Showing data for **{selected_dept}** | Records: {att.punches} | Date range: {len(att.active_dates())} days")
 
     # Main dashboard tabs
     st.markdown("---")
@@ -1188,12 +1091,12 @@ def run_analytics():
         st.header("📊 Attendance Analytics Dashboard")
 
         # Executive summary
-        show_cxo_summary(filtered_df, filtered_resign_df)
+        show_cxo_summary(att, filtered_resign_df)
 
         st.markdown("---")
 
         # KPIs section
-        show_kpis(filtered_df)
+        show_kpis(att)
 
         st.markdown("---")
 
@@ -1201,20 +1104,20 @@ def run_analytics():
         col1, col2 = st.columns([2, 1])
 
         with col1:
-            show_attendance_heatmap(filtered_df)
+            show_attendance_heatmap(att)
 
         with col2:
-            show_late_punch_trend(filtered_df)
+            show_late_punch_trend(att)
 
         st.markdown("---")
 
         # Detailed insights
-        show_insights_summary(filtered_df)
+        show_insights_summary(att)
 
         st.markdown("---")
 
         # Export functionality
-        export_attendance_summary(filtered_df, selected_dept)
+        export_attendance_summary(att, selected_dept)
 
         # Feedback section
         st.markdown("---")
@@ -1301,17 +1204,17 @@ def run_analytics():
         st.header("🧠 Employee Behavioral Analytics")
 
         # Consistency analysis
-        show_punch_consistency(filtered_df)
+        show_punch_consistency(att)
 
         st.markdown("---")
 
         # Weekend activity
-        show_weekend_activity(filtered_df)
+        show_weekend_activity(att)
 
         st.markdown("---")
 
         # Department overview
-        show_department_summary(filtered_df)
+        show_department_summary(att)
 
         st.markdown("---")
 
@@ -1320,8 +1223,9 @@ def run_analytics():
 
         with col1:
             st.subheader("🔮 Late Arrival Predictions")
-            if not filtered_df.empty and "late_mark" in filtered_df.columns and "weekday" in filtered_df.columns:
-                late_by_day = filtered_df[filtered_df["late_mark"] == True].groupby("weekday").size()
+            if not att.empty:
+                late_by_day = att.by_weekday("late")
+                late_by_day = late_by_day[late_by_day > 0]
                 if not late_by_day.empty:
                     st.bar_chart(late_by_day)
                     most_likely_day = late_by_day.idxmax()
@@ -1333,9 +1237,8 @@ def run_analytics():
 
         with col2:
             st.subheader("👤 Attendance Personalities")
-            if not filtered_df.empty and "hour" in filtered_df.columns and "employee_id" in filtered_df.columns:
-                profile_df = filtered_df.dropna(subset=["hour"]).groupby("employee_id")["hour"].agg(
-                    ['mean', 'std']).reset_index()
+            if not att.employees.empty:
+                profile_df = att.employees[["employee_id", "avg_hour", "hour_std"]]
                 profile_df.columns = ["employee_id", "avg_hour", "consistency"]
                 profile_df = profile_df.head(10)  # Top 10
 
@@ -1349,7 +1252,7 @@ def run_analytics():
         st.markdown("---")
 
         # HR alerts
-        show_hr_alerts(filtered_df)
+        show_hr_alerts(att)
 
         # Feedback section
         st.markdown("---")
@@ -2,7 +2,7 @@ import streamlit as st
 import pandas as pd
 import datetime
 import os
-from config import USE_SQL, get_sql_connection
+from config import USE_SQL, sql_connection
 
 
 def run_appraisal_analytics():
@@ -12,9 +12,8 @@ def run_appraisal_analytics():
     master_path = "data/employee_master.csv"
 
     if USE_SQL:
-        conn = get_sql_connection()
-        master = pd.read_sql("SELECT * FROM dbo.employee_master", conn)
-        conn.close()
+        with sql_connection() as conn:
+            master = pd.read_sql("SELECT * FROM dbo.employee_master", conn)
     else:
         master = pd.read_csv(master_path)
     master["employee_id"] = master["employee_id"].astype(str)
@@ -49,13 +48,12 @@ def run_appraisal_analytics():
 
     # 📜 Show existing appraisal history
     if USE_SQL:
-        conn = get_sql_connection()
-        history_df = pd.read_sql(f"""
-            SELECT * FROM dbo.appraisal_history
-            WHERE employee_id = '{selected_id}'
-            ORDER BY appraisal_date DESC
-        """, conn)
-        conn.close()
+        with sql_connection() as conn:
+            history_df = pd.read_sql(f"""
+                SELECT * FROM dbo.appraisal_history
+                WHERE employee_id = '{selected_id}'
+                ORDER BY appraisal_date DESC
+            """, conn)
     else:
         history_path = "data/appraisal_history.csv"
         if os.path.exists(history_path):
@@ -92,58 +90,55 @@ def run_appraisal_analytics():
         today = datetime.datetime.now().date()
 
         if USE_SQL:
-            conn = get_sql_connection()
-            cursor = conn.cursor()
             try:
-                # ✅ CORRECTED: Only update new_salary, keep fixed_salary unchanged
-                cursor.execute("""
-                    UPDATE dbo.employee_master
-                    SET
-                        performance_rating = ?,
-                        appraisal_hike_percent = ?,
-                        reviewer_id = ?,
-                        appraisal_notes = ?,
-                        appraisal_date = ?,
-                        new_salary = ?
-                    WHERE employee_id = ?
-                """, (
-                    rating, hike_percent, reviewer, notes,
-                    today, round(new_salary, 2), selected_id
-                ))
-
-                # Add to appraisal history
-                cursor.execute("""
-                    INSERT INTO dbo.appraisal_history (
-                        employee_id, reviewer_id, rating, hike_percent,
-                        notes, appraisal_date, new_salary
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    selected_id, reviewer, rating, hike_percent,
-                    notes, today, round(new_salary, 2)
-                ))
-                conn.commit()
-
-                # Show success with growth details
-                total_growth = new_salary - joining_salary
-                total_growth_percent = (total_growth / joining_salary * 100) if joining_salary > 0 else 0
-
-                st.success(f"🎉 Appraisal Applied Successfully!")
-                st.info(f"💰 New Salary: ₹{round(new_salary):,}")
-                st.info(f"📈 Total Growth Since Joining: +₹{total_growth:,.2f} ({total_growth_percent:.1f}%)")
+                with sql_connection() as conn:
+                    cursor = conn.cursor()
+                    # ✅ CORRECTED: Only update new_salary, keep fixed_salary unchanged
+                    cursor.execute("""
+                        UPDATE dbo.employee_master
+                        SET
+                            performance_rating = ?,
+                            appraisal_hike_percent = ?,
+                            reviewer_id = ?,
+                            appraisal_notes = ?,
+                            appraisal_date = ?,
+                            new_salary = ?
+                        WHERE employee_id = ?
+                    """, (
+                        rating, hike_percent, reviewer, notes,
+                        today, round(new_salary, 2), selected_id
+                    ))
+
+                    # Add to appraisal history
+                    cursor.execute("""
+                        INSERT INTO dbo.appraisal_history (
+                            employee_id, reviewer_id, rating, hike_percent,
+                            notes, appraisal_date, new_salary
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, (
+                        selected_id, reviewer, rating, hike_percent,
+                        notes, today, round(new_salary, 2)
+                    ))
+                    conn.commit()
+
+                    # Show success with growth details
+                    total_growth = new_salary - joining_salary
+                    total_growth_percent = (total_growth / joining_salary * 100) if joining_salary > 0 else 0
+
+                    st.success(f"🎉 Appraisal Applied Successfully!")
+                    st.info(f"💰 New Salary: ₹{round(new_salary):,}")
+                    st.info(f"📈 Total Growth Since Joining: +₹{total_growth:,.2f} ({total_growth_percent:.1f}%)")
 
             except Exception as e:
                 st.error(f"❌ Failed to update SQL: {e}")
-            finally:
-                conn.close()
 
             # 🔄 Refresh and show updated history
-            conn = get_sql_connection()
-            history_df = pd.read_sql(f"""
-                SELECT * FROM dbo.appraisal_history
-                WHERE employee_id = '{selected_id}'
-                ORDER BY appraisal_date DESC
-            """, conn)
-            conn.close()
+            with sql_connection() as conn:
+                history_df = pd.read_sql(f"""
+                    SELECT * FROM dbo.appraisal_history
+                    WHERE employee_id = '{selected_id}'
+                    ORDER BY appraisal_date DESC
+                """, conn)
             st.subheader("📜 Updated Appraisal History")
             st.dataframe(history_df)
 
@@ -1,7 +1,7 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from config import USE_SQL, get_sql_connection
+from config import USE_SQL, sql_connection
 
 def run_appraisal_audit_log1():
     st.title("📊 Appraisal Intelligence Dashboard")
@@ -9,9 +9,8 @@ def run_appraisal_audit_log1():
 
     # Load employee master data
     if USE_SQL:
-        conn = get_sql_connection()
-        master_df = pd.read_sql("SELECT * FROM dbo.employee_master", conn)
-        conn.close()
+        with sql_connection() as conn:
+            master_df = pd.read_sql("SELECT * FROM dbo.employee_master", conn)
     else:
         master_path = "data/employee_master.csv"
         master_df = pd.read_csv(master_path)
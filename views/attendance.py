@@ -1,7 +1,10 @@
 import streamlit as st
 import pandas as pd
 import os
-from datetime import datetime
+import bisect
+import csv
+import io
+from datetime import datetime, date
 import pyodbc
 import math
 import folium
@@ -11,13 +14,20 @@ import base64
 import json
 
 # Import your existing utilities
-from utils.biometric_utils import compare_faces
+from utils.biometric_utils import compare_faces, get_badge_embedding
+from face_reverification import archive_snapshot
+from utils.file_lock import file_lock
 from utils.data_helpers import get_greeting
+import parquet_store
+import attendance_log
+import attendance_journal
 from config import *
 from config import (
     EMPLOYEE_DATA_TABLE,  # Add this explicit import
     USE_SQL,
-    get_sql_connection,
+    USE_PARQUET,
+    sql_connection,
+    bump_table_version,
     safe_datetime_for_sql,
     safe_date_for_sql,
     safe_float,
@@ -287,11 +297,19 @@ PRESET_LOCATIONS = {
 
 
 # ===== Database Functions (Same as original) =====
+# Column order of the attendance table (SQL INSERT order and CSV header for new files)
+ATTENDANCE_COLUMNS = [
+    "employee_id", "employee_name", "start_datetime", "exit_datetime",
+    "date_only", "total_hours", "extra_hours", "extra_pay",
+    "attendance_status", "late_mark", "method", "confidence", "notes",
+    "location_lat", "location_lon", "location_verified", "location_name"
+]
+
 def load_employee_master():
     """Load employee master data"""
     if USE_SQL:
         try:
-            with get_sql_connection() as conn:
+            with sql_connection() as conn:
                 df = pd.read_sql(f"SELECT * FROM {EMPLOYEE_MASTER_TABLE}", conn)
                 df.columns = df.columns.str.strip().str.lower()
                 return df
@@ -306,8 +324,8 @@ def load_attendance():
     """Load attendance data"""
     if USE_SQL:
         try:
-            with get_sql_connection() as conn:
-                df = pd.read_sql(f"SELECT * FROM {EMPLOYEE_DATA_TABLE}", conn)
+            with sql_connection() as conn:
+                df = attendance_journal.drop_tracking_column(pd.read_sql(f"SELECT * FROM {EMPLOYEE_DATA_TABLE}", conn))
                 if 'start_datetime' in df.columns:
                     df['start_datetime'] = pd.to_datetime(df['start_datetime'], errors='coerce')
                 if 'exit_datetime' in df.columns:
@@ -326,47 +344,67 @@ def load_attendance():
 
 def create_empty_attendance_df():
     """Create empty attendance DataFrame with proper columns"""
-    return pd.DataFrame(columns=[
-        "employee_id", "employee_name", "start_datetime", "exit_datetime",
-        "date_only", "total_hours", "extra_hours", "extra_pay",
-        "attendance_status", "late_mark", "method", "confidence", "notes",
-        "location_lat", "location_lon", "location_verified", "location_name"
-    ])
+    return pd.DataFrame(columns=ATTENDANCE_COLUMNS)
+
+
+def _attendance_sql_values(row):
+    """Convert one attendance row (Series or dict) into SQL-safe column values"""
+    employee_id = str(row["employee_id"])
+    employee_name = str(row["employee_name"])
+    start_datetime = safe_datetime_for_sql(row["start_datetime"])
+    exit_datetime = safe_datetime_for_sql(row["exit_datetime"]) if pd.notna(row["exit_datetime"]) else None
+
+    date_only = safe_date_for_sql(row["date_only"])
+    if date_only is None:
+        if start_datetime:
+            date_only = start_datetime.date()
+        else:
+            date_only = datetime.now().date()
+
+    total_hours = safe_float(row["total_hours"]) if pd.notna(row["total_hours"]) else None
+    extra_hours = safe_float(row["extra_hours"]) if pd.notna(row["extra_hours"]) else 0
+    extra_pay = safe_float(row["extra_pay"]) if pd.notna(row["extra_pay"]) else 0
+    attendance_status = str(row["attendance_status"]) if pd.notna(row["attendance_status"]) else None
+    late_mark = bool(row["late_mark"]) if pd.notna(row["late_mark"]) else False
+    method = str(row["method"]) if pd.notna(row["method"]) else "GPS + Face Recognition"
+    confidence = safe_float(row["confidence"], precision=5, scale=2) if pd.notna(row["confidence"]) else 0
+    notes = str(row["notes"]) if pd.notna(row["notes"]) else ""
+
+    location_lat = safe_float(row.get("location_lat")) if pd.notna(row.get("location_lat")) else None
+    location_lon = safe_float(row.get("location_lon")) if pd.notna(row.get("location_lon")) else None
+    location_verified = bool(row.get("location_verified", False))
+    location_name = str(row.get("location_name", "")) if pd.notna(row.get("location_name")) else ""
+
+    return {
+        "employee_id": employee_id,
+        "employee_name": employee_name,
+        "start_datetime": start_datetime,
+        "exit_datetime": exit_datetime,
+        "date_only": date_only,
+        "total_hours": total_hours,
+        "extra_hours": extra_hours,
+        "extra_pay": extra_pay,
+        "attendance_status": attendance_status,
+        "late_mark": late_mark,
+        "method": method,
+        "confidence": confidence,
+        "notes": notes,
+        "location_lat": location_lat,
+        "location_lon": location_lon,
+        "location_verified": location_verified,
+        "location_name": location_name,
+    }
 
 
 def save_attendance(df):
     """Save attendance data with proper SQL/temporary CSV fallback handling"""
     if USE_SQL:
         try:
-            with get_sql_connection() as conn:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
 
                 for _, row in df.iterrows():
-                    employee_id = str(row["employee_id"])
-                    employee_name = str(row["employee_name"])
-                    start_datetime = safe_datetime_for_sql(row["start_datetime"])
-                    exit_datetime = safe_datetime_for_sql(row["exit_datetime"]) if pd.notna(row["exit_datetime"]) else None
-
-                    date_only = safe_date_for_sql(row["date_only"])
-                    if date_only is None:
-                        if start_datetime:
-                            date_only = start_datetime.date()
-                        else:
-                            date_only = datetime.now().date()
-
-                    total_hours = safe_float(row["total_hours"]) if pd.notna(row["total_hours"]) else None
-                    extra_hours = safe_float(row["extra_hours"]) if pd.notna(row["extra_hours"]) else 0
-                    extra_pay = safe_float(row["extra_pay"]) if pd.notna(row["extra_pay"]) else 0
-                    attendance_status = str(row["attendance_status"]) if pd.notna(row["attendance_status"]) else None
-                    late_mark = bool(row["late_mark"]) if pd.notna(row["late_mark"]) else False
-                    method = str(row["method"]) if pd.notna(row["method"]) else "GPS + Face Recognition"
-                    confidence = safe_float(row["confidence"], precision=5, scale=2) if pd.notna(row["confidence"]) else 0
-                    notes = str(row["notes"]) if pd.notna(row["notes"]) else ""
-
-                    location_lat = safe_float(row.get("location_lat")) if pd.notna(row.get("location_lat")) else None
-                    location_lon = safe_float(row.get("location_lon")) if pd.notna(row.get("location_lon")) else None
-                    location_verified = bool(row.get("location_verified", False))
-                    location_name = str(row.get("location_name", "")) if pd.notna(row.get("location_name")) else ""
+                    v = _attendance_sql_values(row)
 
                     # Fixed SQL with proper EMPLOYEE_DATA_TABLE reference
                     merge_sql = f"""
@@ -397,18 +435,18 @@ def save_attendance(df):
                     """
 
                     params = (
-                        employee_id, date_only,
-                        employee_name, exit_datetime, total_hours, extra_hours, extra_pay,
-                        attendance_status, late_mark, method, confidence, notes,
-                        location_lat, location_lon, location_verified, location_name,
-                        employee_id, employee_name, start_datetime, exit_datetime, date_only,
-                        total_hours, extra_hours, extra_pay, attendance_status, late_mark,
-                        method, confidence, notes, location_lat, location_lon, location_verified, location_name
+                        v["employee_id"], v["date_only"],
+                        v["employee_name"], v["exit_datetime"], v["total_hours"], v["extra_hours"],
+                        v["extra_pay"], v["attendance_status"], v["late_mark"], v["method"],
+                        v["confidence"], v["notes"], v["location_lat"], v["location_lon"],
+                        v["location_verified"], v["location_name"],
+                        *(v[col] for col in ATTENDANCE_COLUMNS)
                     )
 
                     cursor.execute(merge_sql, params)
 
                 conn.commit()
+                bump_table_version(EMPLOYEE_DATA_TABLE)
                 st.success("✅ Data saved to SQL database successfully!")
                 log_attendance_save("SUCCESS", "SQL", len(df), "Data saved to SQL database")
 
@@ -435,7 +473,10 @@ def save_attendance(df):
             df_copy = df.copy()
             if 'date_only' in df_copy.columns:
                 df_copy['date_only'] = pd.to_datetime(df_copy['date_only']).dt.date
-            df_copy.to_csv(EMPLOYEE_DATA_CSV, index=False)
+            with file_lock(EMPLOYEE_DATA_CSV):
+                df_copy.to_csv(EMPLOYEE_DATA_CSV, index=False)
+            attendance_journal.record_frame_changes(df_copy, "attendance:save")
+            bump_table_version(EMPLOYEE_DATA_TABLE)
             st.success("✅ Data saved to CSV file successfully!")
             log_attendance_save("SUCCESS", "CSV", len(df), "Data saved to CSV file")
 
@@ -469,8 +510,8 @@ def load_attendance():
     """Load attendance data with proper temporary CSV handling"""
     if USE_SQL:
         try:
-            with get_sql_connection() as conn:
-                df = pd.read_sql(f"SELECT * FROM {EMPLOYEE_DATA_TABLE}", conn)
+            with sql_connection() as conn:
+                df = attendance_journal.drop_tracking_column(pd.read_sql(f"SELECT * FROM {EMPLOYEE_DATA_TABLE}", conn))
                 if 'start_datetime' in df.columns:
                     df['start_datetime'] = pd.to_datetime(df['start_datetime'], errors='coerce')
                 if 'exit_datetime' in df.columns:
@@ -511,8 +552,17 @@ def load_attendance():
     else:
         # CSV-only mode
         try:
+            if attendance_log.is_enabled():
+                df = attendance_log.read_attendance()
+                for col in ["start_datetime", "exit_datetime"]:
+                    df[col] = pd.to_datetime(df[col], errors="coerce")
+                log_attendance_save("SUCCESS", "LOG_LOAD", len(df), "Data loaded from attendance log")
+                return df
             if os.path.exists(EMPLOYEE_DATA_CSV):
-                df = pd.read_csv(EMPLOYEE_DATA_CSV, parse_dates=["start_datetime", "exit_datetime"])
+                if USE_PARQUET:
+                    df = parquet_store.read_table(EMPLOYEE_DATA_TABLE)
+                else:
+                    df = pd.read_csv(EMPLOYEE_DATA_CSV, parse_dates=["start_datetime", "exit_datetime"])
 
                 # Log CSV load
                 log_attendance_save("SUCCESS", "CSV_LOAD", len(df), "Data loaded from CSV file")
@@ -530,6 +580,458 @@ def load_attendance():
             return create_empty_attendance_df()
 
 
+# ===== Single-Row Attendance Access =====
+# Check-in/check-out only ever touch one (employee_id, date_only) row, so these
+# helpers read and write that row directly instead of round-tripping the whole
+# employee_data table through load_attendance()/save_attendance().
+# In CSV mode with ATTENDANCE_LOG_SETTINGS enabled, punches go to the monthly
+# append-only event files in attendance_log.py instead of employee_data.csv.
+_normalize_employee_id = attendance_log.normalize_employee_id
+_csv_attendance_value = attendance_log.csv_value
+
+
+def _csv_row_key(fields, header):
+    """(employee_id, 'YYYY-MM-DD') of a parsed CSV row"""
+    record = dict(zip(header, fields))
+    day = record.get("date_only") or record.get("start_datetime") or ""
+    return _normalize_employee_id(record.get("employee_id", "")), day[:10]
+
+
+# Line index of employee_data.csv, so a punch reads one line instead of the file.
+# offsets holds the start of every data line; rows maps (employee_id, date) to
+# the line number of its latest line. Growth at the end (appends from any
+# process) is indexed incrementally; any other change rebuilds the index.
+# Only use it while holding file_lock(EMPLOYEE_DATA_CSV).
+_csv_index = {"signature": None, "header": None, "header_line": b"", "offsets": [], "end": 0,
+              "last_line": b"", "last_key": None, "rows": {}}
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+
+def _index_csv_lines(f, start):
+    """Index the lines of f from byte offset start to the end"""
+    index = _csv_index
+    f.seek(start)
+    offset = start
+    for line in iter(f.readline, b""):
+        text = line.decode("utf-8").rstrip("\r\n")
+        index["offsets"].append(offset)
+        index["last_key"] = None
+        if text:
+            key = _csv_row_key(next(csv.reader([text])), index["header"])
+            index["last_key"] = (key, index["rows"].get(key))
+            index["rows"][key] = len(index["offsets"]) - 1
+        index["last_line"] = line
+        offset += len(line)
+    index["end"] = offset
+
+
+def _drop_unterminated_line():
+    """Forget a last line without a line ending (written mid-append), so it is indexed again in full"""
+    index = _csv_index
+    if not index["offsets"] or index["last_line"].endswith(b"\n"):
+        return
+    index["end"] = index["offsets"].pop()
+    if index["last_key"] is not None:
+        key, previous = index["last_key"]
+        if previous is None:
+            del index["rows"][key]
+        else:
+            index["rows"][key] = previous
+    index["last_key"] = None
+    index["last_line"] = b""
+
+
+def _unchanged_prefix(f):
+    """True if the header and the last indexed line are still where the index has them"""
+    index = _csv_index
+    f.seek(0)
+    if f.readline() != index["header_line"]:
+        return False
+    if not index["offsets"]:
+        return True
+    f.seek(index["offsets"][-1])
+    return f.read(len(index["last_line"])) == index["last_line"]
+
+
+def _refresh_csv_index():
+    """Bring the line index up to date with employee_data.csv; returns it (None if the file is empty)"""
+    index = _csv_index
+    signature = _file_signature(EMPLOYEE_DATA_CSV)
+    if signature is None or signature[0] == 0:
+        index.update(signature=None, header=None, header_line=b"", offsets=[], end=0, last_line=b"", last_key=None,
+                     rows={})
+        return None
+    if signature == index["signature"]:
+        return index
+
+    with open(EMPLOYEE_DATA_CSV, "rb") as f:
+        if index["header"] is None or signature[0] < index["end"] or not _unchanged_prefix(f):
+            f.seek(0)
+            header_line = f.readline()
+            index.update(header=next(csv.reader([header_line.decode("utf-8-sig")])), header_line=header_line,
+                         offsets=[], last_line=b"", last_key=None, rows={})
+            _index_csv_lines(f, len(header_line))
+        else:
+            _drop_unterminated_line()
+            _index_csv_lines(f, index["end"])
+    index["signature"] = signature
+    return index
+
+
+def _find_attendance_csv_row(employee_id, date_only):
+    """
+    Locate the latest CSV line for (employee_id, date_only) through the line index.
+    Returns (header, fields, line_offset, line_length, line_ending) or None.
+    """
+    index = _refresh_csv_index()
+    if index is None:
+        return None
+    line_number = index["rows"].get((_normalize_employee_id(employee_id), date_only.isoformat()))
+    if line_number is None:
+        return None
+
+    offsets = index["offsets"]
+    offset = offsets[line_number]
+    length = (offsets[line_number + 1] if line_number + 1 < len(offsets) else index["end"]) - offset
+    with open(EMPLOYEE_DATA_CSV, "rb") as f:
+        f.seek(offset)
+        line = f.read(length)
+    fields = next(csv.reader([line.decode("utf-8").rstrip("\r\n")]))
+    ending = line[len(line.rstrip(b"\r\n")):] or os.linesep.encode()
+    return index["header"], fields, offset, length, ending
+
+
+def _shift_csv_index(line_offset, delta):
+    """Record that the line at line_offset changed length by delta (check-out rewrite)"""
+    index = _csv_index
+    offsets = index["offsets"]
+    position = bisect.bisect_left(offsets, line_offset)
+    for i in range(position + 1, len(offsets)):
+        offsets[i] += delta
+    index["end"] += delta
+    with open(EMPLOYEE_DATA_CSV, "rb") as f:
+        f.seek(offsets[-1])
+        index["last_line"] = f.read(index["end"] - offsets[-1])
+    index["signature"] = _file_signature(EMPLOYEE_DATA_CSV)
+
+
+def load_attendance_record(employee_id, date_only):
+    """
+    Load only the attendance row for (employee_id, date_only).
+    Returns a DataFrame with zero or one row.
+    """
+    employee_id = str(employee_id)
+    if USE_SQL:
+        try:
+            with sql_connection() as conn:
+                df = pd.read_sql(
+                    f"SELECT TOP 1 * FROM {EMPLOYEE_DATA_TABLE} "
+                    f"WHERE employee_id = ? AND date_only = CAST(? AS DATE) "
+                    f"ORDER BY start_datetime DESC",
+                    conn,
+                    params=[employee_id, date_only]
+                )
+                df = attendance_journal.drop_tracking_column(df)
+                for col in ["start_datetime", "exit_datetime"]:
+                    if col in df.columns:
+                        df[col] = pd.to_datetime(df[col], errors="coerce")
+                return df
+        except Exception as e:
+            st.warning(f"⚠️ SQL Database unavailable: {e}")
+
+    if attendance_log.is_enabled():
+        found = attendance_log.find_record(employee_id, date_only)
+        if found is None:
+            return create_empty_attendance_df()
+        record = found["row"]
+    else:
+        with file_lock(EMPLOYEE_DATA_CSV):
+            match = _find_attendance_csv_row(employee_id, date_only)
+        if match is None:
+            return create_empty_attendance_df()
+        header, fields, _, _, _ = match
+        record = dict(zip(header, fields))
+    df = pd.DataFrame([record]).replace("", pd.NA)
+    for col in ["start_datetime", "exit_datetime"]:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    for col in ["total_hours", "extra_hours", "extra_pay", "confidence", "location_lat", "location_lon"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    if "late_mark" in df.columns:
+        df["late_mark"] = df["late_mark"].map(lambda x: str(x).strip().lower() in ("1", "1.0", "true"))
+    df["employee_id"] = employee_id
+    return df
+
+
+def load_employee_attendance(employee_id):
+    """Load the attendance history of a single employee"""
+    employee_id = str(employee_id)
+    if USE_SQL:
+        try:
+            with sql_connection() as conn:
+                df = pd.read_sql(
+                    f"SELECT * FROM {EMPLOYEE_DATA_TABLE} WHERE employee_id = ?",
+                    conn,
+                    params=[employee_id]
+                )
+                df = attendance_journal.drop_tracking_column(df)
+                for col in ["start_datetime", "exit_datetime"]:
+                    if col in df.columns:
+                        df[col] = pd.to_datetime(df[col], errors="coerce")
+                df["employee_id"] = df["employee_id"].astype(str)
+                return df
+        except Exception as e:
+            st.warning(f"⚠️ SQL Database unavailable: {e}")
+
+    if attendance_log.is_enabled():
+        df = attendance_log.read_attendance(employee_id=employee_id)
+        for col in ["start_datetime", "exit_datetime"]:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    elif not os.path.exists(EMPLOYEE_DATA_CSV):
+        return create_empty_attendance_df()
+    elif USE_PARQUET:
+        df = parquet_store.read_table(EMPLOYEE_DATA_TABLE, employee_id=employee_id)
+    else:
+        df = pd.read_csv(EMPLOYEE_DATA_CSV, dtype={"employee_id": str},
+                         parse_dates=["start_datetime", "exit_datetime"])
+    df["employee_id"] = df["employee_id"].map(_normalize_employee_id)
+    return df[df["employee_id"] == employee_id].copy()
+
+
+def record_check_in(row):
+    """
+    Insert today's check-in row for one employee.
+
+    SQL mode runs a single guarded INSERT for the (employee_id, date_only) key;
+    CSV mode appends one line to the attendance file. Returns True when a new
+    row was written, False if the employee already checked in for that date.
+    """
+    record = {col: row.get(col) for col in ATTENDANCE_COLUMNS}
+    if record["date_only"] is None and record["start_datetime"] is not None:
+        record["date_only"] = pd.to_datetime(record["start_datetime"]).date()
+
+    if USE_SQL:
+        try:
+            v = _attendance_sql_values(record)
+            columns = ", ".join(ATTENDANCE_COLUMNS)
+            placeholders = ", ".join("CAST(? AS DATE)" if col == "date_only" else "?" for col in ATTENDANCE_COLUMNS)
+            insert_sql = f"""
+            INSERT INTO {EMPLOYEE_DATA_TABLE} ({columns})
+            SELECT {placeholders}
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {EMPLOYEE_DATA_TABLE} WITH (UPDLOCK, HOLDLOCK)
+                WHERE employee_id = ? AND date_only = CAST(? AS DATE)
+            );
+            """
+            params = [v[col] for col in ATTENDANCE_COLUMNS] + [v["employee_id"], v["date_only"]]
+
+            with sql_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(insert_sql, params)
+                inserted = cursor.rowcount > 0
+                conn.commit()
+
+            if inserted:
+                bump_table_version(EMPLOYEE_DATA_TABLE)
+                st.success("✅ Data saved to SQL database successfully!")
+                log_attendance_save("SUCCESS", "SQL_CHECK_IN", 1, f"Check-in saved for {v['employee_id']}")
+            else:
+                log_attendance_save("INFO", "SQL_CHECK_IN", 0, f"Duplicate check-in ignored for {v['employee_id']}")
+            return inserted
+
+        except Exception as e:
+            st.error(f"❌ SQL Database error: {e}")
+            st.warning("⚠️ Saving to temporary file for later sync...")
+            try:
+                from config import save_data
+                save_data(pd.DataFrame([record]), EMPLOYEE_DATA_TABLE)
+                st.success("✅ Data saved to temporary storage - will sync when database is available!")
+                log_attendance_save("FALLBACK", "TEMP_CSV", 1, f"SQL failed: {str(e)}")
+                return True
+            except Exception as temp_error:
+                st.error(f"❌ Critical error: Cannot save to temporary storage either: {temp_error}")
+                st.error("Please contact IT support immediately!")
+                log_attendance_save("CRITICAL_FAILURE", "NONE", 1,
+                                    f"SQL failed: {str(e)}, Temp failed: {str(temp_error)}")
+                return False
+
+    if attendance_log.is_enabled():
+        try:
+            if not attendance_log.check_in(record):
+                log_attendance_save("INFO", "LOG_CHECK_IN", 0, f"Duplicate check-in ignored for {record['employee_id']}")
+                return False
+            bump_table_version(EMPLOYEE_DATA_TABLE)
+            st.success("✅ Data saved to CSV file successfully!")
+            log_attendance_save("SUCCESS", "LOG_CHECK_IN", 1, f"Check-in event appended for {record['employee_id']}")
+            return True
+        except Exception as e:
+            st.error(f"❌ CSV save error: {e}")
+            log_attendance_save("FAILURE", "LOG_CHECK_IN", 1, f"Event append failed: {str(e)}")
+            return False
+
+    # CSV-only mode - append a single line, keeping the existing header order.
+    # The file lock makes the duplicate check and the append one step for every
+    # session and process writing employee_data.csv.
+    try:
+        date_only = pd.to_datetime(record["date_only"]).date()
+        with file_lock(EMPLOYEE_DATA_CSV):
+            if _find_attendance_csv_row(record["employee_id"], date_only) is not None:
+                log_attendance_save("INFO", "CSV_CHECK_IN", 0, f"Duplicate check-in ignored for {record['employee_id']}")
+                return False
+
+            os.makedirs(os.path.dirname(EMPLOYEE_DATA_CSV), exist_ok=True)
+            file_exists = os.path.exists(EMPLOYEE_DATA_CSV) and os.path.getsize(EMPLOYEE_DATA_CSV) > 0
+            if file_exists:
+                with open(EMPLOYEE_DATA_CSV, "r", encoding="utf-8-sig", newline="") as f:
+                    header = next(csv.reader(f))
+            else:
+                header = ATTENDANCE_COLUMNS
+
+            record["date_only"] = date_only
+            with open(EMPLOYEE_DATA_CSV, "a", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f, lineterminator=os.linesep)
+                if not file_exists:
+                    writer.writerow(header)
+                writer.writerow([_csv_attendance_value(record.get(col)) for col in header])
+
+        attendance_journal.record_change(record["employee_id"], date_only, "attendance:check_in")
+        bump_table_version(EMPLOYEE_DATA_TABLE)
+        st.success("✅ Data saved to CSV file successfully!")
+        log_attendance_save("SUCCESS", "CSV_CHECK_IN", 1, f"Check-in appended for {record['employee_id']}")
+        return True
+
+    except Exception as e:
+        st.error(f"❌ CSV save error: {e}")
+        log_attendance_save("FAILURE", "CSV_CHECK_IN", 1, f"CSV append failed: {str(e)}")
+        return False
+
+
+def record_check_out(employee_id, date_only, updates):
+    """
+    Apply check-out fields (exit_datetime, total_hours, ...) to the existing
+    (employee_id, date_only) row only.
+
+    SQL mode issues one UPDATE keyed on the row; CSV mode rewrites the matching
+    line in place, so only the bytes after today's row are touched.
+    Returns True if a row was updated.
+    """
+    employee_id = str(employee_id)
+    unknown = set(updates) - set(ATTENDANCE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown attendance columns: {sorted(unknown)}")
+
+    if USE_SQL:
+        try:
+            template = {col: None for col in ATTENDANCE_COLUMNS}
+            template.update(updates)
+            template.update({"employee_id": employee_id, "employee_name": "", "date_only": date_only})
+            v = _attendance_sql_values(template)
+
+            set_clause = ", ".join(f"{col} = ?" for col in updates)
+            update_sql = f"""
+            UPDATE {EMPLOYEE_DATA_TABLE}
+            SET {set_clause}
+            WHERE employee_id = ? AND date_only = CAST(? AS DATE);
+            """
+            params = [v[col] for col in updates] + [employee_id, date_only]
+
+            with sql_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(update_sql, params)
+                updated = cursor.rowcount > 0
+                conn.commit()
+
+            if updated:
+                bump_table_version(EMPLOYEE_DATA_TABLE)
+                st.success("✅ Data saved to SQL database successfully!")
+                log_attendance_save("SUCCESS", "SQL_CHECK_OUT", 1, f"Check-out saved for {employee_id}")
+            else:
+                log_attendance_save("FAILURE", "SQL_CHECK_OUT", 0, f"No check-in row found for {employee_id}")
+            return updated
+
+        except Exception as e:
+            st.error(f"❌ SQL Database error: {e}")
+            st.warning("⚠️ Saving to temporary file for later sync...")
+            try:
+                from config import save_data
+                record = load_attendance_record(employee_id, date_only)
+                if record.empty:
+                    record = create_empty_attendance_df()
+                    record.loc[0, ["employee_id", "date_only"]] = [employee_id, date_only]
+                for col, value in updates.items():
+                    record.loc[record.index[0], col] = value
+                save_data(record, EMPLOYEE_DATA_TABLE)
+                st.success("✅ Data saved to temporary storage - will sync when database is available!")
+                log_attendance_save("FALLBACK", "TEMP_CSV", 1, f"SQL failed: {str(e)}")
+                return True
+            except Exception as temp_error:
+                st.error(f"❌ Critical error: Cannot save to temporary storage either: {temp_error}")
+                st.error("Please contact IT support immediately!")
+                log_attendance_save("CRITICAL_FAILURE", "NONE", 1,
+                                    f"SQL failed: {str(e)}, Temp failed: {str(temp_error)}")
+                return False
+
+    if attendance_log.is_enabled():
+        try:
+            if not attendance_log.check_out(employee_id, date_only, updates):
+                log_attendance_save("FAILURE", "LOG_CHECK_OUT", 0, f"No check-in row found for {employee_id}")
+                return False
+            bump_table_version(EMPLOYEE_DATA_TABLE)
+            st.success("✅ Data saved to CSV file successfully!")
+            log_attendance_save("SUCCESS", "LOG_CHECK_OUT", 1, f"Check-out event appended for {employee_id}")
+            return True
+        except Exception as e:
+            st.error(f"❌ CSV save error: {e}")
+            log_attendance_save("FAILURE", "LOG_CHECK_OUT", 1, f"Event append failed: {str(e)}")
+            return False
+
+    # CSV-only mode - rewrite the matching line and whatever follows it, under
+    # the file lock so no append lands between reading the tail and truncating
+    try:
+        with file_lock(EMPLOYEE_DATA_CSV):
+            match = _find_attendance_csv_row(employee_id, date_only)
+            if match is None:
+                log_attendance_save("FAILURE", "CSV_CHECK_OUT", 0, f"No check-in row found for {employee_id}")
+                return False
+
+            header, fields, offset, length, ending = match
+            record = dict(zip(header, fields))
+            for col, value in updates.items():
+                if col in record:
+                    record[col] = _csv_attendance_value(value)
+
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator=ending.decode()).writerow([record.get(col, "") for col in header])
+            new_line = buffer.getvalue().encode("utf-8")
+
+            with open(EMPLOYEE_DATA_CSV, "r+b") as f:
+                f.seek(offset + length)
+                tail = f.read()
+                f.seek(offset)
+                f.write(new_line + tail)
+                f.truncate()
+            _shift_csv_index(offset, len(new_line) - length)
+
+        attendance_journal.record_change(employee_id, date_only, "attendance:check_out")
+        bump_table_version(EMPLOYEE_DATA_TABLE)
+        st.success("✅ Data saved to CSV file successfully!")
+        log_attendance_save("SUCCESS", "CSV_CHECK_OUT", 1, f"Check-out updated for {employee_id}")
+        return True
+
+    except Exception as e:
+        st.error(f"❌ CSV save error: {e}")
+        log_attendance_save("FAILURE", "CSV_CHECK_OUT", 1, f"CSV update failed: {str(e)}")
+        return False
+
+
 def check_and_sync_temp_data():
     """Check for temporary data and sync when SQL comes back online"""
     from config import TEMP_CSV_PATH, sync_offline_data
@@ -537,7 +1039,7 @@ def check_and_sync_temp_data():
     if USE_SQL and os.path.exists(TEMP_CSV_PATH):
         try:
             # Check if SQL is now available
-            with get_sql_connection() as conn:
+            with sql_connection() as conn:
                 # SQL is available, try to sync
                 st.info("🔄 Found temporary data, syncing with database...")
                 sync_offline_data()
@@ -1191,6 +1693,9 @@ def run_attendance():
         </div>
         """, unsafe_allow_html=True)
 
+    # Load (or compute once) the badge embedding before the camera step
+    get_badge_embedding(badge_path)
+
     # Camera input for face recognition
     st.markdown("**📷 Take your photo for verification:**")
     snapshot = st.camera_input("Capture Photo", key="face_recognition_camera")
@@ -1244,7 +1749,8 @@ def run_attendance():
 
             st.stop()
 
-        # Success - face verified
+        # Success - face verified (snapshot kept for later re-verification if archiving is on)
+        archive_snapshot(employee_id, datetime.now().date(), snapshot)
         st.success(f"✅ **Face verified successfully!**")
         st.success(f"🎯 Confidence: {confidence:.2f}% (Excellent match)")
 
@@ -1293,14 +1799,8 @@ def run_attendance():
 
     try:
         # Load attendance data with proper fallback handling
-        attendance_df = load_attendance()
-        attendance_df["employee_id"] = attendance_df["employee_id"].astype(str)
-        attendance_df["start_datetime"] = pd.to_datetime(attendance_df["start_datetime"], errors="coerce")
-        attendance_df["date_only"] = attendance_df["start_datetime"].dt.date
-
-        # Check today's record for this employee
-        mask = (attendance_df["employee_id"] == employee_id) & (attendance_df["date_only"] == today)
-        today_record = attendance_df[mask]
+        # Only today's row is needed to decide between check-in and check-out
+        today_record = load_attendance_record(employee_id, today)
 
         if today_record.empty:
             # ===== CHECK-IN PROCESS =====
@@ -1336,47 +1836,42 @@ def run_attendance():
                 "location_name": location_name
             }
 
-            # Add new record to dataframe
-            attendance_df = pd.concat([attendance_df, pd.DataFrame([new_row])], ignore_index=True)
-            attendance_df["date_only"] = pd.to_datetime(attendance_df["start_datetime"]).dt.date
-
-            # Remove any duplicates (keep latest)
-            attendance_df.drop_duplicates(subset=["employee_id", "date_only"], keep="last", inplace=True)
-
-            # Save to database/CSV with proper fallback handling
-            save_attendance(attendance_df)
-
-            # Success message for check-in
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3>🎉 Check-In Successful!</h3>
-                <p><strong>👤 Employee:</strong> {employee_name}</p>
-                <p><strong>🕐 Check-In Time:</strong> {now.strftime('%I:%M %p')}</p>
-                <p><strong>📅 Date:</strong> {today.strftime('%A, %B %d, %Y')}</p>
-                <p><strong>📍 Location:</strong> {location_name}</p>
-                <p><strong>⚡ Method:</strong> {detection_method.title()}</p>
-                <p><strong>🎯 Face Match:</strong> {confidence:.1f}%</p>
-                <p><strong>👤 Login User:</strong> {logged_username}</p>
-                {f"<p style='color: #ffeb3b; font-weight: bold;'>⚠️ Late Mark Applied ({late_minutes} min late)</p>" if late_mark else "<p style='color: #4CAF50; font-weight: bold;'>✅ On Time</p>"}
-                <span class="speed-indicator">CHECK-IN COMPLETE</span>
-            </div>
-            """, unsafe_allow_html=True)
+            # Insert only today's row (duplicate check-ins for the same day are ignored)
+            if not record_check_in(new_row):
+                # Another session or device checked in first; nothing was written
+                st.warning("⚠️ **You have already checked in today.** Mark attendance again to check out.")
+            else:
+                # Success message for check-in
+                st.markdown(f"""
+                <div class="metric-card">
+                    <h3>🎉 Check-In Successful!</h3>
+                    <p><strong>👤 Employee:</strong> {employee_name}</p>
+                    <p><strong>🕐 Check-In Time:</strong> {now.strftime('%I:%M %p')}</p>
+                    <p><strong>📅 Date:</strong> {today.strftime('%A, %B %d, %Y')}</p>
+                    <p><strong>📍 Location:</strong> {location_name}</p>
+                    <p><strong>⚡ Method:</strong> {detection_method.title()}</p>
+                    <p><strong>🎯 Face Match:</strong> {confidence:.1f}%</p>
+                    <p><strong>👤 Login User:</strong> {logged_username}</p>
+                    {f"<p style='color: #ffeb3b; font-weight: bold;'>⚠️ Late Mark Applied ({late_minutes} min late)</p>" if late_mark else "<p style='color: #4CAF50; font-weight: bold;'>✅ On Time</p>"}
+                    <span class="speed-indicator">CHECK-IN COMPLETE</span>
+                </div>
+                """, unsafe_allow_html=True)
 
-            # Celebration effect
-            st.balloons()
+                # Celebration effect
+                st.balloons()
 
-            # Show today's expected schedule
-            st.markdown("""
-            <div style="background: #E8F5E8; padding: 15px; border-radius: 10px; margin: 15px 0;">
-                <h4 style="color: #2E7D32;">📋 Today's Schedule</h4>
-                <ul style="color: #388E3C;">
-                    <li><strong>Work Hours:</strong> 9:00 AM - 6:00 PM</li>
-                    <li><strong>Lunch Break:</strong> 1:00 PM - 2:00 PM</li>
-                    <li><strong>Overtime Starts:</strong> After 6:45 PM</li>
-                    <li><strong>Next Check-Out:</strong> After minimum 1 minute</li>
-                </ul>
-            </div>
-            """, unsafe_allow_html=True)
+                # Show today's expected schedule
+                st.markdown("""
+                <div style="background: #E8F5E8; padding: 15px; border-radius: 10px; margin: 15px 0;">
+                    <h4 style="color: #2E7D32;">📋 Today's Schedule</h4>
+                    <ul style="color: #388E3C;">
+                        <li><strong>Work Hours:</strong> 9:00 AM - 6:00 PM</li>
+                        <li><strong>Lunch Break:</strong> 1:00 PM - 2:00 PM</li>
+                        <li><strong>Overtime Starts:</strong> After 6:45 PM</li>
+                        <li><strong>Next Check-Out:</strong> After minimum 1 minute</li>
+                    </ul>
+                </div>
+                """, unsafe_allow_html=True)
 
         else:
             # ===== CHECK-OUT PROCESS =====
@@ -1455,20 +1950,17 @@ def run_attendance():
                 # Confirm checkout button
                 if st.button("✅ **Confirm Check-Out**", key="confirm_checkout",
                              help="Click to complete your checkout for today"):
-                    # Update the attendance record with proper datetime handling
-                    idx = attendance_df[(attendance_df["employee_id"] == employee_id) &
-                                        (attendance_df["date_only"] == today)].index[0]
-
                     # Ensure exit_datetime is properly formatted
                     current_time = datetime.now()
 
-                    attendance_df.loc[idx, "exit_datetime"] = current_time
-                    attendance_df.loc[idx, "total_hours"] = round(total_hours, 2)
-                    attendance_df.loc[idx, "extra_hours"] = extra_hours
-                    attendance_df.loc[idx, "extra_pay"] = round(extra_pay, 2)
-                    attendance_df.loc[idx, "attendance_status"] = attendance_status
-                    attendance_df.loc[
-                        idx, "notes"] = f"Auto-login: {logged_username} - Fast checkout completed | Location: {location_source}"
+                    checkout_updates = {
+                        "exit_datetime": current_time,
+                        "total_hours": round(total_hours, 2),
+                        "extra_hours": extra_hours,
+                        "extra_pay": round(extra_pay, 2),
+                        "attendance_status": attendance_status,
+                        "notes": f"Auto-login: {logged_username} - Fast checkout completed | Location: {location_source}",
+                    }
 
                     # Debug print to verify data before saving
                     print(f"DEBUG: Saving checkout data:")
@@ -1477,41 +1969,42 @@ def run_attendance():
                     print(f"  Total Hours: {total_hours}")
                     print(f"  Status: {attendance_status}")
 
-                    # Save updated attendance with proper fallback handling
-                    save_attendance(attendance_df)
-
-                    # Success message for check-out
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <h3>🎉 Check-Out Successful!</h3>
-                        <p><strong>🚪 Check-Out Time:</strong> {now.strftime('%I:%M %p')}</p>
-                        <p><strong>⏱️ Total Hours:</strong> {total_hours:.2f} hours</p>
-                        <p><strong>📊 Status:</strong> {attendance_status}</p>
-                        <p><strong>⏰ Extra Hours:</strong> {extra_hours:.2f} hours</p>
-                        <p><strong>💰 Extra Pay:</strong> ₹{extra_pay:.2f}</p>
-                        <p><strong>👤 Login User:</strong> {logged_username}</p>
-                        <p><strong>📍 Location:</strong> {location_name}</p>
-                        <span class="speed-indicator">CHECK-OUT COMPLETE</span>
-                    </div>
-                    """, unsafe_allow_html=True)
+                    # Update only today's row with proper fallback handling
+                    if not record_check_out(employee_id, today, checkout_updates):
+                        st.error("❌ **No check-in found for today.** Your check-out was not saved; please mark attendance again.")
+                    else:
+                        # Success message for check-out
+                        st.markdown(f"""
+                        <div class="metric-card">
+                            <h3>🎉 Check-Out Successful!</h3>
+                            <p><strong>🚪 Check-Out Time:</strong> {now.strftime('%I:%M %p')}</p>
+                            <p><strong>⏱️ Total Hours:</strong> {total_hours:.2f} hours</p>
+                            <p><strong>📊 Status:</strong> {attendance_status}</p>
+                            <p><strong>⏰ Extra Hours:</strong> {extra_hours:.2f} hours</p>
+                            <p><strong>💰 Extra Pay:</strong> ₹{extra_pay:.2f}</p>
+                            <p><strong>👤 Login User:</strong> {logged_username}</p>
+                            <p><strong>📍 Location:</strong> {location_name}</p>
+                            <span class="speed-indicator">CHECK-OUT COMPLETE</span>
+                        </div>
+                        """, unsafe_allow_html=True)
 
-                    # Celebration effect
-                    st.balloons()
+                        # Celebration effect
+                        st.balloons()
 
-                    # Show work summary
-                    work_quality = "Excellent" if total_hours >= 8 else "Good" if total_hours >= 6 else "Needs Improvement"
-                    st.markdown(f"""
-                    <div style="background: #E8F5E8; padding: 15px; border-radius: 10px; margin: 15px 0;">
-                        <h4 style="color: #2E7D32;">📈 Today's Performance</h4>
-                        <ul style="color: #388E3C;">
-                            <li><strong>Work Quality:</strong> {work_quality}</li>
-                            <li><strong>Punctuality:</strong> {"On Time" if not record['late_mark'] else "Late Arrival"}</li>
-                            <li><strong>Total Productive Hours:</strong> {total_hours:.2f}</li>
-                            <li><strong>Overtime Contribution:</strong> {extra_hours:.2f} hours</li>
-                        </ul>
-                        <p style="color: #2E7D32;"><strong>💼 Thank you for your contribution today!</strong></p>
-                    </div>
-                    """, unsafe_allow_html=True)
+                        # Show work summary
+                        work_quality = "Excellent" if total_hours >= 8 else "Good" if total_hours >= 6 else "Needs Improvement"
+                        st.markdown(f"""
+                        <div style="background: #E8F5E8; padding: 15px; border-radius: 10px; margin: 15px 0;">
+                            <h4 style="color: #2E7D32;">📈 Today's Performance</h4>
+                            <ul style="color: #388E3C;">
+                                <li><strong>Work Quality:</strong> {work_quality}</li>
+                                <li><strong>Punctuality:</strong> {"On Time" if not record['late_mark'] else "Late Arrival"}</li>
+                                <li><strong>Total Productive Hours:</strong> {total_hours:.2f}</li>
+                                <li><strong>Overtime Contribution:</strong> {extra_hours:.2f} hours</li>
+                            </ul>
+                            <p style="color: #2E7D32;"><strong>💼 Thank you for your contribution today!</strong></p>
+                        </div>
+                        """, unsafe_allow_html=True)
 
             else:
                 # ===== ALREADY CHECKED OUT =====
@@ -1551,7 +2044,7 @@ def run_attendance():
         # ===== DISPLAY RECENT ATTENDANCE (Employee's own records only) =====
         st.markdown("### 📊 Your Recent Attendance History")
 
-        employee_attendance = attendance_df[attendance_df["employee_id"] == employee_id].copy()
+        employee_attendance = load_employee_attendance(employee_id)
 
         if not employee_attendance.empty:
             # Sort by date descending (most recent first)
@@ -1811,7 +2304,7 @@ def show_database_status():
     """Show current database connection status"""
     if USE_SQL:
         try:
-            with get_sql_connection() as conn:
+            with sql_connection() as conn:
                 st.markdown("""
                 <div style="background: #E8F5E8; padding: 10px; border-radius: 8px; margin: 10px 0;">
                     <p style="color: #2E7D32; margin: 0;"><strong>🗄️ Database Status:</strong> ✅ SQL Connected</p>
@@ -2027,7 +2520,7 @@ def get_system_status():
         db_status = "✅ Connected"
         try:
             if USE_SQL:
-                with get_sql_connection() as conn:
+                with sql_connection() as conn:
                     cursor = conn.cursor()
                     cursor.execute("SELECT 1")
                     db_status = "✅ SQL Connected"
@@ -2132,7 +2625,7 @@ if __name__ == "__main__":
                     if USE_SQL:
                         try:
                             with st.spinner("🔄 Syncing temporary data to database..."):
-                                with get_sql_connection() as conn:
+                                with sql_connection() as conn:
                                     # Test connection first
                                     cursor = conn.cursor()
                                     cursor.execute("SELECT 1")
@@ -2246,7 +2739,7 @@ if __name__ == "__main__":
                 st.write("**Current Storage Mode:**")
                 if USE_SQL:
                     try:
-                        with get_sql_connection() as conn:
+                        with sql_connection() as conn:
                             st.success("✅ SQL Database Active")
                     except:
                         st.warning("⚠️ SQL Database Offline (Using CSV)")
@@ -2430,7 +2923,7 @@ if __name__ == "__main__":
         if USE_SQL:
             try:
                 # First, try SQL connection
-                with get_sql_connection() as conn:
+                with sql_connection() as conn:
                     cursor = conn.cursor()
 
                     # Process each record
@@ -1,15 +1,51 @@
 import streamlit as st
 import pandas as pd
 import zipfile
-import io
 import os
 from datetime import datetime, date
-from utils.pdf_payslip import generate_payslip_pdf  # Updated to use same PDF generator as mypayslip
-from utils.email_tools import send_email
+from utils.pdf_payslip import render_payslips  # Same PDF generator as mypayslip, rendered in parallel
+import email_delivery
 import pyodbc
 import config
+from repository import read_table
+import work_calendar
 import calendar
 import numpy as np
+import tempfile
+
+
+def open_payslip_archive(selected_month_str):
+    """
+    Temporary file for a month's payslip ZIP, created next to its final path so
+    publish_payslip_archive() can move it into place atomically.
+    """
+    archive_dir = config.BULK_PAYSLIP_SETTINGS.get("archive_dir", "data/exports/payslips")
+    os.makedirs(archive_dir, exist_ok=True)
+    return tempfile.NamedTemporaryFile(
+        dir=archive_dir, prefix=f".Payslips_{selected_month_str}_", suffix=".zip.tmp", delete=False
+    )
+
+
+def publish_payslip_archive(temp_path, selected_month_str):
+    """Replace the month's archive with the finished one; returns its path"""
+    archive_dir = config.BULK_PAYSLIP_SETTINGS.get("archive_dir", "data/exports/payslips")
+    archive_path = os.path.join(archive_dir, f"Payslips_{selected_month_str}.zip")
+    os.replace(temp_path, archive_path)
+    return archive_path
+
+
+def show_delivery_progress(run):
+    """Poll a DeliveryRun from the script thread until it finishes"""
+    progress_bar = st.progress(0.0, text="📧 Sending emails...")
+    while not run.wait(timeout=0.5):
+        counts = run.counts()
+        done = counts["sent"] + counts["failed"]
+        progress_bar.progress(done / max(counts["total"], 1), text=f"📧 Sending emails... {done}/{counts['total']}")
+    progress_bar.empty()
+    counts = run.counts()
+    if run.error:
+        st.error(f"❌ {run.error}. Unsent emails are kept; resume them once the settings are fixed.")
+    return counts
 
 
 def run_bulkpayslip():
@@ -29,37 +65,31 @@ def run_bulkpayslip():
     # ------------------
     if is_sql:
         try:
-            conn = config.safe_get_conn()
-            if conn:
-                st.info("Attempting to load data from SQL Server...")
-                employee_master = pd.read_sql_query(f"SELECT * FROM {config.EMPLOYEE_MASTER_TABLE}", conn)
-                salary_df = pd.read_sql_query(f"SELECT * FROM {config.SALARY_LOG_TABLE}", conn)
-                attendance_df = pd.read_sql_query(f"SELECT * FROM {config.EMPLOYEE_DATA_TABLE}", conn)
-                conn.close()
-                st.success("✅ Data loaded successfully from SQL Server.")
-            else:
-                st.warning("SQL connection failed. Falling back to CSV files.")
-                is_sql = False
-        except pyodbc.Error as ex:
+            st.info("Attempting to load data from SQL Server...")
+            employee_master = read_table(config.EMPLOYEE_MASTER_TABLE)
+            salary_df = read_table(config.SALARY_LOG_TABLE)
+            attendance_df = read_table(config.EMPLOYEE_DATA_TABLE)
+            st.success("✅ Data loaded successfully from SQL Server.")
+        except (pyodbc.Error, config.DatabaseConnectionError) as ex:
             st.error(f"SQL connection error: {ex}. Falling back to CSV files.")
             is_sql = False
 
     if not is_sql:
         st.info("Loading data from local CSV files.")
         if os.path.exists(config.SALARY_LOG_CSV):
-            salary_df = pd.read_csv(config.SALARY_LOG_CSV, dtype={"employee_id": str})
+            salary_df = read_table(config.SALARY_LOG_TABLE, use_sql=False)
         else:
             st.error(f"⚠️ File not found: {config.SALARY_LOG_CSV}")
             st.stop()
 
         if os.path.exists(config.EMPLOYEE_MASTER_CSV):
-            employee_master = pd.read_csv(config.EMPLOYEE_MASTER_CSV, dtype={"employee_id": str})
+            employee_master = read_table(config.EMPLOYEE_MASTER_TABLE, use_sql=False)
         else:
             st.error(f"⚠️ File not found: {config.EMPLOYEE_MASTER_CSV}")
             st.stop()
 
         if os.path.exists(config.EMPLOYEE_DATA_CSV):
-            attendance_df = pd.read_csv(config.EMPLOYEE_DATA_CSV, dtype={"employee_id": str})
+            attendance_df = read_table(config.EMPLOYEE_DATA_TABLE, use_sql=False)
         else:
             st.warning(f"⚠️ Attendance file not found: {config.EMPLOYEE_DATA_CSV}")
             attendance_df = pd.DataFrame()  # Empty dataframe as fallback
@@ -135,6 +165,24 @@ def run_bulkpayslip():
                 "port": st.number_input("SMTP Port", value=587, min_value=1, max_value=65535)
             }
 
+        # Batches from earlier runs that still have unsent emails (failures, restarts);
+        # batches a run is still sending in the background are not offered
+        retry_failed = st.checkbox("Also re-send emails that failed permanently (rejected / 5xx)")
+        unsent = email_delivery.unsent_batches(include_failed=retry_failed)
+        if unsent:
+            with st.expander(f"♻️ Unsent Emails ({sum(unsent.values())})"):
+                batch_id = st.selectbox(
+                    "Batch", list(unsent), format_func=lambda b: f"{b} ({unsent[b]} unsent)"
+                )
+                if st.button("♻️ Resume Sending"):
+                    try:
+                        run = email_delivery.resume(batch_id, smtp_config, include_failed=retry_failed)
+                    except email_delivery.BatchInProgressError as e:
+                        st.warning(f"⏳ {e}. Try again once it has finished.")
+                    else:
+                        show_delivery_progress(run)
+                        st.dataframe(email_delivery.delivery_log(batch_id))
+
     # Enhanced defaults matching mypayslip.py
     enhanced_defaults = {
         # Basic salary components
@@ -200,48 +248,6 @@ def run_bulkpayslip():
         "description": ""
     }
 
-    def build_attendance_map(employee_id, selected_month_str):
-        """Build attendance map for an employee for the selected month"""
-        if attendance_df.empty:
-            return {}
-
-        try:
-            month_start = pd.to_datetime(selected_month_str + "-01")
-            month_end = (month_start + pd.offsets.MonthEnd(1)).date()
-
-            filtered_attendance = attendance_df[
-                (attendance_df["employee_id"] == employee_id) &
-                (attendance_df["date_only"].dt.date >= month_start.date()) &
-                (attendance_df["date_only"].dt.date <= month_end)
-                ]
-
-            attendance_map = {}
-            for _, att_row in filtered_attendance.iterrows():
-                day = att_row["date_only"].day
-                status = att_row["attendance_status"]
-                if status == "full day":
-                    attendance_map[day] = "F"
-                elif status == "half day":
-                    attendance_map[day] = "H"
-                elif status == "late mark":
-                    attendance_map[day] = "L"
-                else:
-                    attendance_map[day] = "A"
-
-            # Fill missing days as 'A' (Absent) or '-' for Tuesdays
-            for day in range(1, month_end.day + 1):
-                dt = date(month_start.year, month_start.month, day)
-                if day not in attendance_map:
-                    if dt.weekday() == 1:  # Tuesday
-                        attendance_map[day] = "-"
-                    else:
-                        attendance_map[day] = "A"
-
-            return attendance_map
-        except Exception as e:
-            st.warning(f"Error building attendance map for {employee_id}: {e}")
-            return {}
-
     def build_pdf_data(row, employee_name_clean, employee_id, month_str, attendance_map):
         """Build PDF data dictionary matching mypayslip.py format"""
         # Fill missing values with defaults
@@ -308,7 +314,10 @@ def run_bulkpayslip():
             "leave_concession_amount": row["leave_concession_amount"],
             "lop_days": row["lop_days"],
             "days_in_month": row["days_in_month"],
-            "working_days": row["working_days"]
+            "working_days": row["working_days"],
+
+            # Finalize time of the salary row, stamped in the PDF footer
+            "timestamp": row.get("timestamp")
         }
         return pdf_data
 
@@ -317,79 +326,120 @@ def run_bulkpayslip():
             st.error("❌ No employees match the filter criteria.")
             return
 
-        zip_buffer = io.BytesIO()
         retry_list = []
         log = []
         successful_count = 0
         error_count = 0
 
-        # Filter salary data for selected month
+        # Filter salary data for selected month, keeping the latest record per employee
         monthly_salary = salary_df[salary_df["salary_month_str"] == selected_month_str]
+        latest_salary = {
+            row["employee_id"]: row
+            for row in monthly_salary.sort_values("data_date", ascending=False)
+            .drop_duplicates("employee_id").to_dict("records")
+        }
+        # Every employee's calendar markers for the month, built in one pass
+        month_start = pd.to_datetime(selected_month_str + "-01")
+        month_attendance = work_calendar.MonthAttendance(attendance_df, month_start.year, month_start.month)
+
+        progress_bar = st.progress(0)
+        total_employees = len(filtered_employees)
+        processed = 0
+
+        # Collect the payslips to render; skips are reported straight away
+        jobs = []
+        payslip_info = {}  # job key -> (display name, employee id, email, zip filename)
+        for idx, emp_row in enumerate(filtered_employees.to_dict("records")):
+            emp_id = str(emp_row["employee_id"]).strip()
+            emp_name = str(emp_row["employee_name"]).strip().lower()
+            emp_name_clean = emp_name.title()
+            email_id = emp_row.get("email_id", None)
+
+            # Find the latest salary record for this employee
+            row = latest_salary.get(emp_id)
+
+            if row is None:
+                log.append(f"❌ No salary data for {emp_name_clean} ({emp_id}) — skipped.")
+                error_count += 1
+                processed += 1
+                continue
+
+            row = dict(row)
+
+            # Check if salary is valid
+            if row.get("net_salary", 0) <= 0 and row.get("gross_earnings", 0) <= 0:
+                log.append(f"❌ Zero salary for {emp_name_clean} ({emp_id}) — skipped.")
+                error_count += 1
+                processed += 1
+                continue
+
+            try:
+                attendance_map = month_attendance.markers(emp_id)
+                pdf_data = build_pdf_data(row, emp_name_clean, emp_id, month_str, attendance_map)
+            except Exception as e:
+                retry_list.append(emp_id)
+                log.append(f"❌ Error generating payslip for {emp_name_clean}: {str(e)}")
+                error_count += 1
+                processed += 1
+                continue
+
+            filename = f"Payslip_{selected_month_str}_{emp_name_clean.replace(' ', '_')}.pdf"
+            jobs.append((idx, emp_name_clean, emp_id, pdf_data))
+            payslip_info[idx] = (emp_name_clean, emp_id, email_id, filename)
+
+        # Emails go out from a pool of SMTP sessions while the rest are still rendering
+        delivery = None
+        if send_emails:
+            delivery = email_delivery.DeliveryRun(
+                email_delivery.new_batch_id(f"payslips_{selected_month_str}"), smtp_config
+            )
 
-        with zipfile.ZipFile(zip_buffer, "w") as zipf:
-            progress_bar = st.progress(0)
-            total_employees = len(filtered_employees)
-
-            for idx, (_, emp_row) in enumerate(filtered_employees.iterrows()):
-                emp_id = str(emp_row["employee_id"]).strip()
-                emp_name = str(emp_row["employee_name"]).strip().lower()
-                emp_name_clean = emp_name.title()
-                email_id = emp_row.get("email_id", None)
-
-                # Update progress
-                progress_bar.progress((idx + 1) / total_employees)
-
-                # Find salary data for this employee
-                employee_salary = monthly_salary[monthly_salary["employee_id"] == emp_id]
-
-                if employee_salary.empty:
-                    log.append(f"❌ No salary data for {emp_name_clean} ({emp_id}) — skipped.")
-                    error_count += 1
-                    continue
-
-                # Get the latest record for this month
-                row = employee_salary.sort_values("data_date", ascending=False).iloc[0].to_dict()
-
-                # Check if salary is valid
-                if row.get("net_salary", 0) <= 0 and row.get("gross_earnings", 0) <= 0:
-                    log.append(f"❌ Zero salary for {emp_name_clean} ({emp_id}) — skipped.")
-                    error_count += 1
-                    continue
-
-                try:
-                    # Build attendance map
-                    attendance_map = build_attendance_map(emp_id, selected_month_str)
-
-                    # Build PDF data
-                    pdf_data = build_pdf_data(row, emp_name_clean, emp_id, month_str, attendance_map)
-
-                    # Generate PDF using the same function as mypayslip.py
-                    pdf_bytes = generate_payslip_pdf(emp_name_clean, emp_id, pdf_data)
+        # Render across CPU cores and write each PDF into the ZIP on disk as soon as it
+        # is ready, so memory holds only the PDFs in flight whatever the headcount
+        archive_file = open_payslip_archive(selected_month_str)
+        try:
+            with archive_file, zipfile.ZipFile(archive_file, "w") as zipf:
+                for key, pdf_bytes, error in render_payslips(jobs):
+                    emp_name_clean, emp_id, email_id, filename = payslip_info[key]
+                    processed += 1
+                    progress_bar.progress(processed / total_employees)
+
+                    if error:
+                        retry_list.append(emp_id)
+                        log.append(f"❌ Error generating payslip for {emp_name_clean}: {error}")
+                        error_count += 1
+                        continue
 
-                    # Add to ZIP
-                    filename = f"Payslip_{selected_month_str}_{emp_name_clean.replace(' ', '_')}.pdf"
                     zipf.writestr(filename, pdf_bytes)
 
-                    # Send email if requested
-                    if send_emails and email_id:
-                        try:
-                            send_email(pdf_bytes, filename, email_id, smtp_config)
-                            log.append(f"📤 Generated and emailed to {emp_name_clean} <{email_id}>")
-                        except Exception as e:
-                            log.append(f"✅ Generated for {emp_name_clean} — ⚠️ Email failed: {str(e)}")
-                    else:
-                        log.append(f"✅ Generated payslip for {emp_name_clean}")
+                    # Queue the email if requested (persisted, sent in the background)
+                    if delivery is not None and email_id:
+                        delivery.submit(str(key), email_id, filename, pdf_bytes)
+                    log.append(f"✅ Generated payslip for {emp_name_clean}")
 
                     successful_count += 1
-
-                except Exception as e:
-                    retry_list.append(emp_id)
-                    log.append(f"❌ Error generating payslip for {emp_name_clean}: {str(e)}")
-                    error_count += 1
+        except BaseException:
+            os.remove(archive_file.name)
+            if delivery is not None:
+                delivery.close()
+            raise
+        archive_path = publish_payslip_archive(archive_file.name, selected_month_str)
 
         # Clear progress bar
         progress_bar.empty()
 
+        # Wait for the remaining emails and add each recipient's outcome to the log
+        email_counts = {"sent": 0, "failed": 0}
+        if delivery is not None:
+            delivery.close()
+            email_counts = show_delivery_progress(delivery)
+            for entry in email_delivery.delivery_log(delivery.batch_id).to_dict("records"):
+                emp_name_clean = payslip_info[int(entry["message_id"])][0]
+                if entry["status"] == "sent":
+                    log.append(f"📤 Emailed to {emp_name_clean} <{entry['recipient']}>")
+                elif entry["status"] == "failed":
+                    log.append(f"⚠️ Email failed for {emp_name_clean} <{entry['recipient']}>: {entry['error']}")
+
         # Show results summary
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -399,14 +449,20 @@ def run_bulkpayslip():
         with col3:
             st.metric("📊 Total Processed", successful_count + error_count)
 
-        # Download button
+        # Download button (served from the archive on disk)
         if successful_count > 0:
-            st.download_button(
-                label=f"📦 Download ZIP for {month_str} ({successful_count} payslips)",
-                data=zip_buffer.getvalue(),
-                file_name=f"Payslips_{selected_month_str}.zip",
-                mime="application/zip"
-            )
+            archive_mb = os.path.getsize(archive_path) / (1024 * 1024)
+            if archive_mb <= config.BULK_PAYSLIP_SETTINGS.get("max_download_mb", 200):
+                with open(archive_path, "rb") as archive:
+                    st.download_button(
+                        label=f"📦 Download ZIP for {month_str} ({successful_count} payslips)",
+                        data=archive,
+                        file_name=f"Payslips_{selected_month_str}.zip",
+                        mime="application/zip"
+                    )
+            else:
+                st.info(f"📦 The archive is {archive_mb:,.0f} MB, too large to download in the browser. "
+                        f"It is saved on the server at `{archive_path}`.")
 
         # Show generation log
         with st.expander(f"📋 Generation Log ({len(log)} entries)"):
@@ -427,15 +483,23 @@ def run_bulkpayslip():
                 f"♻️ {len(retry_list)} employee(s) had issues. Employee IDs with errors: {', '.join(retry_list)}")
 
         # Email summary
-        if send_emails:
-            email_sent = len([entry for entry in log if "📤" in entry])
-            email_failed = len([entry for entry in log if "⚠️ Email failed" in entry])
-
+        if delivery is not None:
             col1, col2 = st.columns(2)
             with col1:
-                st.metric("📧 Emails Sent", email_sent)
+                st.metric("📧 Emails Sent", email_counts["sent"])
             with col2:
-                st.metric("📧 Email Failures", email_failed)
+                st.metric("📧 Email Failures", email_counts["failed"])
+
+            delivery_log = email_delivery.delivery_log(delivery.batch_id)
+            st.download_button(
+                label="📥 Download Email Delivery Log",
+                data=delivery_log.to_csv(index=False),
+                file_name=f"{delivery.batch_id}_deliveries.csv",
+                mime="text/csv"
+            )
+            if email_counts["failed"] or delivery.error:
+                st.info(f"♻️ Unsent emails are kept in batch `{delivery.batch_id}` and can be resumed "
+                        f"from '♻️ Unsent Emails' above.")
 
 
 if __name__ == "__main__":
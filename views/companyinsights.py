@@ -4,6 +4,7 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 import config  # Import your config module
+from repository import read_table
 
 
 def load_data_source():
@@ -12,26 +13,10 @@ def load_data_source():
     Returns: tuple of (salary_df, employee_master)
     """
     try:
-        if config.USE_SQL:
-            # Load from SQL Server
-            conn = config.get_sql_connection()
-
-            # Load salary data
-            salary_query = f"SELECT * FROM {config.SALARY_LOG_TABLE}"
-            salary_df = pd.read_sql(salary_query, conn)
-
-            # Load employee master data
-            employee_query = f"SELECT * FROM {config.EMPLOYEE_MASTER_TABLE}"
-            employee_master = pd.read_sql(employee_query, conn)
-
-            conn.close()
-            st.success("✅ Data loaded from SQL Server")
-
-        else:
-            # Load from CSV files
-            salary_df = pd.read_csv(config.SALARY_LOG_CSV)
-            employee_master = pd.read_csv(config.EMPLOYEE_MASTER_CSV, dtype={"employee_id": str})
-            st.success("✅ Data loaded from CSV files")
+        # Served from the shared table cache; only re-read after a write
+        salary_df = read_table(config.SALARY_LOG_TABLE)
+        employee_master = read_table(config.EMPLOYEE_MASTER_TABLE)
+        st.success(f"✅ Data loaded from {'SQL Server' if config.USE_SQL else 'CSV files'}")
 
         return salary_df, employee_master
 
@@ -40,8 +25,8 @@ def load_data_source():
         if config.USE_SQL:
             st.warning("Falling back to CSV files...")
             try:
-                salary_df = pd.read_csv(config.SALARY_LOG_CSV)
-                employee_master = pd.read_csv(config.EMPLOYEE_MASTER_CSV, dtype={"employee_id": str})
+                salary_df = read_table(config.SALARY_LOG_TABLE, use_sql=False)
+                employee_master = read_table(config.EMPLOYEE_MASTER_TABLE, use_sql=False)
                 st.success("✅ Fallback: Data loaded from CSV files")
                 return salary_df, employee_master
             except Exception as csv_error:
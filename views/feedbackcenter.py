@@ -5,66 +5,15 @@ import os
 import pyodbc
 from config import (
     USE_SQL, FEEDBACK_LOG_CSV, FEEDBACK_LOG_TABLE,
-    safe_get_conn, table_exists, safe_datetime_for_sql
+    sql_connection, table_columns, safe_datetime_for_sql, bump_table_version
 )
+from schema_migrations import ensure_migrated
 
 
 def create_feedback_table_if_not_exists(conn):
-    """Create feedback_log table if it doesn't exist, or add missing columns."""
-    cursor = conn.cursor()
-
-    if not table_exists(conn, FEEDBACK_LOG_TABLE):
-        # Create new table with all columns
-        create_table_sql = f"""
-        CREATE TABLE {FEEDBACK_LOG_TABLE} (
-            id INT IDENTITY(1,1) PRIMARY KEY,
-            timestamp DATETIME NOT NULL,
-            employee_name NVARCHAR(100) NOT NULL,
-            related_date DATE NOT NULL,
-            issue_type NVARCHAR(50) NOT NULL,
-            description NVARCHAR(MAX),
-            status NVARCHAR(20) DEFAULT 'Pending',
-            resolution NVARCHAR(MAX) DEFAULT '-',
-            follow_up NVARCHAR(MAX) DEFAULT '-',
-            created_at DATETIME DEFAULT GETDATE(),
-            updated_at DATETIME DEFAULT GETDATE()
-        )
-        """
-        cursor.execute(create_table_sql)
-        conn.commit()
-    else:
-        # Table exists, check for missing columns and add them
-        table_name = FEEDBACK_LOG_TABLE.split('.')[-1]  # Get table name without schema
-
-        # Check for missing columns
-        missing_columns = []
-        required_columns = {
-            'id': 'INT IDENTITY(1,1) PRIMARY KEY',
-            'created_at': 'DATETIME DEFAULT GETDATE()',
-            'updated_at': 'DATETIME DEFAULT GETDATE()'
-        }
-
-        for col_name in required_columns:
-            cursor.execute(f"""
-            SELECT COLUMN_NAME 
-            FROM INFORMATION_SCHEMA.COLUMNS 
-            WHERE TABLE_NAME = ? AND COLUMN_NAME = ?
-            """, (table_name, col_name))
-
-            if not cursor.fetchone():
-                missing_columns.append((col_name, required_columns[col_name]))
-
-        # Add missing columns (except primary key which can't be added to existing table)
-        for col_name, col_definition in missing_columns:
-            if col_name != 'id':  # Skip primary key for existing tables
-                try:
-                    alter_sql = f"ALTER TABLE {FEEDBACK_LOG_TABLE} ADD {col_name} {col_definition}"
-                    cursor.execute(alter_sql)
-                    conn.commit()
-                except Exception as e:
-                    st.warning(f"Could not add column {col_name}: {str(e)}")
-
-    cursor.close()
+    """Make sure feedback_log exists with all its columns; the DDL runs once per process (see schema_migrations.py)."""
+    for name, error in ensure_migrated(conn):
+        st.warning(f"Schema migration failed ({name}): {error}")
 
 
 def load_feedback_data():
@@ -75,9 +24,8 @@ def load_feedback_data():
     ]
 
     if USE_SQL:
-        conn = safe_get_conn()
-        if conn:
-            try:
+        try:
+            with sql_connection() as conn:
                 create_feedback_table_if_not_exists(conn)
 
                 query = f"""
@@ -87,7 +35,6 @@ def load_feedback_data():
                 ORDER BY timestamp DESC
                 """
                 feedback_log = pd.read_sql(query, conn, parse_dates=["timestamp", "related_date"])
-                conn.close()
 
                 # Ensure all required columns exist
                 for col in required_columns:
@@ -95,10 +42,9 @@ def load_feedback_data():
                         feedback_log[col] = "-"
 
                 return feedback_log
-            except Exception as e:
-                st.error(f"Error loading from SQL: {str(e)}")
-                conn.close()
-                return pd.DataFrame(columns=required_columns)
+        except Exception as e:
+            st.error(f"Error loading from SQL: {str(e)}")
+            return pd.DataFrame(columns=required_columns)
 
     # CSV fallback or when USE_SQL is False
     if os.path.exists(FEEDBACK_LOG_CSV):
@@ -114,9 +60,8 @@ def load_feedback_data():
 def save_feedback_data(feedback_log):
     """Save feedback data to SQL or CSV based on USE_SQL setting."""
     if USE_SQL:
-        conn = safe_get_conn()
-        if conn:
-            try:
+        try:
+            with sql_connection() as conn:
                 create_feedback_table_if_not_exists(conn)
 
                 # Clear existing data and insert fresh data
@@ -142,18 +87,18 @@ def save_feedback_data(feedback_log):
 
                 conn.commit()
                 cursor.close()
-                conn.close()
+                bump_table_version(FEEDBACK_LOG_TABLE)
                 return True
-            except Exception as e:
-                st.error(f"Error saving to SQL: {str(e)}")
-                conn.close()
-                return False
+        except Exception as e:
+            st.error(f"Error saving to SQL: {str(e)}")
+            return False
 
     # CSV fallback or when USE_SQL is False
     try:
         # Ensure directory exists
         os.makedirs(os.path.dirname(FEEDBACK_LOG_CSV), exist_ok=True)
         feedback_log.to_csv(FEEDBACK_LOG_CSV, index=False)
+        bump_table_version(FEEDBACK_LOG_TABLE)
         return True
     except Exception as e:
         st.error(f"Error saving to CSV: {str(e)}")
@@ -163,9 +108,8 @@ def save_feedback_data(feedback_log):
 def add_new_feedback(employee_name, related_date, issue_type, description):
     """Add new feedback entry."""
     if USE_SQL:
-        conn = safe_get_conn()
-        if conn:
-            try:
+        try:
+            with sql_connection() as conn:
                 create_feedback_table_if_not_exists(conn)
                 cursor = conn.cursor()
                 insert_sql = f"""
@@ -182,12 +126,11 @@ def add_new_feedback(employee_name, related_date, issue_type, description):
                 ))
                 conn.commit()
                 cursor.close()
-                conn.close()
+                bump_table_version(FEEDBACK_LOG_TABLE)
                 return True
-            except Exception as e:
-                st.error(f"Error adding feedback to SQL: {str(e)}")
-                conn.close()
-                return False
+        except Exception as e:
+            st.error(f"Error adding feedback to SQL: {str(e)}")
+            return False
 
     # CSV fallback
     feedback_log = load_feedback_data()
@@ -208,9 +151,8 @@ def add_new_feedback(employee_name, related_date, issue_type, description):
 def update_feedback_entry(employee_name, timestamp, related_date, **updates):
     """Update existing feedback entry."""
     if USE_SQL:
-        conn = safe_get_conn()
-        if conn:
-            try:
+        try:
+            with sql_connection() as conn:
                 cursor = conn.cursor()
 
                 # Debug: Check what we're trying to update
@@ -230,13 +172,7 @@ def update_feedback_entry(employee_name, timestamp, related_date, **updates):
                     st.write(f"   - {row}")
 
                 # Check if updated_at column exists
-                cursor.execute(f"""
-                SELECT COLUMN_NAME 
-                FROM INFORMATION_SCHEMA.COLUMNS 
-                WHERE TABLE_NAME = '{FEEDBACK_LOG_TABLE.split('.')[-1]}' 
-                AND COLUMN_NAME = 'updated_at'
-                """)
-                has_updated_at = cursor.fetchone() is not None
+                has_updated_at = "updated_at" in table_columns(conn, FEEDBACK_LOG_TABLE)
 
                 # Build dynamic update query
                 set_clauses = []
@@ -267,12 +203,11 @@ def update_feedback_entry(employee_name, timestamp, related_date, **updates):
 
                 conn.commit()
                 cursor.close()
-                conn.close()
+                bump_table_version(FEEDBACK_LOG_TABLE)
                 return rows_affected > 0
-            except Exception as e:
-                st.error(f"Error updating feedback in SQL: {str(e)}")
-                conn.close()
-                return False
+        except Exception as e:
+            st.error(f"Error updating feedback in SQL: {str(e)}")
+            return False
 
     # CSV fallback
     feedback_log = load_feedback_data()
@@ -3,7 +3,9 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, date
 import calendar
-from config import USE_SQL, safe_datetime_for_sql, get_sql_connection, EMPLOYEE_MASTER_TABLE, EMPLOYEE_DATA_TABLE, SALARY_LOG_TABLE
+from config import USE_SQL, safe_datetime_for_sql, sql_connection, EMPLOYEE_MASTER_TABLE, EMPLOYEE_DATA_TABLE, SALARY_LOG_TABLE
+from repository import read_table
+from attendance_journal import drop_tracking_column
 
 def run_leavevisualizer():
     st.set_page_config(layout="wide")
@@ -12,13 +14,15 @@ def run_leavevisualizer():
 
     # ---------------- Load Data ----------------
     if USE_SQL:
-        conn = get_sql_connection()
-        employee_master = pd.read_sql(f"SELECT * FROM {EMPLOYEE_MASTER_TABLE}", conn)
-        employee_data = pd.read_sql(f"SELECT * FROM {EMPLOYEE_DATA_TABLE}", conn, parse_dates=["start_datetime", "exit_datetime", "date_only"])
-        salary_df = pd.read_sql(f"SELECT * FROM {SALARY_LOG_TABLE}", conn, parse_dates=["data_date"])
+        with sql_connection() as conn:
+            employee_master = pd.read_sql(f"SELECT * FROM {EMPLOYEE_MASTER_TABLE}", conn)
+            employee_data = drop_tracking_column(pd.read_sql(f"SELECT * FROM {EMPLOYEE_DATA_TABLE}", conn, parse_dates=["start_datetime", "exit_datetime", "date_only"]))
+            salary_df = pd.read_sql(f"SELECT * FROM {SALARY_LOG_TABLE}", conn, parse_dates=["data_date"])
     else:
         employee_master = pd.read_csv("data/employee_master.csv", dtype={"employee_id": str})
-        employee_data = pd.read_csv("data/employee_data.csv", parse_dates=["start_datetime", "exit_datetime"])
+        employee_data = read_table(EMPLOYEE_DATA_TABLE, use_sql=False)
+        for col in ["start_datetime", "exit_datetime"]:
+            employee_data[col] = pd.to_datetime(employee_data[col], errors="coerce")
         salary_df = pd.read_csv("data/salary_log.csv", parse_dates=["data_date"], dayfirst=False)
 
     # Normalize employee names
@@ -3,7 +3,9 @@ import pandas as pd
 import os
 from datetime import datetime, timedelta
 from utils.data_helpers import get_greeting
-from config import USE_SQL, get_sql_connection, EMPLOYEE_DATA_TABLE, safe_float, safe_datetime_for_sql
+import attendance_log
+import attendance_journal
+from config import USE_SQL, sql_connection, EMPLOYEE_DATA_TABLE, safe_float, safe_datetime_for_sql, bump_table_version
 
 def format_manual_description(log_date, admin_user, target_date, field="manual attendance"):
     return f"On {log_date.strftime('%d %B %Y')}, admin {admin_user} added data for {target_date.strftime('%d %B %Y')} regarding {field}."
@@ -34,8 +36,11 @@ def run_manual_entry(admin_name=None):
     hourly_rate = salary / (8 * 26)
 
     # Load or initialize employee data
-    if os.path.exists(DATA_PATH):
-        employee_data = pd.read_csv(DATA_PATH, dtype={"employee_id": str})
+    if attendance_log.is_enabled() or os.path.exists(DATA_PATH):
+        if attendance_log.is_enabled():
+            employee_data = attendance_log.read_attendance()
+        else:
+            employee_data = pd.read_csv(DATA_PATH, dtype={"employee_id": str})
         if "date_only" in employee_data.columns:
             employee_data["date_only"] = pd.to_datetime(employee_data["date_only"], errors="coerce").dt.date
         else:
@@ -132,44 +137,49 @@ def run_manual_entry(admin_name=None):
 
         employee_data = pd.concat([employee_data, pd.DataFrame([new_row])], ignore_index=True)
         if not USE_SQL:
-            employee_data.to_csv(DATA_PATH, index=False)
+            if attendance_log.is_enabled():
+                attendance_log.put_row(new_row)
+            else:
+                employee_data.to_csv(DATA_PATH, index=False)
+                attendance_journal.record_change(employee_id, selected_date, "manual_entry")
+            bump_table_version(EMPLOYEE_DATA_TABLE)
         if USE_SQL:
             try:
-                conn = get_sql_connection()
-                cursor = conn.cursor()
-
-                insert_query = f"""
-                    INSERT INTO {EMPLOYEE_DATA_TABLE} (
-                        employee_id, employee_name, start_datetime, exit_datetime, date_only,
-                        total_hours, extra_hours, extra_pay, attendance_status, late_mark,
-                        method, confidence, notes, admin_user, description,
-                        reason, timestamp, action_type
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """
-
-                cursor.execute(insert_query, (
-                    employee_id,
-                    employee_name,
-                    safe_datetime_for_sql(start_dt),
-                    safe_datetime_for_sql(exit_dt),
-                    selected_date,
-                    safe_float(total_hours),
-                    safe_float(extra_hours),
-                    safe_float(extra_pay),
-                    attendance_status,
-                    is_late,
-                    "Manual",
-                    None,
-                    notes,
-                    admin_name,
-                    description,
-                    reason,
-                    safe_datetime_for_sql(log_date),
-                    "manual_entry"
-                ))
-
-                conn.commit()
-                conn.close()
+                with sql_connection() as conn:
+                    cursor = conn.cursor()
+
+                    insert_query = f"""
+                        INSERT INTO {EMPLOYEE_DATA_TABLE} (
+                            employee_id, employee_name, start_datetime, exit_datetime, date_only,
+                            total_hours, extra_hours, extra_pay, attendance_status, late_mark,
+                            method, confidence, notes, admin_user, description,
+                            reason, timestamp, action_type
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """
+
+                    cursor.execute(insert_query, (
+                        employee_id,
+                        employee_name,
+                        safe_datetime_for_sql(start_dt),
+                        safe_datetime_for_sql(exit_dt),
+                        selected_date,
+                        safe_float(total_hours),
+                        safe_float(extra_hours),
+                        safe_float(extra_pay),
+                        attendance_status,
+                        is_late,
+                        "Manual",
+                        None,
+                        notes,
+                        admin_name,
+                        description,
+                        reason,
+                        safe_datetime_for_sql(log_date),
+                        "manual_entry"
+                    ))
+
+                    conn.commit()
+                bump_table_version(EMPLOYEE_DATA_TABLE)
                 st.success("✅ Manual entry also saved to SQL Server.")
             except Exception as e:
                 st.error(f"⚠️ SQL insert failed: {e}")
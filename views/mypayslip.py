@@ -6,6 +6,8 @@ import numpy as np
 from datetime import date
 import pyodbc  # Import the ODBC library
 import config  # Import your config file
+from repository import read_table
+import work_calendar
 import calendar
 import datetime
 
@@ -31,31 +33,25 @@ def run_mypayslip():
     # ------------------
     if is_sql:
         try:
-            conn = config.safe_get_conn()
-            if conn:
-                st.info("Attempting to load data from SQL Server...")
-                employee_master = pd.read_sql_query(f"SELECT * FROM {config.EMPLOYEE_MASTER_TABLE}", conn)
-                salary_df = pd.read_sql_query(f"SELECT * FROM {config.SALARY_LOG_TABLE}", conn)
-                attendance_df = pd.read_sql_query(f"SELECT * FROM {config.EMPLOYEE_DATA_TABLE}", conn)
-                conn.close()
-                st.success("✅ Data loaded successfully from SQL Server.")
-            else:
-                st.warning("SQL connection failed. Falling back to CSV files.")
-                is_sql = False
-        except pyodbc.Error as ex:
+            st.info("Attempting to load data from SQL Server...")
+            employee_master = read_table(config.EMPLOYEE_MASTER_TABLE)
+            salary_df = read_table(config.SALARY_LOG_TABLE)
+            attendance_df = read_table(config.EMPLOYEE_DATA_TABLE)
+            st.success("✅ Data loaded successfully from SQL Server.")
+        except (pyodbc.Error, config.DatabaseConnectionError) as ex:
             st.error(f"SQL connection error: {ex}. Falling back to CSV files.")
             is_sql = False
 
     if not is_sql:
         st.info("Loading data from local CSV files.")
         if os.path.exists(config.SALARY_LOG_CSV):
-            salary_df = pd.read_csv(config.SALARY_LOG_CSV, dtype={"employee_id": str})
+            salary_df = read_table(config.SALARY_LOG_TABLE, use_sql=False)
         else:
             st.error(f"⚠️ File not found: {config.SALARY_LOG_CSV}")
             st.stop()
 
         if os.path.exists(config.EMPLOYEE_MASTER_CSV):
-            employee_master = pd.read_csv(config.EMPLOYEE_MASTER_CSV, dtype={"employee_id": str})
+            employee_master = read_table(config.EMPLOYEE_MASTER_TABLE, use_sql=False)
         else:
             st.error(f"⚠️ File not found: {config.EMPLOYEE_MASTER_CSV}")
             st.stop()
@@ -286,45 +282,18 @@ def run_mypayslip():
         if not is_sql:
             # Fallback to CSV for attendance if SQL failed earlier
             if os.path.exists(config.EMPLOYEE_DATA_CSV):
-                attendance_df = pd.read_csv(config.EMPLOYEE_DATA_CSV, dtype={"employee_id": str})
+                attendance_df = read_table(config.EMPLOYEE_DATA_TABLE, use_sql=False)
             else:
                 st.warning(f"⚠️ Attendance file not found: {config.EMPLOYEE_DATA_CSV}")
                 attendance_map = {}
                 return
 
-        attendance_df["date_only"] = pd.to_datetime(attendance_df["date_only"], errors="coerce")
         attendance_df["employee_id"] = attendance_df["employee_id"].astype(str)
-        attendance_df["attendance_status"] = attendance_df["attendance_status"].fillna("absent").str.lower().str.strip()
-
         month_start = pd.to_datetime(selected_month_str + "-01")
-        month_end = (month_start + pd.offsets.MonthEnd(1)).date()
-        filtered_attendance = attendance_df[
-            (attendance_df["employee_id"] == employee_id) &
-            (attendance_df["date_only"].dt.date >= month_start.date()) &
-            (attendance_df["date_only"].dt.date <= month_end)
-            ]
-
-        attendance_map = {}
-        for _, att_row in filtered_attendance.iterrows():
-            day = att_row["date_only"].day
-            status = att_row["attendance_status"]
-            if status == "full day":
-                attendance_map[day] = "F"
-            elif status == "half day":
-                attendance_map[day] = "H"
-            elif status == "late mark":
-                attendance_map[day] = "L"
-            else:
-                attendance_map[day] = "A"
-
-        # Fill missing days as 'A' (Absent) or '-' for Tuesdays
-        for day in range(1, month_end.day + 1):
-            dt = date(month_start.year, month_start.month, day)
-            if day not in attendance_map:
-                if dt.weekday() == 1:  # Tuesday
-                    attendance_map[day] = "-"
-                else:
-                    attendance_map[day] = "A"
+        month_attendance = work_calendar.MonthAttendance(
+            attendance_df[attendance_df["employee_id"] == employee_id], month_start.year, month_start.month
+        )
+        attendance_map = month_attendance.markers(employee_id)
 
     except Exception as e:
         st.warning(f"📛 Error generating attendance calendar: {e}")
@@ -389,7 +358,10 @@ def run_mypayslip():
         "leave_concession_amount": row["leave_concession_amount"],
         "lop_days": row["lop_days"],
         "days_in_month": row["days_in_month"],
-        "working_days": row["working_days"]
+        "working_days": row["working_days"],
+
+        # Finalize time of the salary row, stamped in the PDF footer
+        "timestamp": row.get("timestamp")
     }
 
     # 🖨️ PDF Generation & Download
@@ -6,146 +6,67 @@ import datetime
 import calendar
 from config import (
     USE_SQL,
-    safe_get_conn,
+    sql_connection,
     table_exists,
+    column_types,
     SALARY_LOG_TABLE,
     SALARY_LOG_CSV,
     safe_float,
-    safe_datetime_for_sql
+    safe_datetime_for_sql,
+    bump_table_version,
+    EMPLOYEE_MASTER_TABLE,
+    EMPLOYEE_DATA_TABLE
 )
+from repository import read_table
+import work_calendar
+from payroll_engine import compute_monthly_payroll, recompute_entries, SALARY_ROW_COLUMNS, PAYROLL_PARAMETERS
+from attendance_journal import current_version, dirty_keys
+from attendance_log import normalize_employee_id
+from utils.pdf_payslip import clear_payslip_cache, invalidate_payslips
+from schema_migrations import ensure_migrated
 
 
 # -------------------- TABLE MANAGEMENT --------------------
 def create_salary_table_if_not_exists(conn):
-    """Create salary_log table if it doesn't exist."""
-    if not table_exists(conn, SALARY_LOG_TABLE):
-        cursor = conn.cursor()
-        try:
-            st.info(f"🔧 Creating table {SALARY_LOG_TABLE}...")
-
-            create_table_sql = f"""
-            CREATE TABLE {SALARY_LOG_TABLE} (
-                id INT IDENTITY(1,1) PRIMARY KEY,
-                employee_id NVARCHAR(50) NOT NULL,
-                employee_name NVARCHAR(255),
-                salary_month NVARCHAR(7), -- YYYY-MM format
-                data_date DATE,
-                timestamp DATETIME2,
-                entry_time TIME,
-                fixed_salary DECIMAL(15,2) DEFAULT 0,
-                basic_salary DECIMAL(15,2) DEFAULT 0,
-                da DECIMAL(15,2) DEFAULT 0,
-                hra DECIMAL(15,2) DEFAULT 0,
-                cell_allowance DECIMAL(15,2) DEFAULT 0,
-                petrol_allowance DECIMAL(15,2) DEFAULT 0,
-                attendance_allowance DECIMAL(15,2) DEFAULT 0,
-                performance_allowance DECIMAL(15,2) DEFAULT 0,
-                ot_hours_amount DECIMAL(15,2) DEFAULT 0,
-                rd_allowance DECIMAL(15,2) DEFAULT 0,
-                lic_allowance DECIMAL(15,2) DEFAULT 0,
-                arrears_allowance DECIMAL(15,2) DEFAULT 0,
-                other_allowance DECIMAL(15,2) DEFAULT 0,
-                gross_earnings DECIMAL(15,2) DEFAULT 0,
-                base_salary DECIMAL(15,2) DEFAULT 0,
-                extra_pay DECIMAL(15,2) DEFAULT 0,
-                festival_bonus DECIMAL(15,2) DEFAULT 0,
-                tuesday_bonus DECIMAL(15,2) DEFAULT 0,
-                tuesday_count INT DEFAULT 0,
-                employee_pf DECIMAL(15,2) DEFAULT 0,
-                employer_pf DECIMAL(15,2) DEFAULT 0,
-                pf_admin_charges DECIMAL(15,2) DEFAULT 0,
-                employee_esi DECIMAL(15,2) DEFAULT 0,
-                employer_esi DECIMAL(15,2) DEFAULT 0,
-                tax_deduction DECIMAL(15,2) DEFAULT 0,
-                mlwf_employee DECIMAL(15,2) DEFAULT 0,
-                mlwf_employer DECIMAL(15,2) DEFAULT 0,
-                advance_deduction DECIMAL(15,2) DEFAULT 0,
-                loan_deduction DECIMAL(15,2) DEFAULT 0,
-                loan_cutting DECIMAL(15,2) DEFAULT 0,
-                fine_deduction DECIMAL(15,2) DEFAULT 0,
-                extra_deduction DECIMAL(15,2) DEFAULT 0,
-                total_deductions DECIMAL(15,2) DEFAULT 0,
-                net_salary DECIMAL(15,2) DEFAULT 0,
-                ctc DECIMAL(15,2) DEFAULT 0,
-                extra_hours DECIMAL(8,2) DEFAULT 0,
-                late_marks INT DEFAULT 0,
-                full_days INT DEFAULT 0,
-                half_days INT DEFAULT 0,
-                earned_leave_taken DECIMAL(8,2) DEFAULT 0,
-                leave_accrued DECIMAL(8,2) DEFAULT 0,
-                leave_balance DECIMAL(8,2) DEFAULT 0,
-                lop_deduction DECIMAL(15,2) DEFAULT 0,
-                leave_encashment DECIMAL(15,2) DEFAULT 0,
-                leave_concession DECIMAL(8,2) DEFAULT 0,
-                leave_concession_amount DECIMAL(15,2) DEFAULT 0,
-                action_type NVARCHAR(50),
-                description NVARCHAR(500),
-                lop_days DECIMAL(8,2) DEFAULT 0,
-                days_in_month INT DEFAULT 0,
-                working_days INT DEFAULT 0,
-                total_earnings DECIMAL(15,2) DEFAULT 0
-            )
-            """
-            cursor.execute(create_table_sql)
-            conn.commit()
-            st.success(f"✅ Successfully created table {SALARY_LOG_TABLE}")
-
-        except Exception as e:
-            st.error(f"❌ Error creating table: {e}")
-            print(f"SQL Error: {e}")
-        finally:
-            cursor.close()
-    else:
-        st.info(f"✅ Table {SALARY_LOG_TABLE} already exists")
+    """Make sure salary_log exists with all its columns; the DDL runs once per process (see schema_migrations.py)."""
+    for name, error in ensure_migrated(conn):
+        st.error(f"❌ Schema migration failed ({name}): {error}")
 
 
 def check_salary_table_status():
     """Check if salary_log table exists and show its status"""
     st.write("🔍 Checking salary_log table status...")
 
-    conn = safe_get_conn()
-    if not conn:
-        st.error("❌ Cannot connect to SQL Server")
-        return False
-
     try:
-        # Check if table exists
-        table_exists_result = table_exists(conn, SALARY_LOG_TABLE)
-        st.write(f"Table {SALARY_LOG_TABLE} exists: {table_exists_result}")
+        with sql_connection() as conn:
+            # Check if table exists
+            table_exists_result = table_exists(conn, SALARY_LOG_TABLE)
+            st.write(f"Table {SALARY_LOG_TABLE} exists: {table_exists_result}")
 
-        if table_exists_result:
-            # Get record count
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT COUNT(*) FROM {SALARY_LOG_TABLE}")
-            count = cursor.fetchone()[0]
-            st.write(f"📊 Records in {SALARY_LOG_TABLE}: {count}")
-
-            # Show table structure
-            cursor.execute(f"""
-                SELECT COLUMN_NAME, DATA_TYPE, IS_NULLABLE 
-                FROM INFORMATION_SCHEMA.COLUMNS 
-                WHERE TABLE_NAME = 'salary_log'
-                ORDER BY ORDINAL_POSITION
-            """)
-            columns = cursor.fetchall()
-            st.write("📋 Table structure:")
-            col_data = []
-            for col in columns[:15]:  # Show first 15 columns
-                col_data.append([col[0], col[1], col[2]])
-
-            if col_data:
-                col_df = pd.DataFrame(col_data, columns=['Column Name', 'Data Type', 'Nullable'])
-                st.dataframe(col_df)
+            if table_exists_result:
+                # Get record count
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT COUNT(*) FROM {SALARY_LOG_TABLE}")
+                count = cursor.fetchone()[0]
+                st.write(f"📊 Records in {SALARY_LOG_TABLE}: {count}")
 
-            cursor.close()
+                # Show table structure (from the schema cache)
+                columns = column_types(conn, SALARY_LOG_TABLE)
+                st.write("📋 Table structure:")
+                col_data = []
+                for name, (data_type, nullable) in list(columns.items())[:15]:  # Show first 15 columns
+                    col_data.append([name, data_type, "YES" if nullable else "NO"])
+
+                if col_data:
+                    col_df = pd.DataFrame(col_data, columns=['Column Name', 'Data Type', 'Nullable'])
+                    st.dataframe(col_df)
+
+                cursor.close()
 
-        conn.close()
-        return table_exists_result
+            return table_exists_result
 
     except Exception as e:
         st.error(f"❌ Error checking table: {e}")
-        if conn:
-            conn.close()
         return False
 
 
@@ -153,135 +74,77 @@ def test_salary_log_query():
     """Test querying the salary_log table"""
     st.subheader("🧪 Test Salary Log Query")
 
-    conn = safe_get_conn()
-    if not conn:
-        st.error("❌ Cannot connect to SQL Server")
-        return
-
     try:
-        # First, ensure table exists
-        create_salary_table_if_not_exists(conn)
+        with sql_connection() as conn:
+            # First, ensure table exists
+            create_salary_table_if_not_exists(conn)
 
-        # Test basic query
-        st.write("Testing basic query...")
-        cursor = conn.cursor()
-
-        # Get record count
-        cursor.execute(f"SELECT COUNT(*) FROM {SALARY_LOG_TABLE}")
-        count = cursor.fetchone()[0]
-        st.write(f"📊 Total records: {count}")
+            # Test basic query
+            st.write("Testing basic query...")
+            cursor = conn.cursor()
 
-        # If records exist, show some data
-        if count > 0:
-            cursor.execute(f"""
-                SELECT TOP 5 employee_id, employee_name, salary_month, net_salary, timestamp 
-                FROM {SALARY_LOG_TABLE} 
-                ORDER BY timestamp DESC
-            """)
-            data = cursor.fetchall()
-
-            if data:
-                df = pd.DataFrame(data, columns=['Employee ID', 'Name', 'Month', 'Net Salary', 'Timestamp'])
-                st.dataframe(df)
-        else:
-            st.info("⚠️ No records found in salary_log table")
+            # Get record count
+            cursor.execute(f"SELECT COUNT(*) FROM {SALARY_LOG_TABLE}")
+            count = cursor.fetchone()[0]
+            st.write(f"📊 Total records: {count}")
+
+            # If records exist, show some data
+            if count > 0:
+                cursor.execute(f"""
+                    SELECT TOP 5 employee_id, employee_name, salary_month, net_salary, timestamp 
+                    FROM {SALARY_LOG_TABLE} 
+                    ORDER BY timestamp DESC
+                """)
+                data = cursor.fetchall()
+
+                if data:
+                    df = pd.DataFrame(data, columns=['Employee ID', 'Name', 'Month', 'Net Salary', 'Timestamp'])
+                    st.dataframe(df)
+            else:
+                st.info("⚠️ No records found in salary_log table")
 
-        # Test the exact query used in load_data
-        st.write("---")
-        st.write("Testing load_data query...")
-        try:
-            salary_log = pd.read_sql(f"SELECT * FROM {SALARY_LOG_TABLE}", conn)
-            st.success(f"✅ Successfully loaded {len(salary_log)} records using pandas.read_sql")
+            # Test the exact query used in load_data
+            st.write("---")
+            st.write("Testing load_data query...")
+            try:
+                salary_log = pd.read_sql(f"SELECT * FROM {SALARY_LOG_TABLE}", conn)
+                st.success(f"✅ Successfully loaded {len(salary_log)} records using pandas.read_sql")
 
-            if not salary_log.empty:
-                st.write("Sample columns:")
-                st.write(list(salary_log.columns)[:10])
-        except Exception as e:
-            st.error(f"❌ Error with pandas.read_sql: {e}")
+                if not salary_log.empty:
+                    st.write("Sample columns:")
+                    st.write(list(salary_log.columns)[:10])
+            except Exception as e:
+                st.error(f"❌ Error with pandas.read_sql: {e}")
 
-        cursor.close()
-        conn.close()
+            cursor.close()
 
     except Exception as e:
         st.error(f"❌ Query test error: {e}")
-        if conn:
-            conn.close()
 
 
 # -------------------- LOAD DATA --------------------
 def load_data():
-    if USE_SQL:
-        conn = safe_get_conn()
-        if conn:
-            try:
-                st.write("🔍 Loading data from SQL Server...")
-
-                # Load master data
-                master = pd.read_sql("SELECT * FROM dbo.employee_master", conn)
-                st.write(f"✅ Loaded {len(master)} employee master records")
-
-                # Load attendance data
-                attendance = pd.read_sql("SELECT * FROM dbo.employee_data", conn)
-                st.write(f"✅ Loaded {len(attendance)} attendance records")
-
-                # Load salary log with detailed checking
-                if table_exists(conn, SALARY_LOG_TABLE):
-                    st.write(f"✅ Table {SALARY_LOG_TABLE} exists, loading data...")
-
-                    # Check record count first
-                    cursor = conn.cursor()
-                    cursor.execute(f"SELECT COUNT(*) FROM {SALARY_LOG_TABLE}")
-                    record_count = cursor.fetchone()[0]
-                    cursor.close()
-
-                    st.write(f"📊 Found {record_count} salary log records")
-
-                    if record_count > 0:
-                        salary_log = pd.read_sql(f"SELECT * FROM {SALARY_LOG_TABLE}", conn)
-                        st.write(f"✅ Successfully loaded {len(salary_log)} salary log records")
-                    else:
-                        salary_log = pd.DataFrame()
-                        st.info("⚠️ No salary records found in table")
-                else:
-                    salary_log = pd.DataFrame()
-                    st.warning(f"⚠️ Table {SALARY_LOG_TABLE} does not exist")
+    # Whole tables come from the shared process cache (repository.read_table);
+    # they are only re-read after a write or when the source changed.
+    try:
+        master = read_table(EMPLOYEE_MASTER_TABLE)
+        attendance = read_table(EMPLOYEE_DATA_TABLE)
+        salary_log = read_table(SALARY_LOG_TABLE, missing_ok=True)
+    except Exception as e:
+        source = "SQL" if USE_SQL else "CSV files"
+        st.error(f"Error loading from {source}: {str(e)}")
+        st.write(f"Error details: {type(e).__name__}: {str(e)}")
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
-                conn.close()
-
-            except Exception as e:
-                st.error(f"Error loading from SQL: {str(e)}")
-                st.write(f"Error details: {type(e).__name__}: {str(e)}")
-                if conn:
-                    conn.close()
-                return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-        else:
-            st.error("❌ Could not establish SQL connection")
-            return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-    else:
-        # CSV fallback
-        try:
-            master = pd.read_csv("data/employee_master.csv")
-            attendance = pd.read_csv("data/employee_data.csv")
-            if os.path.exists(SALARY_LOG_CSV):
-                salary_log = pd.read_csv(SALARY_LOG_CSV)
-            else:
-                salary_log = pd.DataFrame()
-        except Exception as e:
-            st.error(f"Error loading CSV files: {str(e)}")
-            return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    st.write(f"✅ Loaded {len(master)} employee master records, {len(attendance)} attendance records "
+             f"and {len(salary_log)} salary log records")
 
     # Clean & format data
     if not master.empty:
         master["employee_id"] = master["employee_id"].astype(str)
         master["employee_name"] = master["employee_name"].str.strip().str.lower()
 
-    if not attendance.empty:
-        attendance["employee_id"] = attendance["employee_id"].astype(str)
-        attendance["employee_name"] = attendance["employee_name"].str.strip().str.lower()
-        attendance["date_only"] = pd.to_datetime(attendance["date_only"], errors="coerce")
-
-        if "late_mark" not in attendance.columns:
-            attendance["late_mark"] = False
+    attendance = clean_attendance(attendance)
 
     if not salary_log.empty:
         if "data_date" in salary_log.columns:
@@ -293,6 +156,29 @@ def load_data():
     return master, attendance, salary_log
 
 
+def clean_attendance(attendance):
+    """Normalize attendance columns the way the payroll calculations expect"""
+    if not attendance.empty:
+        attendance["employee_id"] = attendance["employee_id"].astype(str)
+        attendance["employee_name"] = attendance["employee_name"].str.strip().str.lower()
+        attendance["date_only"] = pd.to_datetime(attendance["date_only"], errors="coerce")
+
+        if "late_mark" not in attendance.columns:
+            attendance["late_mark"] = False
+    return attendance
+
+
+def load_fresh_attendance():
+    """
+    Stamp the attendance change journal, then read attendance straight from the
+    source. Salary rows computed from it store the stamp as source_version.
+    Returns (attendance, source_version).
+    """
+    source_version = current_version()
+    attendance = clean_attendance(read_table(EMPLOYEE_DATA_TABLE, refresh=True))
+    return attendance, source_version
+
+
 # -------------------- SAVE SALARY LOG --------------------
 def safe_number(val):
     """Convert values to float safely for SQL DECIMAL fields"""
@@ -308,175 +194,199 @@ def safe_number(val):
         return 0.0
 
 
-def save_salary_log(salary_log):
+SALARY_LOG_COLUMNS = SALARY_ROW_COLUMNS + ["source_version"]
+SALARY_LOG_STAGE = "#salary_log_stage"
+SALARY_LOG_BATCH_SIZE = 1000  # rows per fast_executemany call
+SALARY_LOG_INT_COLUMNS = {"tuesday_count", "late_marks", "full_days", "half_days", "days_in_month", "working_days"}
+SALARY_LOG_TEXT_COLUMNS = {"employee_name", "salary_month", "action_type", "description"}
+
+
+def salary_log_values(row):
+    """Parameter tuple for one salary_log row, in SALARY_LOG_COLUMNS order"""
+    # Clean row values
+    row = row.fillna(0)
+
+    # Ensure data_date is not empty
+    if not row.get("data_date") or str(row["data_date"]) in ["", "NaT", "NaN"]:
+        try:
+            # default: first day of salary_month
+            row["data_date"] = pd.to_datetime(str(row["salary_month"]) + "-01").date()
+        except Exception:
+            row["data_date"] = datetime.date.today()
+
+    # Handle entry_time safely
+    entry_time = row.get("entry_time")
+    if pd.isna(entry_time) or entry_time in ["", "NaT", "NaN"]:
+        entry_time = None
+
+    values = []
+    for col in SALARY_LOG_COLUMNS:
+        if col == "employee_id":
+            values.append(str(row[col]))
+        elif col == "data_date":
+            values.append(row[col])
+        elif col == "timestamp":
+            values.append(safe_datetime_for_sql(row[col]))
+        elif col == "entry_time":
+            values.append(entry_time)
+        elif col in SALARY_LOG_TEXT_COLUMNS:
+            values.append(row[col])
+        elif col in SALARY_LOG_INT_COLUMNS:
+            values.append(int(row[col]))
+        elif col == "total_earnings":
+            values.append(safe_number(row.get(col, 0)))
+        elif col == "source_version":
+            values.append(int(row.get(col, 0)))
+        else:
+            values.append(safe_number(row[col]))
+    return tuple(values)
+
+
+def _stage_salary_rows(cursor, staged):
+    """
+    Bulk insert (label, values) pairs into the staging table.
+
+    Batches go through fast_executemany; a batch the driver rejects is removed
+    and retried row by row, so a bad row only fails itself.
+    Returns [(label, error)] for the rows that could not be staged.
+    """
+    columns = ", ".join(SALARY_LOG_COLUMNS + ["stage_row"])
+    placeholders = ", ".join("?" * (len(SALARY_LOG_COLUMNS) + 1))
+    insert_sql = f"INSERT INTO {SALARY_LOG_STAGE} ({columns}) VALUES ({placeholders})"
+
+    failures = []
+    cursor.fast_executemany = True
+    for start in range(0, len(staged), SALARY_LOG_BATCH_SIZE):
+        batch = staged[start:start + SALARY_LOG_BATCH_SIZE]
+        params = [values + (start + i,) for i, (_, values) in enumerate(batch)]
+        try:
+            cursor.executemany(insert_sql, params)
+        except Exception:
+            cursor.execute(f"DELETE FROM {SALARY_LOG_STAGE} WHERE stage_row >= ?", start)
+            for (label, _), values in zip(batch, params):
+                try:
+                    cursor.execute(insert_sql, values)
+                except Exception as e:
+                    failures.append((label, e))
+    cursor.fast_executemany = False
+    return failures
+
+
+def write_salary_rows_sql(conn, rows):
+    """
+    Replace the salary_log rows for the (employee, month) keys in `rows`.
+
+    Rows are bulk-loaded into a session temp table, then one set-based DELETE
+    and one INSERT swap them in, in a single transaction. A row that fails
+    to convert or stage is reported and its existing entry is left untouched.
+    Returns (rows written, [(label, error)]).
+    """
+    failures = []
+    staged = []
+    for idx, row in rows.iterrows():
+        label = f"row {idx} ({row.get('employee_id')}, {row.get('salary_month')})"
+        try:
+            staged.append((label, salary_log_values(row)))
+        except Exception as e:
+            failures.append((label, e))
+    if not staged:
+        return 0, failures
+
+    columns = ", ".join(SALARY_LOG_COLUMNS)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"IF OBJECT_ID('tempdb..{SALARY_LOG_STAGE}') IS NOT NULL DROP TABLE {SALARY_LOG_STAGE}")
+        cursor.execute(f"SELECT TOP 0 {columns} INTO {SALARY_LOG_STAGE} FROM {SALARY_LOG_TABLE}")
+        cursor.execute(f"ALTER TABLE {SALARY_LOG_STAGE} ADD stage_row INT")
+        conn.commit()
+
+        failures.extend(_stage_salary_rows(cursor, staged))
+
+        cursor.execute(f"""
+            DELETE target FROM {SALARY_LOG_TABLE} AS target
+            WHERE EXISTS (
+                SELECT 1 FROM {SALARY_LOG_STAGE} AS stage
+                WHERE stage.employee_id = target.employee_id AND stage.salary_month = target.salary_month
+            )
+        """)
+        cursor.execute(f"INSERT INTO {SALARY_LOG_TABLE} ({columns}) SELECT {columns} FROM {SALARY_LOG_STAGE}")
+        written = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            cursor.execute(f"IF OBJECT_ID('tempdb..{SALARY_LOG_STAGE}') IS NOT NULL DROP TABLE {SALARY_LOG_STAGE}")
+            conn.commit()
+        except Exception:
+            pass
+        cursor.close()
+    return written, failures
+
+
+def forget_cached_payslips(keys=None):
+    """Remove cached payslip PDFs of (employee_id, salary_month) pairs, or all of them"""
+    try:
+        if keys is None:
+            clear_payslip_cache()
+        else:
+            invalidate_payslips(keys)
+    except Exception as e:
+        st.warning(f"⚠️ Could not clear cached payslips: {e}")
+
+
+def save_salary_log(salary_log, keys=None):
+    """
+    Save the salary log. keys: (employee_id, salary_month) pairs that were just
+    finalized; in SQL mode only those rows are written (default: every row).
+    The CSV file is always rewritten whole. Cached payslip PDFs of the saved
+    rows are dropped so they are rendered again from the new figures.
+    """
     st.write(f"💾 Storage Mode: {'SQL Database' if USE_SQL else 'CSV Files'}")
 
     if USE_SQL:
-        conn = safe_get_conn()
-        if conn:
-            try:
+        try:
+            with sql_connection() as conn:
                 create_salary_table_if_not_exists(conn)
-                cursor = conn.cursor()
 
-                success_count, error_count = 0, 0
-                for idx, row in salary_log.iterrows():
-                    try:
-                        # Clean row values
-                        row = row.fillna(0)
-
-                        # Ensure data_date is not empty
-                        if not row.get("data_date") or str(row["data_date"]) in ["", "NaT", "NaN"]:
-                            try:
-                                # default: first day of salary_month
-                                row["data_date"] = pd.to_datetime(str(row["salary_month"]) + "-01").date()
-                            except Exception:
-                                row["data_date"] = datetime.date.today()
-
-                        # Handle entry_time safely
-                        entry_time = row.get("entry_time")
-                        if pd.isna(entry_time) or entry_time in ["", "NaT", "NaN"]:
-                            entry_time = None
-
-                        # Remove existing record for same employee & month
-                        delete_sql = f"DELETE FROM {SALARY_LOG_TABLE} WHERE employee_id = ? AND salary_month = ?"
-                        cursor.execute(delete_sql, (str(row['employee_id']), row['salary_month']))
-
-                        # Insert new record
-                        insert_sql = f"""
-                        INSERT INTO {SALARY_LOG_TABLE} (
-                            employee_id, employee_name, salary_month, data_date, timestamp,
-                            entry_time, fixed_salary, basic_salary, da, hra,
-                            cell_allowance, petrol_allowance, attendance_allowance, performance_allowance,
-                            ot_hours_amount, rd_allowance, lic_allowance, arrears_allowance, other_allowance,
-                            gross_earnings, base_salary, extra_pay, festival_bonus, tuesday_bonus,
-                            tuesday_count, employee_pf, employer_pf, pf_admin_charges, employee_esi,
-                            employer_esi, tax_deduction, mlwf_employee, mlwf_employer, advance_deduction,
-                            loan_deduction, loan_cutting, fine_deduction, extra_deduction, total_deductions,
-                            net_salary, ctc, extra_hours, late_marks, full_days, half_days,
-                            earned_leave_taken, leave_accrued, leave_balance, lop_deduction,
-                            leave_encashment, leave_concession, leave_concession_amount, action_type,
-                            description, lop_days, days_in_month, working_days, total_earnings
-                        ) VALUES (
-                            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-                            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-                            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-                        )
-                        """
-
-                        values = (
-                            str(row['employee_id']),
-                            row['employee_name'],
-                            row['salary_month'],
-                            row['data_date'],
-                            safe_datetime_for_sql(row['timestamp']),
-                            entry_time,
-
-                            safe_number(row['fixed_salary']),
-                            safe_number(row['basic_salary']),
-                            safe_number(row['da']),
-                            safe_number(row['hra']),
-                            safe_number(row['cell_allowance']),
-                            safe_number(row['petrol_allowance']),
-                            safe_number(row['attendance_allowance']),
-                            safe_number(row['performance_allowance']),
-                            safe_number(row['ot_hours_amount']),
-                            safe_number(row['rd_allowance']),
-                            safe_number(row['lic_allowance']),
-                            safe_number(row['arrears_allowance']),
-                            safe_number(row['other_allowance']),
-                            safe_number(row['gross_earnings']),
-                            safe_number(row['base_salary']),
-                            safe_number(row['extra_pay']),
-                            safe_number(row['festival_bonus']),
-                            safe_number(row['tuesday_bonus']),
-                            int(row['tuesday_count']),
-                            safe_number(row['employee_pf']),
-                            safe_number(row['employer_pf']),
-                            safe_number(row['pf_admin_charges']),
-                            safe_number(row['employee_esi']),
-                            safe_number(row['employer_esi']),
-                            safe_number(row['tax_deduction']),
-                            safe_number(row['mlwf_employee']),
-                            safe_number(row['mlwf_employer']),
-                            safe_number(row['advance_deduction']),
-                            safe_number(row['loan_deduction']),
-                            safe_number(row['loan_cutting']),
-                            safe_number(row['fine_deduction']),
-                            safe_number(row['extra_deduction']),
-                            safe_number(row['total_deductions']),
-                            safe_number(row['net_salary']),
-                            safe_number(row['ctc']),
-                            safe_number(row['extra_hours']),
-                            int(row['late_marks']),
-                            int(row['full_days']),
-                            int(row['half_days']),
-                            safe_number(row['earned_leave_taken']),
-                            safe_number(row['leave_accrued']),
-                            safe_number(row['leave_balance']),
-                            safe_number(row['lop_deduction']),
-                            safe_number(row['leave_encashment']),
-                            safe_number(row['leave_concession']),
-                            safe_number(row['leave_concession_amount']),
-                            row['action_type'],
-                            row['description'],
-                            safe_number(row['lop_days']),
-                            int(row['days_in_month']),
-                            int(row['working_days']),
-                            safe_number(row.get('total_earnings', 0))
-                        )
-
-                        cursor.execute(insert_sql, values)
-                        success_count += 1
-
-                    except Exception as e:
-                        st.error(f"❌ Error inserting row {idx}: {e}")
-                        error_count += 1
-
-                conn.commit()
-                cursor.close()
-                conn.close()
+                rows = salary_log
+                if keys is not None:
+                    keys = {(str(emp_id), str(month)) for emp_id, month in keys}
+                    row_keys = zip(rows["employee_id"].astype(str), rows["salary_month"].astype(str))
+                    rows = rows[[key in keys for key in row_keys]]
+                # One row per employee and month; the last one wins
+                rows = rows.loc[~rows.duplicated(["employee_id", "salary_month"], keep="last")]
 
-                if success_count > 0:
-                    st.success(f"✅ SQL: Inserted {success_count} rows")
-                if error_count > 0:
-                    st.warning(f"⚠️ SQL: {error_count} errors occurred")
+                success_count, failures = write_salary_rows_sql(conn, rows)
+            bump_table_version(SALARY_LOG_TABLE)
 
-            except Exception as e:
-                st.error(f"Error saving to SQL: {str(e)}")
-                if conn:
-                    conn.close()
+            forget_cached_payslips(keys)
+
+            for label, e in failures:
+                st.error(f"❌ Error inserting {label}: {e}")
+            if success_count > 0:
+                st.success(f"✅ SQL: Inserted {success_count} rows")
+            if failures:
+                st.warning(f"⚠️ SQL: {len(failures)} errors occurred")
+
+        except Exception as e:
+            st.error(f"Error saving to SQL: {str(e)}")
     else:
         # CSV fallback
         try:
             os.makedirs(os.path.dirname(SALARY_LOG_CSV), exist_ok=True)
             salary_log.to_csv(SALARY_LOG_CSV, index=False)
+            bump_table_version(SALARY_LOG_TABLE)
+            forget_cached_payslips(keys)
             st.success("✅ CSV: Saved to file")
         except Exception as e:
             st.error(f"Error saving to CSV: {str(e)}")
 # -------------------- CALENDAR UTILITY FUNCTIONS --------------------
 def get_month_info(year, month):
     """Get comprehensive month information including working days."""
-    # Get total days in month
-    days_in_month = calendar.monthrange(year, month)[1]
-
-    # Create date range for the month
-    month_start = datetime.date(year, month, 1)
-    month_end = datetime.date(year, month, days_in_month)
-
-    # Count working days (excluding Tuesdays as per your business logic)
-    working_days = 0
-    current_date = month_start
-    while current_date <= month_end:
-        if current_date.weekday() != 1:  # Skip Tuesdays (1 = Tuesday)
-            working_days += 1
-        current_date += datetime.timedelta(days=1)
-
-    return {
-        'days_in_month': days_in_month,
-        'working_days': working_days,
-        'month_start': month_start,
-        'month_end': month_end
-    }
+    # Working days exclude Tuesdays as per business logic (see work_calendar.py)
+    return work_calendar.month_info(year, month)
 
 
 def get_month_display_info(year, month):
@@ -508,11 +418,11 @@ def get_month_display_info(year, month):
 # -------------------- SALARY CALCULATION FUNCTIONS --------------------
 def calculate_salary_components(monthly_salary):
     """Calculate detailed salary components based on gross salary."""
-    # Standard breakdown percentages (can be customized)
-    basic_percentage = 0.60              #0.60  # 60% of gross
-    da_percentage = 0.21              #0.21  # 21% of gross
-    hra_percentage = 0.10             #0.10  # 10% of gross
-    performance_percentage = 0.09     #0.09  # 9% of gross
+    # Standard breakdown percentages (payroll_engine.PAYROLL_PARAMETERS)
+    basic_percentage = PAYROLL_PARAMETERS["basic_percentage"]              # 60% of gross
+    da_percentage = PAYROLL_PARAMETERS["da_percentage"]                    # 21% of gross
+    hra_percentage = PAYROLL_PARAMETERS["hra_percentage"]                  # 10% of gross
+    performance_percentage = PAYROLL_PARAMETERS["performance_percentage"]  # 9% of gross
 
     basic_salary = monthly_salary * basic_percentage
     da = monthly_salary * da_percentage
@@ -553,27 +463,29 @@ def calculate_salary_components(monthly_salary):
 def calculate_statutory_deductions(gross_earnings, basic_salary, da):
     """Calculate PF, ESI, MLWF and other statutory deductions."""
 
+    rules = PAYROLL_PARAMETERS
+
     # PF Calculation (12% on basic + da, max limit 15000)
-    pf_eligible_amount = min(basic_salary + da, 15000)  # PF ceiling on Basic + DA
-    employee_pf = pf_eligible_amount * 0.12
-    employer_pf = pf_eligible_amount * 0.12
+    pf_eligible_amount = min(basic_salary + da, rules["pf_ceiling"])  # PF ceiling on Basic + DA
+    employee_pf = pf_eligible_amount * rules["pf_rate"]
+    employer_pf = pf_eligible_amount * rules["pf_rate"]
 
     # PF Admin charges (typically 0.65% of PF eligible amount)
-    pf_admin_charges = pf_eligible_amount * 0.0065
+    pf_admin_charges = pf_eligible_amount * rules["pf_admin_rate"]
 
     # ESI Calculation (0.75% employee, 3.25% employer on amounts <= 21000)
-    esi_ceiling = 21000
+    esi_ceiling = rules["esi_ceiling"]
     employee_esi = 0
     employer_esi = 0
 
     if gross_earnings <= esi_ceiling:
-        employee_esi = gross_earnings * 0.0075  # 0.75%
-        employer_esi = gross_earnings * 0.0325  # 3.25%
+        employee_esi = gross_earnings * rules["esi_employee_rate"]  # 0.75%
+        employer_esi = gross_earnings * rules["esi_employer_rate"]  # 3.25%
 
     # MLWF (Maharashtra Labour Welfare Fund)
     # Employee: Re 1 if salary > 3000, Employer: Re 1 if salary > 3000
-    mlwf_employee = 1 if gross_earnings > 3000 else 0
-    mlwf_employer = 1 if gross_earnings > 3000 else 0
+    mlwf_employee = 1 if gross_earnings > rules["mlwf_threshold"] else 0
+    mlwf_employer = 1 if gross_earnings > rules["mlwf_threshold"] else 0
 
     return {
         'employee_pf': employee_pf,
@@ -598,13 +510,7 @@ def calculate_lop_days_corrected_v2(emp_id, attendance, month_start, month_end):
     """
 
     # Get all working days (excluding Tuesdays as per business logic)
-    all_working_days = []
-    current_date = month_start
-
-    while current_date <= month_end:
-        if current_date.weekday() != 1:  # Skip Tuesdays (1 = Tuesday)
-            all_working_days.append(current_date)
-        current_date += datetime.timedelta(days=1)
+    all_working_days = work_calendar.working_dates(month_start, month_end)
 
     total_working_days = len(all_working_days)
 
@@ -761,7 +667,7 @@ def build_salary_row_monthly_corrected_lop(emp_row, attendance, selected_date):
     lop_days = calculate_lop_days_corrected_v2(emp_id, attendance, month_info['month_start'], month_info['month_end'])
 
     # Leave concession (monthly accrual)
-    monthly_accrual = 1.2
+    monthly_accrual = PAYROLL_PARAMETERS["monthly_leave_accrual"]
     leave_concession = min(lop_days, monthly_accrual)
 
     # LOP days after concession
@@ -796,7 +702,7 @@ def build_salary_row_monthly_corrected_lop(emp_row, attendance, selected_date):
     )
 
     # Tax calculation (5% of total earnings)
-    tax_deduction = total_earnings * 0.05
+    tax_deduction = total_earnings * PAYROLL_PARAMETERS["tax_rate"]
 
     # Additional deductions
     advance_deduction = 0
@@ -925,12 +831,7 @@ def debug_lop_calculation(emp_id, attendance, month_start, month_end, monthly_sa
     st.write("🔍 **STEP-BY-STEP LOP DEBUG:**")
 
     # Step 1: Working days
-    working_days = []
-    current_date = month_start
-    while current_date <= month_end:
-        if current_date.weekday() != 1:  # Not Tuesday
-            working_days.append(current_date)
-        current_date += datetime.timedelta(days=1)
+    working_days = work_calendar.working_dates(month_start, month_end)
 
     st.write(f"**Step 1:** Total working days = {len(working_days)}")
 
@@ -1245,48 +1146,57 @@ def run_payroll():
             st.warning("⚠️ No employees matched the selection.")
             return
 
-        count = 0
-        new_rows = []
-        debug_data = []
+        month_key = selected_month.strftime("%Y-%m")
+        existing_ids = set()
+        if not salary_log.empty:
+            existing_ids = set(
+                salary_log.loc[salary_log["salary_month"] == month_key, "employee_id"].astype(str)
+            )
 
+        selected_rows = []
         for emp_row in emp_rows:
-            emp_id = emp_row["employee_id"]
-
-            # Check if entry already exists
-            already_exists = False
-            if not salary_log.empty:
-                already_exists = (
-                        (salary_log["employee_id"].astype(str) == str(emp_id)) &
-                        (salary_log["salary_month"] == selected_month.strftime("%Y-%m"))
-                ).any()
-
-            if override and already_exists:
-                # Remove existing entry
-                salary_log = salary_log[~(
-                        (salary_log["employee_id"].astype(str) == str(emp_id)) &
-                        (salary_log["salary_month"] == selected_month.strftime("%Y-%m"))
-                )]
-            elif not override and already_exists:
+            if str(emp_row["employee_id"]) in existing_ids and not override:
                 st.info(f"⏭️ Skipping {emp_row['employee_name']} - entry already exists")
                 continue
-
-            # CORRECTED: Use the correct function name
-            new_row = build_salary_row_monthly_corrected_lop(emp_row, attendance, selected_month)
-            if new_row:
-                new_rows.append(new_row)
-                count += 1
-                debug_data.append({
-                    "Employee": emp_row["employee_name"],
-                    "Fixed Salary": new_row["fixed_salary"],
-                    "Gross Earnings": new_row["gross_earnings"],
-                    "LOP Deduction": new_row["lop_deduction"],
-                    "Total Earnings": new_row.get("total_earnings", 0),
-                    "Total Deductions": new_row["total_deductions"],
-                    "Net Salary": new_row["net_salary"],
-                    "CTC": new_row["ctc"],
-                    "LOP Days": new_row["lop_days"],
-                    "Leave Concession": new_row["leave_concession"],
-                })
+            selected_rows.append(emp_row)
+
+        if override and existing_ids:
+            # Remove existing entries that are about to be recalculated
+            replaced_ids = {str(emp_row["employee_id"]) for emp_row in selected_rows} & existing_ids
+            salary_log = salary_log[~(
+                    salary_log["employee_id"].astype(str).isin(replaced_ids) &
+                    (salary_log["salary_month"] == month_key)
+            )]
+
+        # Re-read attendance so the rows can be stamped with the version they were computed from
+        attendance, source_version = load_fresh_attendance()
+
+        if run_all:
+            # Whole workforce: one vectorized pass over the month's attendance
+            new_rows = compute_monthly_payroll(
+                pd.DataFrame(selected_rows), attendance, selected_month
+            ).to_dict("records") if selected_rows else []
+        else:
+            # Single employee: per-row calculation, which also shows the LOP breakdown
+            new_rows = [build_salary_row_monthly_corrected_lop(emp_row, attendance, selected_month)
+                        for emp_row in selected_rows]
+
+        for new_row in new_rows:
+            new_row["source_version"] = source_version
+
+        count = len(new_rows)
+        debug_data = [{
+            "Employee": new_row["employee_name"],
+            "Fixed Salary": new_row["fixed_salary"],
+            "Gross Earnings": new_row["gross_earnings"],
+            "LOP Deduction": new_row["lop_deduction"],
+            "Total Earnings": new_row.get("total_earnings", 0),
+            "Total Deductions": new_row["total_deductions"],
+            "Net Salary": new_row["net_salary"],
+            "CTC": new_row["ctc"],
+            "LOP Days": new_row["lop_days"],
+            "Leave Concession": new_row["leave_concession"],
+        } for new_row in new_rows]
 
         if count > 0:
             # Add new rows to salary_log
@@ -1302,7 +1212,7 @@ def run_payroll():
             st.dataframe(salary_log[available_cols].tail(count))
 
             # Save the data
-            save_salary_log(salary_log)
+            save_salary_log(salary_log, keys={(row["employee_id"], row["salary_month"]) for row in new_rows})
             st.success(
                 f"✅ Finalized corrected salary for {count} employee(s) for {display_info['month_name']} {display_info['year']}.")
 
@@ -1357,6 +1267,51 @@ def run_payroll():
         else:
             st.warning("⚠️ No new entries were finalized.")
 
+    # Incremental recompute: only entries whose attendance changed since they were finalized
+    st.subheader("🩹 Recompute Changed Entries")
+    st.caption("Rebuilds finalized salary rows whose attendance was edited afterwards "
+               "(late punches, manual entries, corrections). Other rows are left as they are.")
+    recompute_month_only = st.checkbox(f"Only {selected_month.strftime('%B %Y')}", value=True)
+
+    if st.button("🔄 Recompute Dirty Entries"):
+        months = [selected_month.strftime("%Y-%m")] if recompute_month_only else None
+        try:
+            keys = dirty_keys(salary_log, months=months)
+        except Exception as e:
+            st.error(f"❌ Could not read the attendance change journal: {e}")
+            keys = []
+        else:
+            if not keys:
+                st.success("✅ No attendance changes since the last finalize - nothing to recompute.")
+
+        if keys:
+            st.info(f"🔍 {len(keys)} entr{'y' if len(keys) == 1 else 'ies'} changed since finalize; recomputing...")
+            attendance, source_version = load_fresh_attendance()
+            new_df, diff_report = recompute_entries(master, attendance, salary_log, keys)
+
+            if new_df.empty:
+                st.warning("⚠️ None of the changed entries belong to employees in the master list.")
+            else:
+                new_df["source_version"] = source_version
+                replaced = set(zip(new_df["employee_id"].map(normalize_employee_id), new_df["salary_month"]))
+                old_keys = zip(salary_log["employee_id"].map(normalize_employee_id), salary_log["salary_month"].astype(str))
+                salary_log = salary_log[[key not in replaced for key in old_keys]]
+                salary_log = pd.concat([salary_log, new_df], ignore_index=True)
+
+                save_salary_log(salary_log, keys=set(zip(new_df["employee_id"], new_df["salary_month"])))
+
+                changed = diff_report[diff_report["difference"].fillna(1).abs() >= 0.01]
+                st.success(f"✅ Recomputed {len(new_df)} entr{'y' if len(new_df) == 1 else 'ies'}; "
+                           f"{len(changed)} net salar{'y' if len(changed) == 1 else 'ies'} changed.")
+                st.write("📋 **Net Salary Changes:**")
+                st.dataframe(diff_report.round(2))
+                st.download_button(
+                    label="📥 Download Recompute Report",
+                    data=diff_report.to_csv(index=False),
+                    file_name=f"payroll_recompute_{datetime.date.today().strftime('%Y%m%d')}.csv",
+                    mime="text/csv"
+                )
+
     # Add salary log viewer
     if not salary_log.empty:
         with st.expander("📊 View Existing Salary Log", expanded=False):
@@ -0,0 +1,119 @@
+# payrollsimulator.py
+import streamlit as st
+import pandas as pd
+from datetime import date
+from config import EMPLOYEE_MASTER_TABLE, EMPLOYEE_DATA_TABLE, get_table_version
+from repository import read_table
+from payroll_engine import PAYROLL_PARAMETERS, PayrollSimulator, month_range
+
+# (label, parameter, shown as a percentage?)
+PARAMETER_FIELDS = [
+    ("Basic (% of salary)", "basic_percentage", True),
+    ("DA (% of salary)", "da_percentage", True),
+    ("HRA (% of salary)", "hra_percentage", True),
+    ("Performance allowance (% of salary)", "performance_percentage", True),
+    ("PF rate (employee & employer, %)", "pf_rate", True),
+    ("PF wage ceiling (₹)", "pf_ceiling", False),
+    ("PF admin charges (%)", "pf_admin_rate", True),
+    ("ESI gross ceiling (₹)", "esi_ceiling", False),
+    ("ESI employee rate (%)", "esi_employee_rate", True),
+    ("ESI employer rate (%)", "esi_employer_rate", True),
+    ("MLWF threshold (₹)", "mlwf_threshold", False),
+    ("Tax rate (%)", "tax_rate", True),
+    ("Monthly leave accrual (days)", "monthly_leave_accrual", False),
+]
+
+
+def load_simulator(months):
+    """Build (or reuse) the simulator for these months; rebuilt after attendance/master writes"""
+    master = read_table(EMPLOYEE_MASTER_TABLE)
+    attendance = read_table(EMPLOYEE_DATA_TABLE)
+    cache_key = (tuple(months), len(master), len(attendance),
+                 get_table_version(EMPLOYEE_MASTER_TABLE), get_table_version(EMPLOYEE_DATA_TABLE))
+
+    cached = st.session_state.get("payroll_simulator")
+    if cached is not None and cached[0] == cache_key:
+        return cached[1]
+
+    master["employee_id"] = master["employee_id"].astype(str)
+    attendance["employee_id"] = attendance["employee_id"].astype(str)
+    attendance["date_only"] = pd.to_datetime(attendance["date_only"], errors="coerce")
+    simulator = PayrollSimulator(master, attendance, months)
+    st.session_state["payroll_simulator"] = (cache_key, simulator)
+    return simulator
+
+
+def run_payrollsimulator():
+    st.title("🧪 Payroll What-If Simulator")
+    st.markdown("Change salary rules and see how payroll cost moves, by department. Nothing is saved.")
+
+    # ---------------- Month Range ----------------
+    today = date.today().replace(day=1)
+    col1, col2 = st.columns(2)
+    with col1:
+        start_month = st.date_input("📆 From month", (pd.Timestamp(today) - pd.DateOffset(months=2)).date())
+    with col2:
+        end_month = st.date_input("📆 To month", today)
+    if start_month > end_month:
+        st.error("❌ 'From month' must be before 'To month'.")
+        return
+    months = month_range(start_month, end_month)
+
+    try:
+        with st.spinner("Preparing attendance summaries..."):
+            simulator = load_simulator(months)
+    except Exception as e:
+        st.error(f"❌ Could not load employee master or attendance data: {e}")
+        return
+    st.caption(f"👥 {len(simulator.monthly_salary)} employees · 📅 {', '.join(months)}")
+
+    # ---------------- Scenario ----------------
+    st.subheader("⚙️ Scenario")
+    overrides = {}
+    columns = st.columns(3)
+    for i, (label, name, is_percent) in enumerate(PARAMETER_FIELDS):
+        current = PAYROLL_PARAMETERS[name]
+        with columns[i % 3]:
+            if is_percent:
+                value = st.number_input(label, value=round(current * 100, 4), step=0.25, format="%.2f", key=f"sim_{name}")
+                value = value / 100
+            else:
+                value = st.number_input(label, value=float(current), step=0.1 if current < 100 else 500.0, key=f"sim_{name}")
+        if abs(value - current) > 1e-12:
+            overrides[name] = value
+
+    if not overrides:
+        st.info("ℹ️ Change one or more values above to compare against the current rules.")
+        return
+
+    st.write("**Changed:** " + ", ".join(
+        f"{label}: {PAYROLL_PARAMETERS[name]:g} → {overrides[name]:g}"
+        for label, name, _ in PARAMETER_FIELDS if name in overrides
+    ))
+
+    result = simulator.run(overrides)
+    total = result.loc["All departments"]
+
+    # ---------------- Results ----------------
+    st.subheader("📊 Impact")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("CTC", f"₹{total['ctc_scenario']:,.0f}", f"₹{total['ctc_delta']:,.0f}", delta_color="inverse")
+    col2.metric("Net Salary", f"₹{total['net_salary_scenario']:,.0f}", f"₹{total['net_salary_delta']:,.0f}")
+    col3.metric("Employer PF", f"₹{total['employer_pf_scenario']:,.0f}", f"₹{total['employer_pf_delta']:,.0f}",
+                delta_color="inverse")
+    col4.metric("Employer ESI", f"₹{total['employer_esi_scenario']:,.0f}", f"₹{total['employer_esi_delta']:,.0f}",
+                delta_color="inverse")
+
+    delta_columns = ["headcount"] + [f"{col}_delta" for col in PayrollSimulator.TOTAL_COLUMNS]
+    st.write("**Change by department:**")
+    st.dataframe(result[delta_columns].round(2))
+
+    with st.expander("📋 Baseline vs scenario totals"):
+        st.dataframe(result.round(2))
+
+    st.download_button(
+        label="📥 Download Scenario Report",
+        data=result.round(2).to_csv(),
+        file_name=f"payroll_whatif_{months[0]}_{months[-1]}.csv",
+        mime="text/csv"
+    )
@@ -3,7 +3,7 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, time
 from data_utils import get_resignation_data, get_salary_log
-from config import USE_SQL, safe_get_conn, RESIGNATION_LOG_CSV
+from config import USE_SQL, sql_connection, RESIGNATION_LOG_CSV
 from utils.logger import log_admin_action
 
 def run_resignation():
@@ -252,8 +252,7 @@ def run_resignation():
         if st.button("Update Status", key=f"update_{emp_id_to_update}"):
             try:
                 if USE_SQL:
-                    conn = safe_get_conn()
-                    if conn:
+                    with sql_connection() as conn:
                         with conn.cursor() as cur:
                             # Decide system_status based on the chosen status
                             if new_status.lower() == "cancelled":
@@ -0,0 +1,284 @@
+# work_calendar.py
+"""
+Shared working-day calendar, so payroll, payslips and alerts agree on which
+days count.
+
+The table has one entry per day from WORK_CALENDAR_SETTINGS first_year to
+last_year: weekday, weekly-off flag (Tuesday), holiday flag (from
+data/holidays.csv) and a running working-day index. It is built once per
+process as NumPy arrays and rebuilt only when holidays.csv changes or a date
+outside the range is asked for, so month figures are array slices instead of
+a day-by-day loop on every call.
+
+A working day is any day that is not the weekly off. Holidays are flagged
+(is_holiday, month_holidays) but still count as payroll working days, as they
+always have, so a payslip marks a holiday without attendance "A" exactly when
+LOP counts it as absent.
+
+MonthAttendance turns a month of attendance rows into the payslip calendar
+markers of every employee at once (a day x employee int8 matrix).
+
+Print a month from the command line:
+    python work_calendar.py 2025-08
+"""
+import argparse
+import datetime
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from config import WORK_CALENDAR_SETTINGS
+
+OFF_MARKER = "-"  # Payslip calendar marker for the weekly off
+ABSENT_MARKER = "A"  # ... and for working days without attendance
+
+# Payslip calendar markers by code, as stored in MonthAttendance.codes (0 = no record)
+ATTENDANCE_MARKERS = np.array(["", "F", "H", "L", ABSENT_MARKER, OFF_MARKER])
+STATUS_CODES = {"full day": 1, "half day": 2, "late mark": 3}  # Any other status is 4 (A)
+ABSENT_CODE = 4
+OFF_CODE = 5
+
+_calendar = None
+_calendar_key = None
+_calendar_lock = threading.Lock()
+
+
+def _month_start(year, month):
+    return np.datetime64(f"{int(year):04d}-{int(month):02d}", "M").astype("datetime64[D]")
+
+
+def _as_day(day):
+    return np.datetime64(pd.Timestamp(day).date(), "D")
+
+
+class WorkCalendar:
+    """Per-day arrays for every day of [first_year, last_year]"""
+
+    def __init__(self, first_year, last_year, holidays, weekly_off):
+        self.first_year = first_year
+        self.last_year = last_year
+        self.first_day = np.datetime64(f"{first_year:04d}-01-01", "D")
+        self.dates = np.arange(self.first_day, np.datetime64(f"{last_year + 1:04d}-01-01", "D"))
+
+        # Monday = 0, as datetime.weekday(); 1970-01-01 was a Thursday
+        self.weekday = ((self.dates.astype("int64") + 3) % 7).astype(np.int8)
+        self.is_weekly_off = self.weekday == weekly_off
+        holiday_days = np.array(sorted(holidays), dtype="datetime64[D]")
+        self.is_holiday = np.isin(self.dates, holiday_days)
+        self.holiday_names = {day: name for day, name in holidays.items()
+                              if first_year <= day.year <= last_year}
+
+        self.is_working = ~self.is_weekly_off
+        self.is_off = self.is_weekly_off | self.is_holiday
+        # working_index[i] = working days before dates[i]; one extra entry at the end,
+        # so the working days in dates[a:b] are working_index[b] - working_index[a]
+        self.working_index = np.concatenate(([0], np.cumsum(self.is_working, dtype=np.int32)))
+
+    def covers(self, first_year, last_year):
+        return self.first_year <= first_year and last_year <= self.last_year
+
+    def position(self, day):
+        """Index of day (date, Timestamp or "YYYY-MM-DD") in the arrays"""
+        return int((_as_day(day) - self.first_day).astype("int64"))
+
+    def positions(self, dates):
+        """Indexes of many dates (Series or array of datetimes) in the arrays"""
+        days = pd.to_datetime(pd.Series(dates)).to_numpy().astype("datetime64[D]")
+        return (days - self.first_day).astype("int64")
+
+    def span(self, start, end):
+        """Slice of the arrays for start..end, both inclusive"""
+        return slice(self.position(start), self.position(end) + 1)
+
+    def month_span(self, year, month):
+        """Slice of the arrays for every day of the month"""
+        first = _month_start(year, month)
+        following = (first.astype("datetime64[M]") + 1).astype("datetime64[D]")
+        start = int((first - self.first_day).astype("int64"))
+        return slice(start, start + int((following - first).astype("int64")))
+
+    def working_days_between(self, start, end):
+        """Working days in start..end, both inclusive"""
+        days = self.span(start, end)
+        return int(self.working_index[days.stop] - self.working_index[days.start])
+
+    def working_dates(self, start, end):
+        """Working days in start..end as datetime.date objects"""
+        days = self.span(start, end)
+        return self.dates[days][self.is_working[days]].astype(object).tolist()
+
+    def month_info(self, year, month):
+        days = self.month_span(year, month)
+        return {
+            "days_in_month": days.stop - days.start,
+            "working_days": int(self.working_index[days.stop] - self.working_index[days.start]),
+            "month_start": datetime.date(year, month, 1),
+            "month_end": self.dates[days.stop - 1].astype(object),
+        }
+
+    def default_markers(self, year, month):
+        """Payslip calendar marker per day of the month when there is no attendance"""
+        return np.where(self.is_working[self.month_span(year, month)], ABSENT_MARKER, OFF_MARKER)
+
+
+# ==================== LOADING ====================
+
+def _holidays_path():
+    return WORK_CALENDAR_SETTINGS.get("holidays_csv", "data/holidays.csv")
+
+
+def load_holidays(path=None):
+    """{date: holiday_name} from holidays.csv; a missing file means no holidays"""
+    path = path or _holidays_path()
+    if not os.path.exists(path):
+        return {}
+    holidays = pd.read_csv(path, dtype=str, skipinitialspace=True)
+    holidays.columns = holidays.columns.str.strip().str.lower()
+    if "dates" not in holidays.columns:
+        return {}
+    # Rows are hand-edited: tolerate stray tabs/spaces and day-first dates
+    dates = pd.to_datetime(holidays["dates"].str.strip(), errors="coerce", format="mixed", dayfirst=True)
+    names = holidays["holiday_name"].str.strip() if "holiday_name" in holidays.columns else pd.Series("", index=holidays.index)
+    return {day.date(): name for day, name in zip(dates, names.fillna("")) if pd.notna(day)}
+
+
+def get_calendar(first_year=None, last_year=None):
+    """
+    The shared calendar, covering at least first_year..last_year. Rebuilt when
+    holidays.csv changes or a wider range is needed; otherwise reused as is.
+    """
+    global _calendar, _calendar_key
+    path = _holidays_path()
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    wanted_first = min(first_year or WORK_CALENDAR_SETTINGS["first_year"], WORK_CALENDAR_SETTINGS["first_year"])
+    wanted_last = max(last_year or WORK_CALENDAR_SETTINGS["last_year"], WORK_CALENDAR_SETTINGS["last_year"])
+
+    with _calendar_lock:
+        if _calendar is not None and _calendar_key == (path, mtime) and _calendar.covers(wanted_first, wanted_last):
+            return _calendar
+        if _calendar is not None and _calendar_key == (path, mtime):
+            # Keep whatever range was already requested
+            wanted_first = min(wanted_first, _calendar.first_year)
+            wanted_last = max(wanted_last, _calendar.last_year)
+        _calendar = WorkCalendar(
+            wanted_first, wanted_last, load_holidays(path), WORK_CALENDAR_SETTINGS.get("weekly_off", 1)
+        )
+        _calendar_key = (path, mtime)
+        return _calendar
+
+
+def _calendar_for(*days):
+    years = [pd.Timestamp(day).year for day in days]
+    return get_calendar(min(years), max(years))
+
+
+# ==================== LOOKUPS ====================
+
+def month_info(year, month):
+    """days_in_month, working_days, month_start and month_end for a month"""
+    return get_calendar(year, year).month_info(year, month)
+
+
+def working_days_in_month(year, month):
+    return month_info(year, month)["working_days"]
+
+
+def working_days_between(start, end):
+    """Working days in start..end, both inclusive"""
+    return _calendar_for(start, end).working_days_between(start, end)
+
+
+def working_dates(start, end):
+    """Working days in start..end (both inclusive) as datetime.date objects"""
+    return _calendar_for(start, end).working_dates(start, end)
+
+
+def weekly_off_mask(dates):
+    """Boolean array: which of these dates (no NaT) fall on the weekly off"""
+    dates = pd.to_datetime(pd.Series(dates))
+    if dates.empty:
+        return np.zeros(0, dtype=bool)
+    work_calendar = _calendar_for(dates.min(), dates.max())
+    return work_calendar.is_weekly_off[work_calendar.positions(dates)]
+
+
+def is_off_day(day):
+    """True on the weekly off and on holidays"""
+    work_calendar = _calendar_for(day)
+    return bool(work_calendar.is_off[work_calendar.position(day)])
+
+
+def default_markers(year, month):
+    """Payslip calendar marker per day of the month ("-" weekly off, "A" otherwise)"""
+    return get_calendar(year, year).default_markers(year, month)
+
+
+def month_holidays(year, month):
+    """{date: holiday_name} for holidays in the month"""
+    return {day: name for day, name in get_calendar(year, year).holiday_names.items()
+            if day.year == year and day.month == month}
+
+
+# ==================== PAYSLIP ATTENDANCE ====================
+
+class MonthAttendance:
+    """
+    Payslip calendar markers of a month for many employees, built in one pass.
+
+    codes is an int8 matrix with one row per employee (employee_ids) and one
+    column per day: the employee's status on that day, the last record winning
+    when a day has several, or the calendar default (weekly off / absent) for
+    days without a record. Employees with no records get the default row.
+    """
+
+    def __init__(self, attendance, year, month):
+        self.year = year
+        self.month = month
+        default_row = np.where(default_markers(year, month) == OFF_MARKER, OFF_CODE, ABSENT_CODE).astype(np.int8)
+        self.default_row = default_row
+
+        daily = pd.DataFrame({"employee_id": [], "day": np.array([], dtype=int), "code": np.array([], dtype=np.int8)})
+        if not attendance.empty:
+            first = pd.Timestamp(year=year, month=month, day=1)
+            dates = pd.to_datetime(attendance["date_only"], errors="coerce")
+            in_month = ((dates >= first) & (dates < first + pd.offsets.MonthBegin(1))).to_numpy()
+            status = attendance["attendance_status"][in_month].fillna("absent").astype(str).str.lower().str.strip()
+            daily = pd.DataFrame({
+                "employee_id": attendance["employee_id"].to_numpy()[in_month],
+                "day": dates[in_month].dt.day.to_numpy() - 1,
+                "code": status.map(STATUS_CODES).fillna(ABSENT_CODE).astype(np.int8).to_numpy(),
+            }).drop_duplicates(["employee_id", "day"], keep="last")
+
+        employee_codes, self.employee_ids = pd.factorize(daily["employee_id"])
+        self.codes = np.tile(default_row, (len(self.employee_ids), 1))
+        self.codes[employee_codes, daily["day"].to_numpy()] = daily["code"].to_numpy()
+        self._rows = {employee_id: i for i, employee_id in enumerate(self.employee_ids)}
+
+    def row(self, employee_id):
+        """int8 codes of one employee, one per day of the month"""
+        i = self._rows.get(employee_id)
+        return self.default_row if i is None else self.codes[i]
+
+    def markers(self, employee_id):
+        """{day: marker} for the payslip calendar, e.g. {1: "-", 2: "F", ...}"""
+        return dict(enumerate(ATTENDANCE_MARKERS[self.row(employee_id)].tolist(), start=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show working days and holidays for a month")
+    parser.add_argument("month", help="Month to show, YYYY-MM")
+    args = parser.parse_args()
+
+    year, month = (int(part) for part in args.month.split("-"))
+    info = month_info(year, month)
+    print(f"{args.month}: {info['days_in_month']} days, {info['working_days']} working days")
+    for day, name in sorted(month_holidays(year, month).items()):
+        print(f"  holiday {day}  {name}")
+    markers = default_markers(year, month)
+    print("  off days: " + ", ".join(str(day + 1) for day in np.flatnonzero(markers == OFF_MARKER)))
+
+
+if __name__ == "__main__":
+    main()